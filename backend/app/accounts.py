@@ -0,0 +1,132 @@
+# backend/app/accounts.py
+#
+# Login upsert in one statement / one transaction. Kept out of auth.py so it
+# can be driven without Firebase (see benchmarks/bench_login.py).
+from typing import NamedTuple, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from . import versions, identity
+
+
+class LoginResult(NamedTuple):
+    user_id: int
+    role: Optional[str]
+    patient_id: Optional[int]
+
+
+# Resolve firebase_uid -> email -> phone, update changed identifiers (never
+# overwriting an existing role), insert if nothing matched, and optionally
+# ensure the patients row. Reports the previous role so the caller can
+# enforce role mismatch and roll back.
+_UPSERT_SQL = text("""
+    WITH found AS (
+        SELECT id, email, phone, firebase_uid, role
+        FROM (
+            SELECT u.id, u.email, u.phone, u.firebase_uid, u.role, 1 AS pref
+            FROM users u WHERE u.firebase_uid = :uid
+            UNION ALL
+            SELECT u.id, u.email, u.phone, u.firebase_uid, u.role, 2
+            FROM users u WHERE u.email = :email
+            UNION ALL
+            SELECT u.id, u.email, u.phone, u.firebase_uid, u.role, 3
+            FROM users u WHERE u.phone = :phone
+        ) c
+        ORDER BY pref
+        LIMIT 1
+    ),
+    mismatch AS (
+        SELECT EXISTS (
+            SELECT 1 FROM found
+            WHERE role IS NOT NULL
+              AND CAST(:role AS user_role_enum) IS NOT NULL
+              AND role <> CAST(:role AS user_role_enum)
+        ) AS v
+    ),
+    upd AS (
+        UPDATE users u
+        SET firebase_uid = COALESCE(:uid, u.firebase_uid),
+            email        = COALESCE(:email, u.email),
+            phone        = COALESCE(:phone, u.phone),
+            role         = COALESCE(u.role, CAST(:role AS user_role_enum))
+        FROM found
+        WHERE u.id = found.id
+          AND NOT (SELECT v FROM mismatch)
+          AND (u.firebase_uid IS DISTINCT FROM COALESCE(:uid, u.firebase_uid)
+            OR u.email IS DISTINCT FROM COALESCE(:email, u.email)
+            OR u.phone IS DISTINCT FROM COALESCE(:phone, u.phone)
+            OR (u.role IS NULL AND CAST(:role AS user_role_enum) IS NOT NULL))
+        RETURNING u.id, u.role
+    ),
+    ins AS (
+        INSERT INTO users (email, phone, full_name, firebase_uid, role)
+        SELECT :email, :phone, :name, :uid, CAST(:role AS user_role_enum)
+        WHERE NOT EXISTS (SELECT 1 FROM found)
+        ON CONFLICT DO NOTHING
+        RETURNING id, role
+    ),
+    acct AS (
+        SELECT id, role, TRUE AS changed FROM upd
+        UNION ALL
+        SELECT id, role, TRUE FROM ins
+        UNION ALL
+        SELECT id, role, FALSE FROM found WHERE NOT EXISTS (SELECT 1 FROM upd)
+    ),
+    pat AS (
+        INSERT INTO patients (user_id)
+        SELECT id FROM acct
+        WHERE CAST(:ensure AS BOOLEAN) AND role = 'patient'
+        ON CONFLICT (user_id) DO NOTHING
+        RETURNING id
+    )
+    SELECT a.id,
+           a.role::text AS role,
+           a.changed OR EXISTS (SELECT 1 FROM pat) AS changed,
+           (SELECT v FROM mismatch) AS mismatch,
+           f.role::text AS existing_role,
+           COALESCE((SELECT id FROM pat),
+                    (SELECT p.id FROM patients p WHERE p.user_id = a.id)) AS patient_id
+    FROM acct a
+    LEFT JOIN found f ON f.id = a.id
+""")
+
+
+def upsert_login(db: Session, *, uid: Optional[str], email: Optional[str],
+                 phone: Optional[str], name: Optional[str], role: Optional[str],
+                 ensure_patient: bool = False) -> LoginResult:
+    """
+    Resolve in this order: firebase_uid -> email -> phone.
+    Create/update as needed, enforce role mismatch, optionally ensure the
+    patients row. One round trip and one commit on the common path.
+    """
+    params = {"uid": uid, "email": email, "phone": phone, "name": name,
+              "role": role, "ensure": bool(ensure_patient)}
+    row = db.execute(_UPSERT_SQL, params).mappings().first()
+    if row is None:
+        # Lost an insert race on a unique key: the retry sees the winner's row
+        db.rollback()
+        row = db.execute(_UPSERT_SQL, params).mappings().first()
+        if row is None:
+            db.rollback()
+            raise HTTPException(status_code=409, detail="Account is being created concurrently; retry.")
+
+    if row["mismatch"]:
+        db.rollback()
+        raise HTTPException(
+            status_code=409,
+            detail=f"Role mismatch: your account is '{row['existing_role']}', not '{role}'.",
+        )
+
+    if row["changed"]:
+        versions.bump_profile_for_user(db, row["id"])
+        # user_id sweeps the old email/uid entries; the new ones may be cached as misses
+        identity.invalidate(db, user_id=row["id"], email=email, uid=uid)
+    db.commit()
+
+    return LoginResult(
+        user_id=row["id"],
+        role=row["role"],
+        patient_id=row["patient_id"] if ensure_patient and row["role"] == "patient" else None,
+    )
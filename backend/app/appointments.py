@@ -7,6 +7,7 @@ from sqlalchemy import text
 from datetime import datetime, timedelta, timezone
 
 from .db import get_db
+from . import cohort, versions, slots
 
 router = APIRouter(prefix="/appointments", tags=["appointments"])
 
@@ -24,7 +25,7 @@ class AppointmentOut(BaseModel):
 
 class RescheduleBody(BaseModel):
     appointment_id: int = Field(..., gt=0)
-    new_date: datetime
+    new_date: Optional[datetime] = None   # None: least-loaded day within ±7 days
 
 class ConfirmBody(BaseModel):
     appointment_id: int = Field(..., gt=0)
@@ -44,24 +45,33 @@ def to_aware(dt: datetime) -> datetime:
 def schedule_next_anc(body: ScheduleBody, db: Session = Depends(get_db)):
     # Check patient exists
     patient = db.execute(
-        text("SELECT id FROM users WHERE id = :pid AND role = 'patient'"),
+        text("""
+            SELECT u.id, p.facility_id
+            FROM users u LEFT JOIN patients p ON p.user_id = u.id
+            WHERE u.id = :pid AND u.role = 'patient'
+        """),
         {"pid": body.patient_id}
     ).first()
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
 
-    last_dt = to_aware(body.last_visit_date)
-    next_dt = last_dt + timedelta(weeks=body.interval_weeks)
+    # Least-loaded clinic day within a week either side of the target interval
+    target = (to_aware(body.last_visit_date) + timedelta(weeks=body.interval_weeks)).date()
+    slot = slots.allocate(db, target - timedelta(days=7), target + timedelta(days=7),
+                          preferred=target, facility_id=patient.facility_id)
 
     # Create appointment
     row = db.execute(
         text("""
-            INSERT INTO appointments (patient_id, scheduled_for, status)
-            VALUES (:pid, :scheduled_for, 'scheduled')
+            INSERT INTO appointments (patient_id, scheduled_for, status, facility_id, slot_index)
+            VALUES (:pid, :scheduled_for, 'scheduled', :fid, :slot)
             RETURNING id, patient_id, scheduled_for, status
         """),
-        {"pid": body.patient_id, "scheduled_for": next_dt}
+        {"pid": body.patient_id, "scheduled_for": to_aware(slot.starts_at),
+         "fid": slot.facility_id, "slot": slot.slot_index}
     ).first()
+    cohort.on_appointment_change(db, None, None, cohort.appointment_day(row.scheduled_for), row.status)
+    versions.bump(db, (versions.PROFILE, row.patient_id), versions.appointments(slot.facility_id))
     db.commit()
 
     return AppointmentOut(
@@ -92,18 +102,30 @@ def get_next_appointment(patient_id: int, db: Session = Depends(get_db)):
 
 @router.post("/confirm", response_model=AppointmentOut)
 def confirm_attendance(body: ConfirmBody, db: Session = Depends(get_db)):
-    # Update to confirmed
+    # Update to confirmed (old values feed the cohort counters)
     row = db.execute(
         text("""
-            UPDATE appointments
+            UPDATE appointments a
             SET status='confirmed', updated_at=NOW()
-            WHERE id = :aid
-            RETURNING id, patient_id, scheduled_for, status
+            FROM (
+                SELECT id, status, scheduled_for
+                FROM appointments
+                WHERE id = :aid
+                FOR UPDATE
+            ) old
+            WHERE a.id = old.id
+            RETURNING a.id, a.patient_id, a.scheduled_for, a.status, a.facility_id,
+                      old.status AS prev_status, old.scheduled_for AS prev_scheduled_for
         """),
         {"aid": body.appointment_id}
     ).first()
     if not row:
         raise HTTPException(status_code=404, detail="Appointment not found")
+    cohort.on_appointment_change(
+        db, cohort.appointment_day(row.prev_scheduled_for), row.prev_status,
+        cohort.appointment_day(row.scheduled_for), row.status
+    )
+    versions.bump(db, (versions.PROFILE, row.patient_id), versions.appointments(row.facility_id))
     db.commit()
     return AppointmentOut(
         id=row.id, patient_id=row.patient_id,
@@ -113,31 +135,52 @@ def confirm_attendance(body: ConfirmBody, db: Session = Depends(get_db)):
 @router.post("/reschedule", response_model=AppointmentOut)
 def reschedule_appointment(body: RescheduleBody, db: Session = Depends(get_db)):
     appt = db.execute(
-        text("SELECT id, scheduled_for FROM appointments WHERE id = :aid"),
+        text("""
+            SELECT id, scheduled_for, status, facility_id, slot_index
+            FROM appointments WHERE id = :aid FOR UPDATE
+        """),
         {"aid": body.appointment_id}
     ).first()
     if not appt:
         raise HTTPException(status_code=404, detail="Appointment not found")
 
     old_dt = to_aware(appt.scheduled_for)
-    new_dt = to_aware(body.new_date)
-    delta_days = abs((new_dt - old_dt).days)
-
-    if delta_days > MAX_RESCHEDULE_DAYS:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Reschedule limited to ±{MAX_RESCHEDULE_DAYS} days to reduce missed ANC visits"
-        )
+    old_day = cohort.appointment_day(appt.scheduled_for)
+    if body.new_date is not None:
+        new_dt = to_aware(body.new_date)
+        delta_days = abs((new_dt - old_dt).days)
+
+        if delta_days > MAX_RESCHEDULE_DAYS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Reschedule limited to ±{MAX_RESCHEDULE_DAYS} days to reduce missed ANC visits"
+            )
+        lo = hi = new_dt.date()
+    else:
+        lo = max(old_day - timedelta(days=MAX_RESCHEDULE_DAYS), datetime.now(timezone.utc).date())
+        hi = old_day + timedelta(days=MAX_RESCHEDULE_DAYS)
+
+    # Free the old slot first so its day is a candidate again
+    slots.release(db, appt.facility_id, old_day, appt.slot_index)
+    slot = slots.allocate(db, lo, hi, preferred=old_day, facility_id=appt.facility_id)
 
     row = db.execute(
         text("""
             UPDATE appointments
-            SET scheduled_for = :new_dt, status='rescheduled', updated_at=NOW()
+            SET scheduled_for = :new_dt, status='rescheduled', updated_at=NOW(),
+                facility_id = :fid, slot_index = :slot, reminder_sent_at = NULL
             WHERE id = :aid
             RETURNING id, patient_id, scheduled_for, status
         """),
-        {"new_dt": new_dt, "aid": body.appointment_id}
+        {"new_dt": to_aware(slot.starts_at), "aid": body.appointment_id,
+         "fid": slot.facility_id, "slot": slot.slot_index}
     ).first()
+    cohort.on_appointment_change(
+        db, cohort.appointment_day(appt.scheduled_for), appt.status,
+        cohort.appointment_day(row.scheduled_for), row.status
+    )
+    versions.bump(db, (versions.PROFILE, row.patient_id), versions.appointments(appt.facility_id),
+                  versions.appointments(slot.facility_id))
     db.commit()
 
     return AppointmentOut(
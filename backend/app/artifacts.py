@@ -0,0 +1,193 @@
+# backend/app/artifacts.py
+#
+# Memory-mapped model artifacts.
+#
+# A pickled TabNet model is unpickled separately by every worker, so N
+# workers hold N private copies of the same read-only weights. The mmap
+# format splits it up:
+#   ml_model/mmap/manifest.json        tensor/array names, dtypes, shapes
+#   ml_model/mmap/skeleton.joblib      the model object with empty tensors
+#   ml_model/mmap/tensors/<name>.npy   one raw array per weight/buffer
+# load_model() unpickles the small skeleton and points every weight at
+# np.load(mmap_mode="r") through torch.from_numpy, so the weights live in
+# the page cache once per node and each worker only maps them. The
+# skeleton is exported without the optimizer and training callbacks (which
+# hold their own copies of the weights), and export fails if it isn't small.
+#
+# Build it from the existing pickle:
+#     python -m app.artifacts --export --reference ../ml_model/X_train.csv
+# (--reference only records the training medians in the manifest.)
+# With MODEL_PRELOAD=1 each worker reads the mapped pages in at load time
+# instead of on first use; after the first worker they come from the page
+# cache. Don't start gunicorn with --preload: modules open pooled database
+# connections at import, and forked workers must not share them.
+import argparse
+import json
+import os
+import warnings
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+import joblib
+import numpy as np
+
+MODEL_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "ml_model"))
+MMAP_DIR = os.getenv("MODEL_MMAP_DIR", os.path.join(MODEL_DIR, "mmap"))
+PRELOAD = os.getenv("MODEL_PRELOAD", "0").lower() in ("1", "true", "yes")
+MANIFEST = "manifest.json"
+FORMAT_VERSION = 1
+_PAGE = 4096
+# Training-only state of a fitted TabNet estimator: the optimizer (Adam
+# moments per weight) and the callbacks (early stopping's best_weights)
+_TRAINING_ATTRS = ("_optimizer", "_callback_container")
+# skeleton.joblib may be at most this, or a quarter of the weights if larger
+SKELETON_MAX_BYTES = 256 * 1024
+
+_mapped: Dict[str, int] = {}  # file -> bytes mapped by this process
+
+# ---------- Memory ----------
+def rss() -> Dict[str, int]:
+    """Resident set of this process in kB (Linux /proc; {} elsewhere).
+    rss_file is mostly shared page cache (the mapped weights); rss_anon is private."""
+    keys = {"VmRSS": "rss", "RssAnon": "rss_anon", "RssFile": "rss_file", "RssShmem": "rss_shmem"}
+    out = {}
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                name, _, value = line.partition(":")
+                if name in keys:
+                    out[keys[name] + "_kb"] = int(value.split()[0])
+    except OSError:
+        pass
+    return out
+
+def mapped() -> dict:
+    return {"files": len(_mapped), "bytes": sum(_mapped.values()), "preload": PRELOAD}
+
+# ---------- Export ----------
+def _slot(net, name: str):
+    """(module, attribute, is_parameter) for a state_dict key."""
+    prefix, _, attr = name.rpartition(".")
+    module = net.get_submodule(prefix) if prefix else net
+    return module, attr, attr in module._parameters
+
+def _assign(net, name: str, tensor):
+    import torch
+    module, attr, is_param = _slot(net, name)
+    if is_param:
+        module._parameters[attr] = torch.nn.Parameter(tensor, requires_grad=False)
+    else:
+        module._buffers[attr] = tensor
+
+def export(model, out_dir: str = MMAP_DIR, reference_csv: Optional[str] = None) -> dict:
+    """Write model (a fitted TabNet estimator) in mmap format, with the training
+    feature medians from reference_csv if given."""
+    import torch
+    net = model.network
+    os.makedirs(os.path.join(out_dir, "tensors"), exist_ok=True)
+    # The manifest goes last: until then (or after a failed export) nothing loads from out_dir
+    if os.path.isfile(os.path.join(out_dir, MANIFEST)):
+        os.remove(os.path.join(out_dir, MANIFEST))
+
+    state = {k: v.detach().cpu() for k, v in net.state_dict().items()}
+    tensors = {}
+    for name, t in state.items():
+        arr = np.ascontiguousarray(t.numpy())
+        rel = os.path.join("tensors", name + ".npy")
+        np.save(os.path.join(out_dir, rel), arr)
+        tensors[name] = {"file": rel, "dtype": str(arr.dtype), "shape": list(arr.shape)}
+
+    # Pickle the estimator with empty tensors and no training state, then put everything back
+    skeleton = os.path.join(out_dir, "skeleton.joblib")
+    training = {a: getattr(model, a) for a in _TRAINING_ATTRS if hasattr(model, a)}
+    try:
+        for a in training:
+            setattr(model, a, None)
+        for name, t in state.items():
+            _assign(net, name, torch.empty(0, dtype=t.dtype))
+        joblib.dump(model, skeleton)
+    finally:
+        for name, t in state.items():
+            _assign(net, name, t)
+        for a, v in training.items():
+            setattr(model, a, v)
+
+    skeleton_bytes = os.path.getsize(skeleton)
+    tensor_bytes = sum(int(t.numel()) * t.element_size() for t in state.values())
+    if skeleton_bytes > max(SKELETON_MAX_BYTES, tensor_bytes // 4):
+        raise RuntimeError(f"skeleton.joblib is {skeleton_bytes} bytes for {tensor_bytes} bytes of "
+                           "weights; the estimator still holds copies of them")
+
+    manifest = {"format": FORMAT_VERSION, "skeleton": "skeleton.joblib",
+                "skeleton_bytes": skeleton_bytes, "tensor_bytes": tensor_bytes,
+                "tensors": tensors, "stats": {}, "created_at": datetime.now(timezone.utc).isoformat()}
+
+    if reference_csv:
+        import pandas as pd
+        df = pd.read_csv(reference_csv).apply(pd.to_numeric, errors="coerce")
+        x = df.to_numpy(dtype=np.float32)
+        manifest["stats"]["medians"] = {c: float(v) for c, v in zip(df.columns, np.nanmedian(x, axis=0))}
+
+    with open(os.path.join(out_dir, MANIFEST), "w") as fh:
+        json.dump(manifest, fh, indent=1)
+    return manifest
+
+# ---------- Load ----------
+def available(mmap_dir: str = MMAP_DIR) -> bool:
+    return os.path.isfile(os.path.join(mmap_dir, MANIFEST))
+
+def manifest(mmap_dir: str = MMAP_DIR) -> dict:
+    with open(os.path.join(mmap_dir, MANIFEST)) as fh:
+        m = json.load(fh)
+    if m.get("format") != FORMAT_VERSION:
+        raise RuntimeError(f"Unsupported artifact format {m.get('format')} in {mmap_dir}")
+    return m
+
+def _touch(arr: np.ndarray):
+    # Read one byte per page so inference never waits on a page fault
+    if arr.nbytes:
+        int(arr.reshape(-1).view(np.uint8)[::_PAGE].sum())
+
+def _map(mmap_dir: str, rel: str, meta: dict) -> np.ndarray:
+    path = os.path.join(mmap_dir, rel)
+    arr = np.load(path, mmap_mode="r")
+    if list(arr.shape) != meta["shape"] or str(arr.dtype) != meta["dtype"]:
+        raise RuntimeError(f"{rel}: expected {meta['dtype']}{meta['shape']}, found {arr.dtype}{list(arr.shape)}")
+    if PRELOAD:
+        _touch(arr)
+    _mapped[path] = arr.nbytes
+    return arr
+
+def load_model(mmap_dir: str = MMAP_DIR):
+    """The estimator from skeleton.joblib with every weight backed by a read-only mmap."""
+    import torch
+    m = manifest(mmap_dir)
+    model = joblib.load(os.path.join(mmap_dir, m["skeleton"]))
+    net = model.network
+    with warnings.catch_warnings():
+        # torch warns that the arrays are not writable; inference never writes them
+        warnings.simplefilter("ignore", UserWarning)
+        for name, meta in m["tensors"].items():
+            _assign(net, name, torch.from_numpy(_map(mmap_dir, meta["file"], meta)))
+    net.eval()
+    return model
+
+def train_medians(mmap_dir: str = MMAP_DIR) -> Optional[Dict[str, float]]:
+    if not available(mmap_dir):
+        return None
+    return manifest(mmap_dir)["stats"].get("medians")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Model artifact maintenance")
+    ap.add_argument("--export", action="store_true", help="convert the pickled model to the mmap format")
+    ap.add_argument("--model", default=os.path.join(MODEL_DIR, "tabnet_model.pkl"))
+    ap.add_argument("--reference", help="training features CSV (X_train.csv) to take medians from")
+    ap.add_argument("--out", default=MMAP_DIR)
+    args = ap.parse_args()
+    if args.export:
+        path = args.model
+        if not os.path.isfile(path) and os.path.isfile(os.path.join(MODEL_DIR, "tabnet_model.joblib")):
+            path = os.path.join(MODEL_DIR, "tabnet_model.joblib")
+        m = export(joblib.load(path), args.out, args.reference)
+        print({"out": args.out, "tensors": len(m["tensors"]), "skeleton_bytes": m["skeleton_bytes"]})
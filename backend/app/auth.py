@@ -1,10 +1,11 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
-from firebase_admin import auth as fb_auth
 
 from .firebase_admin_init import *  # ensures firebase_admin.initialize_app(...)
 from .db import SessionLocal
-from .models import User, Patient, UserRole  # role is Enum(UserRole)
+from .models import UserRole  # role is Enum(UserRole)
+from .accounts import upsert_login
+from . import session_tokens
 
 router = APIRouter()
 
@@ -27,80 +28,10 @@ def parse_role(role_str: str | None) -> UserRole | None:
         )
 
 
-def upsert_user(db, *, uid, email, phone, name, role_hint: UserRole | None) -> User:
-    """
-    Resolve in this order: firebase_uid -> email -> phone.
-    Create/update as needed. Enforce role mismatch.
-    """
-    user = None
-
-    if uid:
-        user = db.query(User).filter(User.firebase_uid == uid).one_or_none()
-    if not user and email:
-        user = db.query(User).filter(User.email == email).one_or_none()
-    if not user and phone:
-        user = db.query(User).filter(User.phone == phone).one_or_none()
-
-    if not user:
-        user = User(
-            email=email,
-            phone=phone,
-            full_name=name,
-            firebase_uid=uid,
-            role=role_hint if role_hint else None,
-        )
-        db.add(user)
-        db.commit()
-        db.refresh(user)
-        return user
-
-    # existing user: update identifiers
-    changed = False
-    if uid and user.firebase_uid != uid:
-        user.firebase_uid = uid
-        changed = True
-    if email and user.email != email:
-        user.email = email
-        changed = True
-    if phone and user.phone != phone:
-        user.phone = phone
-        changed = True
-
-    # role enforcement
-    if role_hint:
-        if user.role and user.role != role_hint:
-            raise HTTPException(
-                status_code=409,
-                detail=f"Role mismatch: your account is '{user.role.value}', not '{role_hint.value}'.",
-            )
-        if not user.role:
-            user.role = role_hint
-            changed = True
-
-    if changed:
-        db.add(user)
-        db.commit()
-        db.refresh(user)
-
-    return user
-
-
-def ensure_patient(db, user: User) -> int | None:
-    if user.role != UserRole.patient:
-        return None
-    pat = db.query(Patient).filter(Patient.user_id == user.id).one_or_none()
-    if not pat:
-        pat = Patient(user_id=user.id)
-        db.add(pat)
-        db.commit()
-        db.refresh(pat)
-    return pat.id
-
-
 def handle_login(payload: FirebaseLoginIn):
-    # Verify Firebase ID token
+    # Verify Firebase ID token (locally, against cached Google certs)
     try:
-        decoded = fb_auth.verify_id_token(payload.id_token)
+        decoded = session_tokens.verifier.verify(payload.id_token)
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"Invalid Firebase token: {e}")
 
@@ -119,20 +50,21 @@ def handle_login(payload: FirebaseLoginIn):
 
     db = SessionLocal()
     try:
-        user = upsert_user(
-            db, uid=uid, email=email, phone=phone, name=name, role_hint=role_hint
+        # single statement: user upsert + role check + optional patients row
+        acct = upsert_login(
+            db, uid=uid, email=email, phone=phone, name=name,
+            role=(role_hint.value if role_hint else None),
+            ensure_patient=payload.ensure_patient,
         )
-
-        patient_id = None
-        if payload.ensure_patient and user.role == UserRole.patient:
-            patient_id = ensure_patient(db, user)
+        token, expires_at = session_tokens.issue(acct.user_id, acct.role, acct.patient_id)
 
         # Return values the frontend already expects
         return {
-            "token": payload.id_token,  # reuse Firebase token; swap to your own JWT later if you want
-            "role": (user.role.value if user.role else None),
-            "user_id": user.id,
-            "patient_id": patient_id,
+            "token": token,  # our own session token; send as "Authorization: Bearer ..."
+            "expires_at": expires_at,
+            "role": acct.role,
+            "user_id": acct.user_id,
+            "patient_id": acct.patient_id,
         }
     finally:
         db.close()
@@ -146,3 +78,13 @@ def firebase_login(payload: FirebaseLoginIn):
 @router.post("/auth/firebase-login")
 def firebase_login_alias(payload: FirebaseLoginIn):
     return handle_login(payload)
+
+
+@router.get("/auth/session")
+def auth_session(session: dict = Depends(session_tokens.current_session)):
+    return {
+        "user_id": session["sub"],
+        "role": session.get("role"),
+        "patient_id": session.get("pid"),
+        "expires_at": session["exp"],
+    }
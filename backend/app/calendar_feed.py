@@ -0,0 +1,214 @@
+# backend/app/calendar_feed.py
+#
+# iCalendar (RFC 5545) feed of ANC appointments for clinic calendar tools:
+#   GET /appointments/calendar.ics?facility_id=&clinician_id=&patient_id=&start=&days=
+#
+# VEVENTs are streamed from a server-side cursor in CALENDAR_BATCH-row
+# chunks, so a large facility feed never sits in memory. Conditional GET
+# uses the version markers in versions.py (the global APPOINTMENTS marker,
+# or the patient's PROFILE marker for a per-patient feed): a client polling
+# with If-None-Match gets a 304 after one primary-key lookup, no scan.
+#
+# The feed needs either a clinician/admin bearer token (or the patient's own
+# session for a per-patient feed) or a token= capability for exactly that
+# facility/clinician/patient filter, issued by GET /appointments/calendar-token
+# for calendar apps that can only poll a URL. Events name the patient by
+# full name or number, never by email address.
+import os
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+from urllib.parse import urlencode
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import text, bindparam
+from sqlalchemy.orm import Session
+
+from .db import get_db, engine
+from . import versions
+from .session_tokens import check_capability, capability, current_session, require_role
+from .slots import BOOKED_STATUSES, DEFAULT_FACILITY
+
+router = APIRouter(prefix="/appointments", tags=["appointments"])
+
+BATCH_SIZE = int(os.getenv("CALENDAR_BATCH", "500"))
+APP_NAME = os.getenv("APP_NAME", "GH Risk Predictor")
+UID_DOMAIN = os.getenv("CALENDAR_UID_DOMAIN", "gh-risk-predictor")
+
+# Clinician responsible for the visit (fresh databases get it from models.py)
+with engine.begin() as conn:
+    conn.execute(text("""
+        DO $$
+        BEGIN
+            IF to_regclass('appointments') IS NOT NULL THEN
+                ALTER TABLE appointments ADD COLUMN IF NOT EXISTS clinician_id INTEGER;
+                CREATE INDEX IF NOT EXISTS ix_appointments_clinician ON appointments (clinician_id)
+                WHERE clinician_id IS NOT NULL;
+            END IF;
+        END $$
+    """))
+
+# ---------- iCalendar formatting ----------
+def _escape(s: str) -> str:
+    return (s.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+             .replace("\r\n", "\\n").replace("\n", "\\n"))
+
+def _fold(line: str) -> str:
+    """Fold at 75 octets as RFC 5545 requires (continuation lines start with a space)."""
+    raw = line.encode("utf-8")
+    if len(raw) <= 75:
+        return line + "\r\n"
+    parts, limit = [], 75
+    while raw:
+        cut = min(limit, len(raw))
+        while cut < len(raw) and (raw[cut] & 0xC0) == 0x80:  # don't split a UTF-8 sequence
+            cut -= 1
+        parts.append(raw[:cut].decode("utf-8"))
+        raw, limit = raw[cut:], 74
+    return "\r\n ".join(parts) + "\r\n"
+
+def _dt(v: datetime) -> str:
+    if v.tzinfo is not None:
+        return v.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    return v.strftime("%Y%m%dT%H%M%S")  # floating: clinic local time
+
+def _stamp(v: Optional[datetime]) -> str:
+    # DTSTAMP must be UTC; created_at keeps the feed byte-identical between polls
+    if v is None:
+        return "19700101T000000Z"
+    return _dt(v if v.tzinfo else v.replace(tzinfo=timezone.utc))
+
+def _vevent(r) -> str:
+    when = r.scheduled_for or r.next_visit
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:appt-{r.id}@{UID_DOMAIN}",
+        f"DTSTAMP:{_stamp(r.created_at)}",
+    ]
+    if isinstance(when, datetime):
+        lines.append(f"DTSTART:{_dt(when)}")
+        lines.append(f"DURATION:PT{int(r.slot_minutes or 15)}M")
+    else:
+        lines.append(f"DTSTART;VALUE=DATE:{when.strftime('%Y%m%d')}")
+    lines.append("SUMMARY:" + _escape("ANC visit - " + (r.patient_name or f"Patient {r.patient_id}")))
+    lines.append("DESCRIPTION:" + _escape(f"Patient #{r.patient_id}; status: {r.status}"))
+    lines.append("STATUS:" + ("CONFIRMED" if r.status == "confirmed" else "TENTATIVE"))
+    if r.facility_name:
+        lines.append("LOCATION:" + _escape(r.facility_name))
+    lines.append("END:VEVENT")
+    return "".join(_fold(l) for l in lines)
+
+def _header() -> str:
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        f"PRODID:-//{_escape(APP_NAME)}//ANC appointments//EN",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        f"X-WR-CALNAME:{_escape(APP_NAME)} ANC visits",
+    ]
+    return "".join(_fold(l) for l in lines)
+
+# ---------- Query ----------
+_FEED_SQL = """
+    SELECT a.id, a.patient_id, a.scheduled_for, a.next_visit, a.status::text AS status,
+           a.created_at, f.name AS facility_name, f.slot_minutes,
+           u.full_name AS patient_name
+    FROM appointments a
+    JOIN patients p ON p.id = a.patient_id
+    JOIN users u    ON u.id = p.user_id
+    LEFT JOIN facilities f ON f.id = COALESCE(a.facility_id, :default_facility)
+    WHERE COALESCE(a.scheduled_for, a.next_visit) >= :start
+      AND COALESCE(a.scheduled_for, a.next_visit) < :end
+      AND a.status::text IN :booked
+      {filters}
+    ORDER BY COALESCE(a.scheduled_for, a.next_visit), a.id
+"""
+
+def _stream(params: dict, filters: str):
+    stmt = text(_FEED_SQL.format(filters=filters)).bindparams(bindparam("booked", expanding=True))
+    yield _header().encode("utf-8")
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=BATCH_SIZE).execute(stmt, params)
+        for batch in result.partitions(BATCH_SIZE):
+            yield "".join(_vevent(r) for r in batch).encode("utf-8")
+    yield b"END:VCALENDAR\r\n"
+
+# ---------- Access ----------
+STAFF_ROLES = ("admin", "clinician")
+
+def _scope(facility_id: Optional[int], clinician_id: Optional[int], patient_id: Optional[int]) -> str:
+    return f"calendar:f{facility_id or ''}c{clinician_id or ''}p{patient_id or ''}"
+
+def _authorize(scope: str, patient_id: Optional[int], token: Optional[str], authorization: Optional[str]):
+    if token is not None:
+        if not check_capability(scope, token):
+            raise HTTPException(status_code=403, detail="Feed token does not match this feed")
+        return
+    session = current_session(authorization)  # 401 without a bearer token
+    if session.get("role") in STAFF_ROLES:
+        return
+    if patient_id is not None and session.get("pid") == patient_id:
+        return
+    raise HTTPException(status_code=403, detail="Forbidden")
+
+# ---------- Endpoints ----------
+@router.get("/calendar-token")
+def calendar_token(
+    facility_id: Optional[int] = Query(None),
+    clinician_id: Optional[int] = Query(None),
+    patient_id: Optional[int] = Query(None),
+    _user: dict = Depends(require_role(*STAFF_ROLES)),
+):
+    """Subscription URL for a calendar app; the token only opens this exact filter."""
+    token = capability(_scope(facility_id, clinician_id, patient_id))
+    query = {k: v for k, v in (("facility_id", facility_id), ("clinician_id", clinician_id),
+                               ("patient_id", patient_id)) if v is not None}
+    return {"token": token, "path": "/appointments/calendar.ics?" + urlencode({**query, "token": token})}
+
+@router.get("/calendar.ics")
+def calendar_ics(
+    request: Request,
+    response: Response,
+    facility_id: Optional[int] = Query(None),
+    clinician_id: Optional[int] = Query(None),
+    patient_id: Optional[int] = Query(None),
+    start: Optional[date] = Query(None, description="First day (default: today)"),
+    days: int = Query(7, ge=1, le=92),
+    token: Optional[str] = Query(None, description="Feed token from /appointments/calendar-token"),
+    authorization: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    _authorize(_scope(facility_id, clinician_id, patient_id), patient_id, token, authorization)
+    start = start or date.today()
+    end = start + timedelta(days=days)
+
+    # The window is part of the variant: "today" moves even when no appointment does
+    variant = f"f{facility_id or ''}c{clinician_id or ''}p{patient_id or ''}s{start:%Y%m%d}d{days}"
+    if patient_id is not None:
+        not_modified = versions.check(request, response, db, versions.PROFILE, patient_id, variant)
+    else:
+        # One facility: its own marker; otherwise the sum over all facilities
+        not_modified = versions.check(request, response, db, versions.APPOINTMENTS,
+                                      versions.appointments(facility_id)[1] if facility_id is not None else None,
+                                      variant)
+    if not_modified is not None:
+        return not_modified
+
+    filters, params = [], {"start": start, "end": end, "booked": list(BOOKED_STATUSES),
+                           "default_facility": DEFAULT_FACILITY}
+    if facility_id is not None:
+        filters.append("AND COALESCE(a.facility_id, :default_facility) = :facility_id")
+        params["facility_id"] = facility_id
+    if clinician_id is not None:
+        filters.append("AND a.clinician_id = :clinician_id")
+        params["clinician_id"] = clinician_id
+    if patient_id is not None:
+        filters.append("AND a.patient_id = :patient_id")
+        params["patient_id"] = patient_id
+
+    headers = {k: v for k, v in response.headers.items()
+               if k.lower() not in ("content-length", "content-type")}
+    headers["Content-Disposition"] = 'inline; filename="anc-appointments.ics"'
+    return StreamingResponse(_stream(params, "\n      ".join(filters)),
+                             media_type="text/calendar; charset=utf-8", headers=headers)
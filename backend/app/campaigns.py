@@ -0,0 +1,227 @@
+# backend/app/campaigns.py
+#
+# Bulk ANC visit reminders. A campaign streams every open appointment in a
+# date window (appointments ⋈ patients ⋈ users) through a server-side
+# cursor, CAMPAIGN_BATCH rows at a time, renders the visit template once per
+# distinct (last_visit, next_visit) pair in the batch, and bulk-enqueues the
+# batch into notification_outbox. Delivery, concurrency and rate limiting
+# are the outbox workers' job (OUTBOX_WORKERS, OUTBOX_RATE_PER_SEC).
+#
+# Memory stays at one batch regardless of recipient count. Re-running a
+# campaign over the same window does not re-send: reminders are deduped per
+# appointment and date.
+#
+#   python -m app.campaigns --start 2025-01-01 --end 2025-01-07
+import argparse
+import logging
+import os
+import threading
+import time
+from datetime import date, timedelta
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
+from sqlalchemy import text, bindparam
+from sqlalchemy.orm import Session
+
+from .db import get_db, engine, SessionLocal
+from . import outbox
+from .cohort import OPEN_STATUSES
+from .notifications import render_visit
+from .session_tokens import require_role
+
+router = APIRouter(prefix="/notifications/campaigns", tags=["notifications"])
+log = logging.getLogger("uvicorn.error")
+
+BATCH_SIZE = int(os.getenv("CAMPAIGN_BATCH", "1000"))
+
+# ---------- Schema ----------
+with engine.begin() as conn:
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS notification_campaigns (
+            id BIGSERIAL PRIMARY KEY,
+            kind TEXT NOT NULL,
+            window_start DATE NOT NULL,
+            window_end DATE NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            selected INTEGER NOT NULL DEFAULT 0,
+            queued INTEGER NOT NULL DEFAULT 0,
+            skipped INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            started_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            finished_at TIMESTAMPTZ
+        )
+    """))
+
+# ---------- Schemas ----------
+class VisitReminderIn(BaseModel):
+    start: Optional[date] = None     # default: today
+    end: Optional[date] = None       # default: start + 7 days (inclusive)
+
+class CampaignOut(BaseModel):
+    id: int
+    kind: str
+    status: str
+    window_start: str
+    window_end: str
+    selected: int
+    queued: int
+    skipped: int
+    delivery: dict
+    elapsed_seconds: float
+    enqueue_per_sec: Optional[float] = None
+    delivered_per_sec: Optional[float] = None
+    last_error: Optional[str] = None
+
+# ---------- Job ----------
+_SELECT_DUE = text("""
+    SELECT a.id AS appointment_id,
+           COALESCE(a.scheduled_for, a.next_visit) AS visit_day,
+           a.last_visit,
+           u.email
+    FROM appointments a
+    JOIN patients p ON p.id = a.patient_id
+    JOIN users u    ON u.id = p.user_id
+    WHERE COALESCE(a.scheduled_for, a.next_visit) BETWEEN :start AND :end
+      AND a.status::text IN :open
+      AND u.email IS NOT NULL
+    ORDER BY a.id
+""").bindparams(bindparam("open", expanding=True))
+
+def _messages(batch):
+    """Outbox rows for one batch; each distinct date pair is rendered once."""
+    rendered = {}
+    out = []
+    for r in batch:
+        key = (r.last_visit, r.visit_day)
+        if key not in rendered:
+            rendered[key] = render_visit(
+                r.last_visit.isoformat() if r.last_visit else None,
+                r.visit_day.isoformat(),
+            )
+        subject, body = rendered[key]
+        out.append({
+            "kind": "visit_reminder",
+            "to": r.email,
+            "subject": subject,
+            "text": body,
+            "dedupe": f"visit_reminder:{r.appointment_id}:{r.visit_day.isoformat()}",
+        })
+    return out
+
+def create_campaign(start: date, end: date) -> int:
+    with engine.begin() as conn:
+        return conn.execute(text("""
+            INSERT INTO notification_campaigns (kind, window_start, window_end)
+            VALUES ('visit_reminder', :s, :e)
+            RETURNING id
+        """), {"s": start, "e": end}).scalar()
+
+def run_visit_reminders(campaign_id: int, start: date, end: date, batch_size: int = BATCH_SIZE):
+    """Stream, render and enqueue; progress is committed after every batch."""
+    try:
+        with engine.connect() as src:
+            result = src.execution_options(stream_results=True, max_row_buffer=batch_size) \
+                        .execute(_SELECT_DUE, {"start": start, "end": end, "open": list(OPEN_STATUSES)})
+            for batch in result.partitions(batch_size):
+                with SessionLocal() as db:
+                    queued = outbox.enqueue_many(db, _messages(batch), campaign_id=campaign_id)
+                    db.execute(text("""
+                        UPDATE notification_campaigns
+                        SET selected = selected + :n, queued = queued + :q, skipped = skipped + :n - :q
+                        WHERE id = :id
+                    """), {"id": campaign_id, "n": len(batch), "q": queued})
+                    db.commit()
+        status, err = "done", None
+    except Exception as e:
+        log.exception("[campaigns] campaign %s failed", campaign_id)
+        status, err = "failed", str(e)[:2000]
+    with engine.begin() as conn:
+        conn.execute(text("""
+            UPDATE notification_campaigns
+            SET status = :st, last_error = :err, finished_at = NOW()
+            WHERE id = :id
+        """), {"id": campaign_id, "st": status, "err": err})
+
+def start_visit_reminders(start: date, end: date) -> int:
+    campaign_id = create_campaign(start, end)
+    threading.Thread(target=run_visit_reminders, args=(campaign_id, start, end),
+                     name=f"campaign-{campaign_id}", daemon=True).start()
+    return campaign_id
+
+def campaign_status(db: Session, campaign_id: int) -> Optional[CampaignOut]:
+    row = db.execute(text("""
+        SELECT c.*,
+               EXTRACT(EPOCH FROM COALESCE(c.finished_at, NOW()) - c.started_at) AS elapsed,
+               o.delivery,
+               EXTRACT(EPOCH FROM o.last_sent - c.started_at) AS delivery_elapsed,
+               o.sent
+        FROM notification_campaigns c
+        LEFT JOIN LATERAL (
+            SELECT jsonb_object_agg(s.status, s.n) AS delivery,
+                   max(s.last_sent) AS last_sent,
+                   COALESCE(sum(s.n) FILTER (WHERE s.status = 'sent'), 0) AS sent
+            FROM (
+                SELECT status, count(*) AS n, max(sent_at) AS last_sent
+                FROM notification_outbox
+                WHERE campaign_id = c.id
+                GROUP BY status
+            ) s
+        ) o ON TRUE
+        WHERE c.id = :id
+    """), {"id": campaign_id}).mappings().first()
+    if not row:
+        return None
+
+    elapsed = float(row["elapsed"] or 0.0)
+    delivery_elapsed = float(row["delivery_elapsed"] or 0.0)
+    return CampaignOut(
+        id=row["id"],
+        kind=row["kind"],
+        status=row["status"],
+        window_start=row["window_start"].isoformat(),
+        window_end=row["window_end"].isoformat(),
+        selected=row["selected"],
+        queued=row["queued"],
+        skipped=row["skipped"],
+        delivery=row["delivery"] or {},
+        elapsed_seconds=round(elapsed, 3),
+        enqueue_per_sec=round(row["selected"] / elapsed, 1) if elapsed > 0 else None,
+        delivered_per_sec=round(int(row["sent"]) / delivery_elapsed, 1) if delivery_elapsed > 0 else None,
+        last_error=row["last_error"],
+    )
+
+# ---------- Endpoints ----------
+@router.post("/visit-reminders", status_code=202)
+def visit_reminders(body: VisitReminderIn,
+                    _user: dict = Depends(require_role("admin", "clinician"))):
+    start = body.start or date.today()
+    end = body.end or start + timedelta(days=7)
+    if end < start:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+    return {"ok": True, "campaign_id": start_visit_reminders(start, end)}
+
+@router.get("/{campaign_id}", response_model=CampaignOut)
+def get_campaign(campaign_id: int, db: Session = Depends(get_db),
+                 _user: dict = Depends(require_role("admin", "clinician"))):
+    out = campaign_status(db, campaign_id)
+    if not out:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    return out
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Queue ANC visit reminders for a date window")
+    ap.add_argument("--start", type=date.fromisoformat, default=date.today())
+    ap.add_argument("--end", type=date.fromisoformat, default=None)
+    ap.add_argument("--batch", type=int, default=BATCH_SIZE)
+    args = ap.parse_args()
+    end = args.end or args.start + timedelta(days=7)
+    cid = create_campaign(args.start, end)
+    t0 = time.perf_counter()
+    run_visit_reminders(cid, args.start, end, batch_size=args.batch)
+    with SessionLocal() as db:
+        out = campaign_status(db, cid)
+    print(out.dict() if out else {"id": cid})
+    print(f"enqueue wall time: {time.perf_counter() - t0:.2f}s")
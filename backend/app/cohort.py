@@ -0,0 +1,432 @@
+# backend/app/cohort.py
+#
+# Facility dashboard counters, maintained incrementally by the write paths:
+#   - on_prediction()          called from gh_predict.save_prediction
+#   - on_predictions()         the same for a batch (cohort_import.py)
+#   - on_appointment_change()  called wherever an appointment is created or
+#                              its date/status changes (visits.py, appointments.py)
+#   - on_appointment_changes() the same for a batch (reminders.py)
+# Reads never touch gh_predictions/appointments; reconcile() rebuilds
+# everything from the base tables to correct any drift.
+#
+# Writers never update a shared row: each delta goes to one of
+# COHORT_COUNTER_SHARDS stripes in cohort_counter_shards (picked from the
+# patient id, or the appointment day), so concurrent predictions and
+# bookings only contend when they land on the same stripe. The value read
+# is cohort_counters.value (the reconciled base) plus the sum of its
+# stripes; reconcile() folds the stripes back into the base.
+import argparse
+import logging
+import os
+import random
+import threading
+import time
+from datetime import date, timedelta
+from typing import Optional
+
+from fastapi import APIRouter, Depends
+from pydantic import BaseModel
+from sqlalchemy import text, bindparam
+from sqlalchemy.orm import Session
+
+from .db import get_db, engine
+from .session_tokens import require_role
+
+router = APIRouter(prefix="/cohort", tags=["cohort"])
+log = logging.getLogger("uvicorn.error")
+
+# Appointments that still expect the patient to turn up
+OPEN_STATUSES = ("scheduled", "rescheduled")
+COUNTERS = ("risk_high", "risk_low", "priority", "open_before")
+RECONCILE_SECONDS = int(os.getenv("COHORT_RECONCILE_SECONDS", "3600"))
+SHARDS = max(1, int(os.getenv("COHORT_COUNTER_SHARDS", "16")))
+_RECONCILE_LOCK = 7_202_701  # pg advisory lock key
+
+# ---------- Schema ----------
+with engine.begin() as conn:
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS cohort_counters (
+            name TEXT PRIMARY KEY,
+            value BIGINT NOT NULL DEFAULT 0,
+            as_of DATE,
+            reconciled_at TIMESTAMPTZ
+        )
+    """))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS cohort_counter_shards (
+            name TEXT NOT NULL,
+            shard SMALLINT NOT NULL,
+            value BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (name, shard)
+        )
+    """))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS cohort_patient_state (
+            patient_id INTEGER PRIMARY KEY REFERENCES patients(id) ON DELETE CASCADE,
+            risk_class TEXT NOT NULL,
+            priority BOOLEAN NOT NULL DEFAULT FALSE
+        )
+    """))
+    # Latest score and the threshold it was classed with (thresholds.ScoreIndex reads these)
+    conn.execute(text("""
+        ALTER TABLE cohort_patient_state
+            ADD COLUMN IF NOT EXISTS risk_score DOUBLE PRECISION,
+            ADD COLUMN IF NOT EXISTS threshold DOUBLE PRECISION
+    """))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS cohort_appointment_days (
+            day DATE PRIMARY KEY,
+            open_count INTEGER NOT NULL DEFAULT 0
+        )
+    """))
+    for name in COUNTERS:
+        conn.execute(text("""
+            INSERT INTO cohort_counters (name, value, as_of)
+            VALUES (:n, 0, CURRENT_DATE)
+            ON CONFLICT (name) DO NOTHING
+        """), {"n": name})
+
+# ---------- Schemas ----------
+class CohortSummary(BaseModel):
+    high: int
+    low: int
+    priority: int
+    due_this_week: int
+    overdue: int
+    as_of: Optional[str] = None
+    reconciled_at: Optional[str] = None
+
+# ---------- Incremental maintenance ----------
+def _bump(db: Session, deltas: dict, shard_key: Optional[int] = None):
+    """Add deltas to one stripe (shard_key % SHARDS, random if None)."""
+    deltas = {k: v for k, v in deltas.items() if v}
+    if not deltas:
+        return
+    shard = (shard_key if shard_key is not None else random.randrange(SHARDS)) % SHARDS
+    # Sorted names: two writers on the same stripe lock its rows in the same order
+    names = sorted(deltas)
+    db.execute(text("""
+        INSERT INTO cohort_counter_shards (name, shard, value)
+        SELECT n, :shard, d FROM unnest(CAST(:names AS TEXT[]), CAST(:deltas AS BIGINT[])) AS t(n, d)
+        ORDER BY n
+        ON CONFLICT (name, shard) DO UPDATE
+        SET value = cohort_counter_shards.value + EXCLUDED.value
+    """), {"shard": shard, "names": names, "deltas": [int(deltas[n]) for n in names]})
+
+def _set_state(db: Session, ids: list, rcs: list, prs: list, scores: list, thrs: list) -> tuple:
+    """
+    Upsert cohort_patient_state; returns (number of patients seen for the
+    first time, [(old risk_class, old priority)] for the rest). "New" comes
+    from the insert itself rather than a prior SELECT, so two concurrent
+    first predictions for a patient count as one new patient and one move.
+    """
+    params = {"ids": ids, "rcs": rcs, "prs": [bool(p) for p in prs],
+              "scores": [None if v is None else float(v) for v in scores],
+              "thrs": [None if v is None else float(v) for v in thrs]}
+    inserted = set(db.execute(text("""
+        INSERT INTO cohort_patient_state (patient_id, risk_class, priority, risk_score, threshold)
+        SELECT * FROM unnest(CAST(:ids AS INTEGER[]), CAST(:rcs AS TEXT[]), CAST(:prs AS BOOLEAN[]),
+                             CAST(:scores AS DOUBLE PRECISION[]), CAST(:thrs AS DOUBLE PRECISION[]))
+        ORDER BY 1
+        ON CONFLICT (patient_id) DO NOTHING
+        RETURNING patient_id
+    """), params).scalars().all())
+    rest = [i for i, pid in enumerate(ids) if pid not in inserted]
+    if not rest:
+        return len(inserted), []
+    # The FOR UPDATE subquery waits for a concurrent writer and then reads
+    # its committed values, so the old bucket is always the one counted
+    prev = db.execute(text("""
+        UPDATE cohort_patient_state s
+        SET risk_class = n.rc, priority = n.pr, risk_score = n.score, threshold = n.thr
+        FROM (
+            SELECT patient_id, risk_class, priority FROM cohort_patient_state
+            WHERE patient_id = ANY(:ids)
+            ORDER BY patient_id
+            FOR UPDATE
+        ) old,
+        unnest(CAST(:ids AS INTEGER[]), CAST(:rcs AS TEXT[]), CAST(:prs AS BOOLEAN[]),
+               CAST(:scores AS DOUBLE PRECISION[]), CAST(:thrs AS DOUBLE PRECISION[]))
+            AS n(pid, rc, pr, score, thr)
+        WHERE s.patient_id = old.patient_id AND n.pid = old.patient_id
+        RETURNING old.risk_class, old.priority
+    """), {k: [v[i] for i in rest] for k, v in params.items()}).all()
+    return len(inserted), prev
+
+def _state_deltas(prev, items) -> dict:
+    deltas = {"risk_high": 0, "risk_low": 0, "priority": 0}
+    for r in prev:
+        deltas["risk_high" if r.risk_class == "High" else "risk_low"] -= 1
+        deltas["priority"] -= int(bool(r.priority))
+    for _, rc, pr, *_ in items:
+        deltas["risk_high" if rc == "High" else "risk_low"] += 1
+        deltas["priority"] += int(bool(pr))
+    return deltas
+
+def on_prediction(db: Session, patient_id: int, risk_class: str, priority: bool,
+                  risk_score: Optional[float] = None, threshold: Optional[float] = None):
+    """Move the patient between High/Low/priority buckets. Caller commits."""
+    _, prev = _set_state(db, [patient_id], [risk_class], [priority], [risk_score], [threshold])
+    _bump(db, _state_deltas(prev, [(patient_id, risk_class, priority)]), shard_key=patient_id)
+
+def on_predictions(db: Session, items):
+    """on_prediction for many patients at once: items = [(patient_id, risk_class, priority,
+    risk_score, threshold)], one per patient. Caller commits."""
+    if not items:
+        return
+    ids, rcs, prs, scores, thrs = (list(col) for col in zip(*items))
+    _, prev = _set_state(db, ids, rcs, prs, scores, thrs)
+    _bump(db, _state_deltas(prev, items))
+
+def appointment_day(scheduled_for, next_visit=None) -> Optional[date]:
+    d = scheduled_for or next_visit
+    if d is None:
+        return None
+    return d.date() if hasattr(d, "date") else d
+
+def on_appointment_change(db: Session,
+                          old_day: Optional[date], old_status: Optional[str],
+                          new_day: Optional[date], new_status: Optional[str]):
+    """
+    Record an appointment insert/update. Pass old_* as None for a new row.
+    Statuses may be plain strings or AppointmentStatus members. Caller commits.
+    """
+    on_appointment_changes(db, [(old_day, old_status, new_day, new_status)])
+
+def on_appointment_changes(db: Session, changes):
+    """on_appointment_change for many appointments at once:
+    changes = [(old_day, old_status, new_day, new_status)]. Caller commits."""
+    def _open(s):
+        return getattr(s, "value", s) in OPEN_STATUSES
+
+    per_day = {}
+    for old_day, old_status, new_day, new_status in changes:
+        if old_day and _open(old_status):
+            per_day[old_day] = per_day.get(old_day, 0) - 1
+        if new_day and _open(new_status):
+            per_day[new_day] = per_day.get(new_day, 0) + 1
+    per_day = {d: n for d, n in per_day.items() if n}
+    if not per_day:
+        return
+
+    days = sorted(per_day)
+    db.execute(text("""
+        INSERT INTO cohort_appointment_days (day, open_count)
+        SELECT * FROM unnest(CAST(:days AS DATE[]), CAST(:deltas AS INTEGER[]))
+        ORDER BY 1
+        ON CONFLICT (day) DO UPDATE
+        SET open_count = cohort_appointment_days.open_count + EXCLUDED.open_count
+    """), {"days": days, "deltas": [per_day[d] for d in days]})
+
+    # Days before the reconciliation point are folded into open_before
+    as_of = db.execute(text(
+        "SELECT as_of FROM cohort_counters WHERE name = 'open_before'"
+    )).scalar()
+    if as_of:
+        _bump(db, {"open_before": sum(n for d, n in per_day.items() if d < as_of)},
+              shard_key=days[0].toordinal())
+
+# ---------- Reads ----------
+def summary(db: Session, today: Optional[date] = None) -> CohortSummary:
+    today = today or date.today()
+    row = db.execute(text("""
+        WITH v AS (
+            SELECT c.name, c.value + COALESCE(sum(s.value), 0) AS value, c.as_of, c.reconciled_at
+            FROM cohort_counters c
+            LEFT JOIN cohort_counter_shards s ON s.name = c.name
+            GROUP BY c.name, c.value, c.as_of, c.reconciled_at
+        ), c AS (
+            SELECT
+                max(value) FILTER (WHERE name = 'risk_high')   AS high,
+                max(value) FILTER (WHERE name = 'risk_low')    AS low,
+                max(value) FILTER (WHERE name = 'priority')    AS priority,
+                max(value) FILTER (WHERE name = 'open_before') AS open_before,
+                max(as_of) FILTER (WHERE name = 'open_before') AS as_of,
+                max(reconciled_at) FILTER (WHERE name = 'open_before') AS reconciled_at
+            FROM v
+        )
+        SELECT c.high, c.low, c.priority, c.as_of, c.reconciled_at,
+               c.open_before + COALESCE((
+                   SELECT sum(open_count) FROM cohort_appointment_days
+                   WHERE day >= c.as_of AND day < :today
+               ), 0) AS overdue,
+               COALESCE((
+                   SELECT sum(open_count) FROM cohort_appointment_days
+                   WHERE day >= :today AND day < :week_end
+               ), 0) AS due_this_week
+        FROM c
+    """), {"today": today, "week_end": today + timedelta(days=7)}).mappings().first()
+
+    return CohortSummary(
+        high=int(row["high"] or 0),
+        low=int(row["low"] or 0),
+        priority=int(row["priority"] or 0),
+        due_this_week=int(row["due_this_week"] or 0),
+        overdue=int(row["overdue"] or 0),
+        as_of=row["as_of"].isoformat() if row["as_of"] else None,
+        reconciled_at=row["reconciled_at"].isoformat() if row["reconciled_at"] else None,
+    )
+
+# ---------- Reconciliation ----------
+# Phase 1 (REPEATABLE READ, no table locks): rebuild the state and per-day
+# counts from gh_predictions/appointments and diff them against what the
+# maintained tables held in the same snapshot. Writers keep going meanwhile.
+_DIFF_STATE = """
+    CREATE TEMP TABLE cohort_fix_state AS
+    WITH r AS (
+        SELECT DISTINCT ON (patient_id) patient_id, risk_class, priority, risk_score,
+               threshold_used AS threshold
+        FROM gh_predictions
+        ORDER BY patient_id, created_at DESC, id DESC
+    ), m AS (
+        SELECT patient_id, risk_class, priority, risk_score, threshold, xmin::text AS row_version
+        FROM cohort_patient_state
+    )
+    SELECT COALESCE(r.patient_id, m.patient_id) AS patient_id,
+           r.risk_class, r.priority, r.risk_score, r.threshold, m.row_version
+    FROM r FULL JOIN m ON m.patient_id = r.patient_id
+    WHERE ROW(r.risk_class, r.priority, r.risk_score, r.threshold)
+          IS DISTINCT FROM ROW(m.risk_class, m.priority, m.risk_score, m.threshold)
+"""
+_DIFF_DAYS = """
+    CREATE TEMP TABLE cohort_fix_days AS
+    WITH r AS (
+        SELECT COALESCE(scheduled_for, next_visit)::date AS day, count(*) AS n
+        FROM appointments
+        WHERE status::text IN :open
+          AND COALESCE(scheduled_for, next_visit) IS NOT NULL
+        GROUP BY 1
+    )
+    SELECT COALESCE(r.day, m.day) AS day, COALESCE(r.n, 0) - COALESCE(m.open_count, 0) AS delta
+    FROM r FULL JOIN cohort_appointment_days m ON m.day = r.day
+    WHERE COALESCE(r.n, 0) <> COALESCE(m.open_count, 0)
+"""
+# Phase 2 (locked): apply the differences. A state row a writer has touched
+# since the snapshot (its xmin changed) already holds the newer prediction
+# and is left alone; day counts are deltas, so they stack on top of writers'.
+_FIX_STATE = (
+    """
+    DELETE FROM cohort_patient_state s USING cohort_fix_state f
+    WHERE s.patient_id = f.patient_id AND f.risk_class IS NULL AND s.xmin::text = f.row_version
+    """,
+    """
+    UPDATE cohort_patient_state s
+    SET risk_class = f.risk_class, priority = f.priority, risk_score = f.risk_score, threshold = f.threshold
+    FROM cohort_fix_state f
+    WHERE s.patient_id = f.patient_id AND f.risk_class IS NOT NULL AND s.xmin::text = f.row_version
+    """,
+    """
+    INSERT INTO cohort_patient_state (patient_id, risk_class, priority, risk_score, threshold)
+    SELECT f.patient_id, f.risk_class, f.priority, f.risk_score, f.threshold
+    FROM cohort_fix_state f JOIN patients p ON p.id = f.patient_id
+    WHERE f.row_version IS NULL AND f.risk_class IS NOT NULL
+    ORDER BY f.patient_id
+    ON CONFLICT (patient_id) DO NOTHING
+    """,
+)
+_FIX_DAYS = """
+    INSERT INTO cohort_appointment_days (day, open_count)
+    SELECT day, delta FROM cohort_fix_days ORDER BY day
+    ON CONFLICT (day) DO UPDATE
+    SET open_count = cohort_appointment_days.open_count + EXCLUDED.open_count
+"""
+_DROP_FIX = "DROP TABLE IF EXISTS cohort_fix_state, cohort_fix_days"
+
+def reconcile(today: Optional[date] = None) -> bool:
+    """
+    Rebuild all counters from the base tables. The base-table scan runs
+    without table locks; writers are only held up while the differences
+    are applied and the counters recomputed from the (small) state tables.
+    Returns False if another worker is already reconciling.
+    """
+    today = today or date.today()
+    with engine.connect() as conn:
+        with conn.begin():
+            # Session-level: held across both transactions below
+            if not conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": _RECONCILE_LOCK}).scalar():
+                return False
+        try:
+            with conn.begin():
+                conn.execute(text("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ"))
+                conn.execute(text(_DROP_FIX))
+                conn.execute(text(_DIFF_STATE))
+                conn.execute(text(_DIFF_DAYS).bindparams(bindparam("open", expanding=True)),
+                             {"open": list(OPEN_STATUSES)})
+
+            with conn.begin():
+                # Same order the write paths touch these tables, so writers queue behind us
+                conn.execute(text("""
+                    LOCK TABLE cohort_patient_state, cohort_appointment_days, cohort_counters,
+                               cohort_counter_shards
+                    IN SHARE ROW EXCLUSIVE MODE
+                """))
+                for stmt in _FIX_STATE:
+                    conn.execute(text(stmt))
+                conn.execute(text(_FIX_DAYS))
+                conn.execute(text("""
+                    UPDATE cohort_counters c
+                    SET value = s.value, as_of = :today, reconciled_at = NOW()
+                    FROM (
+                        SELECT 'risk_high' AS name, count(*) FILTER (WHERE risk_class = 'High') AS value
+                        FROM cohort_patient_state
+                        UNION ALL
+                        SELECT 'risk_low', count(*) FILTER (WHERE risk_class <> 'High')
+                        FROM cohort_patient_state
+                        UNION ALL
+                        SELECT 'priority', count(*) FILTER (WHERE priority)
+                        FROM cohort_patient_state
+                        UNION ALL
+                        SELECT 'open_before', COALESCE(sum(open_count), 0)
+                        FROM cohort_appointment_days WHERE day < :today
+                    ) s
+                    WHERE c.name = s.name
+                """), {"today": today})
+                # The base now holds the true values; start the stripes from zero
+                conn.execute(text("DELETE FROM cohort_counter_shards"))
+                conn.execute(text("DELETE FROM cohort_appointment_days WHERE open_count = 0"))
+                conn.execute(text(_DROP_FIX))
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _RECONCILE_LOCK})
+    log.info("[cohort] reconciled counters as of %s", today)
+    return True
+
+def _reconcile_loop(interval: int):
+    # Rows written before the risk_score column existed: fill them now, not in an hour
+    try:
+        with engine.connect() as conn:
+            unscored = conn.execute(text(
+                "SELECT EXISTS (SELECT 1 FROM cohort_patient_state WHERE risk_score IS NULL)"
+            )).scalar()
+        if unscored:
+            reconcile()
+    except Exception as e:
+        log.error("[cohort] reconcile failed: %s", e)
+    while True:
+        time.sleep(interval)
+        try:
+            reconcile()
+        except Exception as e:
+            log.error("[cohort] reconcile failed: %s", e)
+
+def start_reconciler(interval: int = RECONCILE_SECONDS):
+    """Background reconciliation thread; the advisory lock keeps it to one worker per run."""
+    if interval <= 0:
+        return None
+    t = threading.Thread(target=_reconcile_loop, args=(interval,), name="cohort-reconcile", daemon=True)
+    t.start()
+    return t
+
+# ---------- Endpoints ----------
+@router.get("/summary", response_model=CohortSummary)
+def cohort_summary(db: Session = Depends(get_db)):
+    return summary(db)
+
+@router.post("/reconcile")
+def cohort_reconcile(_admin: dict = Depends(require_role("admin"))):
+    return {"ok": True, "ran": reconcile()}
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Rebuild cohort dashboard counters")
+    ap.parse_args()
+    print({"ran": reconcile()})
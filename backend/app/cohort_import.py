@@ -0,0 +1,334 @@
+# backend/app/cohort_import.py
+#
+# Bulk onboarding of a facility's cohort from CSV:
+#   POST /patients/import?score=true      (body: the CSV, Content-Type text/csv)
+#   python -m app.cohort_import cohort.csv [--no-score]
+#
+# Columns: email (required), full_name, medical_record_number, facility_id,
+# and optionally the nine clinical inputs named as in /gh/predict-gh
+# (age, bmi, systolic_bp, diastolic_bp, previous_complications,
+# preexisting_diabetes, gestational_diabetes, mental_health, heart_rate).
+#
+# The file is read IMPORT_CHUNK rows at a time. Each chunk is validated
+# column-wise with pandas (row loops only touch rows that failed), then in
+# one transaction: valid rows are COPYed into a temp staging table, users
+# and patients are upserted with set-based INSERT ... ON CONFLICT, rows
+# with all nine inputs are scored in one predict_proba call per model
+# bundle, and the predictions, cohort counters and version markers are
+# written in bulk. The report lists per-row errors (by CSV line) and rows/s.
+import argparse
+import io
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from .db import SessionLocal
+from . import cohort, identity, model_pool, prediction_history, thresholds, versions
+from .gh_predict import _priority_reasons, score_matrix
+from .session_tokens import require_role
+
+router = APIRouter(tags=["patients"])
+log = logging.getLogger("uvicorn.error")
+
+CHUNK_ROWS = int(os.getenv("IMPORT_CHUNK", "5000"))
+MAX_BYTES  = int(float(os.getenv("IMPORT_MAX_MB", "50")) * 1024 * 1024)
+MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+EMAIL_RE   = r"^[^@\s]+@[^@\s]+\.[^@\s]+$"
+
+# CSV column -> (model feature, min, max); same bounds as PredictIn
+NUMERIC = {
+    "age":          ("Age", 10, 60),
+    "bmi":          ("BMI", 10, 80),
+    "systolic_bp":  ("Systolic BP", 60, 250),
+    "diastolic_bp": ("Diastolic BP", 40, 150),
+    "heart_rate":   ("Heart Rate", 40, 220),
+}
+BINARY = {
+    "previous_complications": "Previous Complications",
+    "preexisting_diabetes":   "Preexisting Diabetes",
+    "gestational_diabetes":   "Gestational Diabetes",
+    "mental_health":          "Mental Health",
+}
+FEATURE_COLS = list(NUMERIC) + list(BINARY)
+INT_COLS = ["age", "systolic_bp", "diastolic_bp", "heart_rate"] + list(BINARY)
+_BOOL = {"1": 1, "0": 0, "true": 1, "false": 0, "yes": 1, "no": 0, "y": 1, "n": 0}
+
+# ---------- Validation ----------
+def _blank(s: pd.Series) -> pd.Series:
+    return s.isna() | (s.astype(str).str.strip() == "")
+
+def validate(df: pd.DataFrame, seen_emails: set, seen_mrns: set):
+    """Returns (clean frame of valid rows, {line: [errors]}). Column-wise checks."""
+    lines = df.index + 2  # header is line 1
+    masks: Dict[str, pd.Series] = {}
+    out = pd.DataFrame(index=df.index)
+
+    email = df["email"].fillna("").astype(str).str.strip().str.lower()
+    masks["invalid email"] = ~email.str.match(EMAIL_RE)
+    masks["duplicate email in file"] = ~masks["invalid email"] & (email.duplicated() | email.isin(seen_emails))
+    out["email"] = email
+
+    out["full_name"] = df["full_name"].where(~_blank(df["full_name"])).str.strip() \
+        if "full_name" in df else None
+
+    if "medical_record_number" in df:
+        mrn = df["medical_record_number"].where(~_blank(df["medical_record_number"])).astype("string").str.strip()
+        masks["duplicate medical_record_number in file"] = mrn.notna() & (mrn.duplicated(keep="first") | mrn.isin(seen_mrns))
+        out["mrn"] = mrn
+    else:
+        out["mrn"] = None
+
+    if "facility_id" in df:
+        fac = pd.to_numeric(df["facility_id"], errors="coerce")
+        masks["invalid facility_id"] = ~_blank(df["facility_id"]) & ~(fac > 0)
+        out["facility_id"] = fac.astype("Int64")
+    else:
+        out["facility_id"] = pd.array([pd.NA] * len(df), dtype="Int64")
+
+    given = [c for c in FEATURE_COLS if c in df]
+    if given:
+        present = ~pd.concat([_blank(df[c]) for c in given], axis=1)
+        any_given = present.any(axis=1)
+        masks["incomplete clinical values (all nine are needed to score)"] = \
+            any_given & ~(present.all(axis=1) & (len(given) == len(FEATURE_COLS)))
+        for col, (_, lo, hi) in NUMERIC.items():
+            if col in df:
+                v = pd.to_numeric(df[col], errors="coerce")
+                masks[f"{col} must be a number in [{lo}, {hi}]"] = ~_blank(df[col]) & ~v.between(lo, hi)
+                out[col] = v
+        for col in BINARY:
+            if col in df:
+                v = df[col].astype(str).str.strip().str.lower().map(_BOOL)
+                masks[f"{col} must be 0/1"] = ~_blank(df[col]) & v.isna()
+                out[col] = v
+        out["scorable"] = present.all(axis=1) & (len(given) == len(FEATURE_COLS))
+    else:
+        out["scorable"] = False
+
+    bad = pd.Series(False, index=df.index)
+    for m in masks.values():
+        bad |= m.fillna(False).astype(bool)
+    errors: Dict[int, List[str]] = {}
+    for msg, m in masks.items():
+        for line in lines[m.fillna(False).astype(bool).to_numpy()]:
+            errors.setdefault(int(line), []).append(msg)
+
+    clean = out[~bad].copy()
+    clean["line"] = lines[~bad.to_numpy()]
+    clean["scorable"] = clean["scorable"].astype(bool)
+    seen_emails.update(clean["email"])
+    if clean["mrn"].notna().any():
+        seen_mrns.update(clean["mrn"].dropna())
+    return clean, errors
+
+# ---------- Upsert ----------
+_STAGE = """
+    CREATE TEMP TABLE import_stage (
+        line INTEGER PRIMARY KEY, email TEXT NOT NULL, full_name TEXT, mrn TEXT,
+        facility_id INTEGER, user_id INTEGER, patient_id INTEGER
+    ) ON COMMIT DROP
+"""
+
+def _copy_stage(db: Session, clean: pd.DataFrame):
+    buf = io.StringIO()
+    clean[["line", "email", "full_name", "mrn", "facility_id"]].to_csv(buf, index=False, header=False)
+    buf.seek(0)
+    cur = db.connection().connection.cursor()  # DBAPI cursor in the session's transaction
+    try:
+        cur.copy_expert("COPY import_stage (line, email, full_name, mrn, facility_id) FROM STDIN WITH (FORMAT csv)", buf)
+    finally:
+        cur.close()
+
+def upsert(db: Session, clean: pd.DataFrame, errors: Dict[int, List[str]]) -> dict:
+    db.execute(text(_STAGE))
+    _copy_stage(db, clean)
+
+    new_emails = db.execute(text("""
+        INSERT INTO users (email, full_name, role)
+        SELECT s.email, s.full_name, CAST('patient' AS user_role_enum) FROM import_stage s
+        WHERE NOT EXISTS (SELECT 1 FROM users u WHERE lower(u.email) = s.email)
+        ON CONFLICT (email) DO NOTHING
+        RETURNING email
+    """)).scalars().all()
+    db.execute(text("""
+        UPDATE import_stage s SET user_id = u.id
+        FROM users u WHERE lower(u.email) = s.email
+    """))
+    db.execute(text("""
+        UPDATE users u SET full_name = s.full_name
+        FROM import_stage s
+        WHERE u.id = s.user_id AND u.full_name IS NULL AND s.full_name IS NOT NULL
+    """))
+
+    # An MRN already held by someone else's patient record would violate
+    # the unique index; those rows are rejected instead of failing the chunk
+    for r in db.execute(text("""
+        DELETE FROM import_stage s
+        USING patients p
+        WHERE p.medical_record_number = s.mrn AND p.user_id <> s.user_id
+        RETURNING s.line
+    """)).all():
+        errors.setdefault(r.line, []).append("medical_record_number belongs to another patient")
+
+    created = db.execute(text("""
+        INSERT INTO patients (user_id, medical_record_number, facility_id)
+        SELECT user_id, mrn, facility_id FROM import_stage
+        ON CONFLICT (user_id) DO UPDATE
+        SET medical_record_number = COALESCE(patients.medical_record_number, EXCLUDED.medical_record_number),
+            facility_id = COALESCE(EXCLUDED.facility_id, patients.facility_id)
+        RETURNING user_id, (xmax = 0) AS inserted
+    """)).all()
+    # The patient's facility after the upsert is the one scoring routes by
+    rows = db.execute(text("""
+        UPDATE import_stage s SET patient_id = p.id, facility_id = p.facility_id
+        FROM patients p WHERE p.user_id = s.user_id
+        RETURNING s.line, s.email, s.mrn, s.user_id, s.patient_id, s.facility_id
+    """)).all()
+
+    # Cached identities (including "no patient yet" answers) for these
+    # emails/MRNs are stale; one NOTIFY for the chunk, not one per row
+    new_patient_users = {r.user_id for r in created if r.inserted}
+    identity.invalidate_many(db, [{"email": r.email, "mrn": r.mrn, "patient_id": r.patient_id,
+                                   "user_id": r.user_id} for r in rows])
+    return {"patients": {r.line: r.patient_id for r in rows},
+            "facilities": {r.line: r.facility_id for r in rows},
+            "created_users": len(new_emails), "created_patients": len(new_patient_users)}
+
+# ---------- Scoring ----------
+def score(db: Session, clean: pd.DataFrame, patients: Dict[int, int],
+          facilities: Dict[int, Optional[int]]) -> int:
+    rows = clean[clean["scorable"] & clean["line"].isin(list(patients))].copy()
+    if rows.empty:
+        return 0
+    rows[INT_COLS] = rows[INT_COLS].astype(int)
+    rows["patient_id"] = rows["line"].map(patients)
+    # Last row wins if a patient appears twice (emails are unique, so it doesn't)
+    rows = rows.drop_duplicates("patient_id", keep="last")
+
+    out = {"pid": [], "rc": [], "rs": [], "pr": [], "reasons": [], "thr": []}
+    # Facilities were resolved in the staging table (the row's, else the
+    # patient's stored one), so routing is one lookup per facility, no SELECTs
+    fids = [facilities.get(line) for line in rows["line"]]
+    names = {f: model_pool.bundle_name(db, f, None, None) for f in set(fids)}
+    rows["bundle"] = [names[f] for f in fids]
+    for name, group in rows.groupby("bundle", sort=False):
+        bundle = model_pool.pool.get(name) or model_pool.pool.default
+        X = np.zeros((len(group), len(bundle.features)), dtype=np.float32)
+        for col, (feat, _, _) in NUMERIC.items():
+            X[:, bundle.feat_index[feat]] = group[col].to_numpy(dtype=np.float32)
+        for col, feat in BINARY.items():
+            X[:, bundle.feat_index[feat]] = group[col].to_numpy(dtype=np.float32)
+        scores = np.round(score_matrix(bundle, X), 4)
+        for rec, s in zip(group.itertuples(index=False), scores):
+            priority, reasons = _priority_reasons(rec)
+            out["pid"].append(int(rec.patient_id))
+            out["rc"].append("High" if s >= bundle.threshold else "Low")
+            out["rs"].append(float(s))
+            out["pr"].append(priority)
+            out["reasons"].append(json.dumps(reasons))
+            out["thr"].append(bundle.threshold)
+
+    db.execute(text("""
+        INSERT INTO gh_predictions (patient_id, risk_class, risk_score, priority, reasons, threshold_used)
+        SELECT pid, rc, rs, pr, CAST(reasons AS JSONB), thr
+        FROM unnest(CAST(:pid AS INTEGER[]), CAST(:rc AS TEXT[]), CAST(:rs AS DOUBLE PRECISION[]),
+                    CAST(:pr AS BOOLEAN[]), CAST(:reasons AS TEXT[]), CAST(:thr AS DOUBLE PRECISION[]))
+             AS t(pid, rc, rs, pr, reasons, thr)
+    """), out)
+    cohort.on_predictions(db, list(zip(out["pid"], out["rc"], out["pr"], out["rs"], out["thr"])))
+    versions.bump(db, *[(versions.RISK, pid) for pid in out["pid"]])
+    db.info["scored"] = list(zip(out["pid"], out["rs"], out["thr"]))
+    return len(out["pid"])
+
+# ---------- Pipeline ----------
+def import_csv(source, do_score: bool = True, chunk_rows: int = CHUNK_ROWS) -> dict:
+    t0 = time.perf_counter()
+    report = {"rows": 0, "imported": 0, "created_users": 0, "created_patients": 0,
+              "scored": 0, "failed_rows": 0, "errors": []}
+    seen_emails, seen_mrns = set(), set()
+
+    if do_score:
+        with SessionLocal() as db:  # the bulk insert can't retry per row like save_prediction
+            prediction_history.ensure_partitions(db.connection())
+            db.commit()
+
+    reader = pd.read_csv(source, dtype=str, chunksize=chunk_rows, skipinitialspace=True,
+                         keep_default_na=False, na_values=[""])
+    for chunk in reader:
+        chunk.columns = [c.strip().lower() for c in chunk.columns]
+        if "email" not in chunk:
+            raise ValueError("CSV needs an email column")
+        report["rows"] += len(chunk)
+        clean, errors = validate(chunk, seen_emails, seen_mrns)
+        if not clean.empty:
+            try:
+                with SessionLocal() as db:
+                    up = upsert(db, clean, errors)
+                    scored = score(db, clean, up["patients"], up["facilities"]) if do_score else 0
+                    db.commit()
+                    for pid, s, thr in db.info.pop("scored", []):
+                        thresholds.on_prediction(pid, s, thr)
+                report["imported"] += len(up["patients"])
+                report["created_users"] += up["created_users"]
+                report["created_patients"] += up["created_patients"]
+                report["scored"] += scored
+            except Exception as e:
+                log.error("[import] chunk at line %d failed: %s", int(clean["line"].iloc[0]), e, exc_info=True)
+                for line in clean["line"]:
+                    errors.setdefault(int(line), []).append(f"chunk failed: {e}")
+        report["failed_rows"] += len(errors)
+        room = MAX_ERRORS - len(report["errors"])
+        if room > 0:
+            report["errors"].extend({"line": line, "errors": msgs} for line, msgs in sorted(errors.items())[:room])
+
+    secs = time.perf_counter() - t0
+    report["errors_truncated"] = report["failed_rows"] > len(report["errors"])
+    report["seconds"] = round(secs, 3)
+    report["rows_per_second"] = round(report["rows"] / secs, 1) if secs else None
+    log.info("[import] %d rows, %d imported, %d scored, %d failed in %.1fs",
+             report["rows"], report["imported"], report["scored"], report["failed_rows"], secs)
+    return report
+
+# ---------- Endpoint ----------
+@router.post("/patients/import")
+async def import_cohort(
+    request: Request,
+    score: bool = Query(True, description="Score rows that have all nine clinical values"),
+    _user: dict = Depends(require_role("admin", "clinician")),
+):
+    # Spool the upload so the import reads it in chunks, never as one string
+    spool = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    size = 0
+    async for part in request.stream():
+        size += len(part)
+        if size > MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"CSV larger than {MAX_BYTES // 2**20} MB")
+        spool.write(part)
+    if not size:
+        raise HTTPException(status_code=400, detail="Empty body; send the CSV as text/csv")
+    spool.seek(0)
+    try:
+        return await run_in_threadpool(import_csv, spool, score)
+    except (ValueError, pd.errors.ParserError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        spool.close()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Import a cohort CSV")
+    ap.add_argument("csv")
+    ap.add_argument("--no-score", action="store_true")
+    ap.add_argument("--chunk", type=int, default=CHUNK_ROWS)
+    args = ap.parse_args()
+    print(json.dumps(import_csv(args.csv, not args.no_score, args.chunk), indent=1))
@@ -0,0 +1,164 @@
+# backend/app/dashboard.py
+from typing import Optional, List
+
+from fastapi import APIRouter, HTTPException, Depends, Query
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+
+from .db import get_db
+from . import prediction_history, identity
+
+router = APIRouter(prefix="/dashboard", tags=["dashboard"])
+
+# ---------- Schemas ----------
+class ProfileOut(BaseModel):
+    id: int
+    full_name: Optional[str] = None
+    email: Optional[str] = None
+    phone_number: Optional[str] = None
+
+class AppointmentSection(BaseModel):
+    id: int
+    last_visit: Optional[str] = None
+    next_visit: Optional[str] = None
+    scheduled_for: Optional[str] = None
+    status: Optional[str] = None
+
+class RiskSection(BaseModel):
+    risk_class: str
+    risk_score: float
+    priority: bool = False
+    reasons: List[str] = []
+    threshold_used: Optional[float] = None
+    created_at: Optional[str] = None
+
+class AdviceItem(BaseModel):
+    id: int
+    patient_id: int
+    text: str
+    created_at: str
+
+class PatientDashboardOut(BaseModel):
+    profile: ProfileOut
+    appointment: Optional[AppointmentSection] = None
+    risk: Optional[RiskSection] = None
+    advice: List[AdviceItem] = []
+    empty_sections: List[str] = []
+
+# ---------- Query ----------
+# One statement: the profile CTE resolves the patient, every other section is
+# a correlated subquery rendered to JSON server-side. Sections without rows
+# come back NULL / [] instead of failing the whole bundle.
+_BUNDLE_SQL = """
+    WITH p AS (
+        SELECT p.id,
+               COALESCE(u.full_name, u.email) AS full_name,
+               u.email,
+               u.phone AS phone_number
+        FROM patients p
+        JOIN users u ON u.id = p.user_id
+        WHERE {match}
+        LIMIT 1
+    )
+    SELECT
+        row_to_json(p) AS profile,
+        (
+            SELECT row_to_json(a) FROM (
+                SELECT a.id,
+                       to_char(a.last_visit, 'YYYY-MM-DD') AS last_visit,
+                       to_char(a.next_visit, 'YYYY-MM-DD') AS next_visit,
+                       a.scheduled_for::text AS scheduled_for,
+                       a.status::text AS status
+                FROM appointments a
+                WHERE a.patient_id = p.id
+                ORDER BY a.next_visit DESC NULLS LAST, a.id DESC
+                LIMIT 1
+            ) a
+        ) AS appointment,
+        COALESCE(
+            (
+                SELECT row_to_json(g) FROM (
+                    SELECT risk_class, risk_score, priority,
+                           COALESCE(reasons, '[]'::jsonb) AS reasons,
+                           threshold_used, created_at
+                    FROM gh_predictions
+                    WHERE patient_id = p.id AND created_at >= :since
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT 1
+                ) g
+            ),
+            (
+                SELECT row_to_json(g) FROM (
+                    SELECT risk_class, risk_score, priority,
+                           COALESCE(reasons, '[]'::jsonb) AS reasons,
+                           threshold_used, created_at
+                    FROM gh_predictions
+                    WHERE patient_id = p.id
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT 1
+                ) g
+            )
+        ) AS risk,
+        (
+            SELECT COALESCE(json_agg(x), '[]'::json) FROM (
+                SELECT id, patient_id, text, created_at
+                FROM patient_advice
+                WHERE patient_id = p.id
+                ORDER BY created_at DESC, id DESC
+                LIMIT CAST(:advice_limit AS INTEGER)  -- NULL: all
+            ) x
+        ) AS advice
+    FROM p
+"""
+
+_MATCH_ID    = "p.id = :pid"
+_MATCH_EMAIL = "lower(u.email) = lower(:em)"
+
+def load_bundle(db: Session, key: str, advice_limit: int = 5) -> Optional[dict]:
+    """advice_limit=0 returns every advice entry."""
+    key = key.strip()
+    params = {"since": prediction_history.recent_cutoff(), "advice_limit": advice_limit or None}
+    if key.isdigit():
+        match, params["pid"] = _MATCH_ID, int(key)
+    elif "@" in key:
+        # A cached identity lets us use the primary-key variant; never adds a round trip
+        ident = identity.peek_email(key)
+        if ident and ident.patient_id:
+            match, params["pid"] = _MATCH_ID, ident.patient_id
+        else:
+            match, params["em"] = _MATCH_EMAIL, key
+    else:
+        return None
+    return db.execute(text(_BUNDLE_SQL.format(match=match)), params).mappings().first()
+
+# ---------- Endpoint ----------
+@router.get("/patient/{key}", response_model=PatientDashboardOut)
+def patient_dashboard(
+    key: str,
+    advice_limit: int = Query(5, ge=0, le=50, description="0 = all advice"),
+    db: Session = Depends(get_db),
+):
+    """
+    Everything the patient dashboard needs (profile, latest appointment,
+    latest GH risk, recent advice) for a patient id or email, in one query.
+    """
+    row = load_bundle(db, key, advice_limit)
+    if not row or not row["profile"]:
+        raise HTTPException(status_code=404, detail="Patient not found")
+
+    risk = row["risk"]
+    if risk:
+        risk = dict(risk, reasons=[str(r) for r in (risk.get("reasons") or [])])
+    advice = row["advice"] or []
+
+    empty = [name for name, val in (("appointment", row["appointment"]),
+                                     ("risk", risk),
+                                     ("advice", advice)) if not val]
+    return PatientDashboardOut(
+        profile=row["profile"],
+        appointment=row["appointment"],
+        risk=risk,
+        advice=advice,
+        empty_sections=empty,
+    )
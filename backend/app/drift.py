@@ -0,0 +1,259 @@
+# backend/app/drift.py
+#
+# Input drift monitoring for the nine production features.
+#   - Every feature has fixed bins (uniform lo..hi, out-of-range values go
+#     to the end bins), so a histogram is a short list of counts: O(1)
+#     memory per feature no matter how many predictions are observed.
+#   - observe() is called on every /gh/predict-gh request and only bumps
+#     in-process counters. A flusher thread adds them to drift_histograms,
+#     one row per (feature, hour), so all workers' counts end up together.
+#   - The reference histograms are computed once from the training set:
+#         python -m app.drift --build-reference path/to/X_train.csv
+#     and stored next to the model as drift_reference.json.
+#   - GET /drift/summary scores each window (PSI and a binned KS statistic)
+#     from those hourly rows, never from stored predictions. A window with
+#     fewer than DRIFT_MIN_SAMPLES values is "insufficient_data" (psi/ks null)
+#     rather than a false drift alarm on a quiet facility or hour.
+import argparse
+import json
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .db import get_db, engine
+
+router = APIRouter(prefix="/drift", tags=["drift"])
+log = logging.getLogger("uvicorn.error")
+
+MODEL_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "ml_model"))
+REFERENCE_PATH = os.getenv("DRIFT_REFERENCE", os.path.join(MODEL_DIR, "drift_reference.json"))
+FLUSH_SECONDS = int(os.getenv("DRIFT_FLUSH_SECONDS", "60"))
+BUCKET_SECONDS = 3600
+PSI_EPS = 1e-4
+# Fewer live values than this in a window and PSI/KS are noise, not drift
+MIN_SAMPLES = int(os.getenv("DRIFT_MIN_SAMPLES", "50"))
+
+# feature -> (lo, hi, n_bins); ranges follow PredictIn's validation bounds
+BINS: Dict[str, tuple] = {
+    "Age":                    (10.0, 60.0, 25),
+    "BMI":                    (10.0, 80.0, 28),
+    "Systolic BP":            (60.0, 250.0, 38),
+    "Diastolic BP":           (40.0, 150.0, 22),
+    "Heart Rate":             (40.0, 220.0, 36),
+    "Previous Complications": (0.0, 2.0, 2),
+    "Preexisting Diabetes":   (0.0, 2.0, 2),
+    "Gestational Diabetes":   (0.0, 2.0, 2),
+    "Mental Health":          (0.0, 2.0, 2),
+}
+FEATURES = list(BINS)
+
+# ---------- Schema ----------
+with engine.begin() as conn:
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS drift_histograms (
+            feature TEXT NOT NULL,
+            bucket_start TIMESTAMPTZ NOT NULL,
+            counts BIGINT[] NOT NULL,
+            PRIMARY KEY (feature, bucket_start)
+        )
+    """))
+
+# ---------- Binning ----------
+def bin_index(feature: str, value: float) -> int:
+    lo, hi, n = BINS[feature]
+    i = int((value - lo) * n / (hi - lo)) if value == value else 0  # NaN -> first bin
+    return 0 if i < 0 else n - 1 if i >= n else i
+
+def histogram(feature: str, values) -> List[int]:
+    """Counts for an iterable/array of values (used to build the reference)."""
+    import numpy as np
+    lo, hi, n = BINS[feature]
+    v = np.asarray(values, dtype=float)
+    v = v[~np.isnan(v)]
+    idx = np.clip(((v - lo) * n / (hi - lo)).astype(int), 0, n - 1)
+    return np.bincount(idx, minlength=n).astype(int).tolist()
+
+# ---------- Reference ----------
+def _load_reference() -> Optional[Dict[str, List[int]]]:
+    if not os.path.isfile(REFERENCE_PATH):
+        log.warning("[drift] %s missing; run python -m app.drift --build-reference", REFERENCE_PATH)
+        return None
+    try:
+        ref = json.load(open(REFERENCE_PATH))
+    except Exception as e:
+        log.warning("[drift] could not read %s: %s", REFERENCE_PATH, e)
+        return None
+    if ref.get("bins") != {f: list(b) for f, b in BINS.items()}:
+        log.warning("[drift] reference bins differ from BINS; rebuild the reference")
+        return None
+    return ref["counts"]
+
+_reference = _load_reference()
+
+def build_reference(csv_path: str, out_path: str = REFERENCE_PATH, chunksize: int = 100_000) -> dict:
+    import pandas as pd
+    counts = {f: [0] * BINS[f][2] for f in FEATURES}
+    rows = 0
+    for chunk in pd.read_csv(csv_path, usecols=FEATURES, chunksize=chunksize):
+        rows += len(chunk)
+        for f in FEATURES:
+            h = histogram(f, pd.to_numeric(chunk[f], errors="coerce").to_numpy())
+            counts[f] = [a + b for a, b in zip(counts[f], h)]
+    ref = {"source": os.path.basename(csv_path), "rows": rows,
+           "bins": {f: list(b) for f, b in BINS.items()}, "counts": counts}
+    with open(out_path, "w") as fh:
+        json.dump(ref, fh)
+    return ref
+
+# ---------- Live counts ----------
+_lock = threading.Lock()
+_pending: Dict[int, Dict[str, List[int]]] = {}   # bucket epoch -> feature -> counts
+
+def observe(values: Dict[str, float]):
+    """Record one prediction's inputs (feature name -> value). Constant time."""
+    bucket = int(time.time()) // BUCKET_SECONDS * BUCKET_SECONDS
+    idx = [(f, bin_index(f, float(values[f]))) for f in FEATURES if f in values]
+    with _lock:
+        hist = _pending.get(bucket)
+        if hist is None:
+            hist = _pending[bucket] = {f: [0] * BINS[f][2] for f in FEATURES}
+        for f, i in idx:
+            hist[f][i] += 1
+
+def flush() -> int:
+    """Add pending counts to drift_histograms; returns rows written."""
+    global _pending
+    with _lock:
+        pending, _pending = _pending, {}
+    rows = [{"f": f, "b": datetime.fromtimestamp(bucket, timezone.utc), "c": counts}
+            for bucket, hist in pending.items() for f, counts in hist.items() if any(counts)]
+    if not rows:
+        return 0
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO drift_histograms (feature, bucket_start, counts)
+                VALUES (:f, :b, CAST(:c AS BIGINT[]))
+                ON CONFLICT (feature, bucket_start) DO UPDATE
+                SET counts = (
+                    SELECT array_agg(COALESCE(x.a, 0) + COALESCE(x.b, 0) ORDER BY x.i)
+                    FROM unnest(drift_histograms.counts, EXCLUDED.counts) WITH ORDINALITY AS x(a, b, i)
+                )
+            """), rows)
+    except Exception:
+        # Put the counts back so the next flush retries them
+        with _lock:
+            for bucket, hist in pending.items():
+                cur = _pending.setdefault(bucket, {f: [0] * BINS[f][2] for f in FEATURES})
+                for f, counts in hist.items():
+                    cur[f] = [a + b for a, b in zip(cur[f], counts)]
+        raise
+    return len(rows)
+
+def _flush_loop(interval: int):
+    while True:
+        time.sleep(interval)
+        try:
+            flush()
+        except Exception as e:
+            log.error("[drift] flush failed: %s", e)
+
+def start_flusher(interval: int = FLUSH_SECONDS):
+    if interval <= 0:
+        return None
+    t = threading.Thread(target=_flush_loop, args=(interval,), name="drift-flush", daemon=True)
+    t.start()
+    return t
+
+# ---------- Scores ----------
+def _proportions(counts: List[int]) -> List[float]:
+    total = float(sum(counts))
+    return [c / total for c in counts] if total else [0.0] * len(counts)
+
+def psi(expected: List[int], actual: List[int]) -> float:
+    e, a = _proportions(expected), _proportions(actual)
+    return sum((ai - ei) * math.log(max(ai, PSI_EPS) / max(ei, PSI_EPS)) for ei, ai in zip(e, a))
+
+def ks(expected: List[int], actual: List[int]) -> float:
+    """Max CDF distance over the shared bins (a lower bound on the exact KS statistic)."""
+    e, a = _proportions(expected), _proportions(actual)
+    ce = ca = d = 0.0
+    for ei, ai in zip(e, a):
+        ce += ei; ca += ai
+        d = max(d, abs(ce - ca))
+    return d
+
+def _level(score: float) -> str:
+    # Conventional PSI bands
+    return "stable" if score < 0.1 else "moderate" if score < 0.25 else "drift"
+
+def window_counts(db: Session, hours: int) -> Dict[str, List[int]]:
+    since = datetime.now(timezone.utc) - timedelta(hours=hours)
+    rows = db.execute(text("""
+        SELECT feature, counts FROM drift_histograms
+        WHERE bucket_start >= :since
+    """), {"since": since.replace(minute=0, second=0, microsecond=0)}).all()
+    out = {f: [0] * BINS[f][2] for f in FEATURES}
+    for r in rows:
+        if r.feature in out and len(r.counts) == len(out[r.feature]):
+            out[r.feature] = [a + b for a, b in zip(out[r.feature], r.counts)]
+    # Include this worker's not-yet-flushed counts
+    cutoff = since.timestamp() - BUCKET_SECONDS
+    with _lock:
+        for bucket, hist in _pending.items():
+            if bucket >= cutoff:
+                for f, counts in hist.items():
+                    out[f] = [a + b for a, b in zip(out[f], counts)]
+    return out
+
+# ---------- Endpoints ----------
+@router.get("/summary")
+def drift_summary(windows: str = Query("24,168", description="Comma-separated window lengths in hours"),
+                  db: Session = Depends(get_db)):
+    if _reference is None:
+        raise HTTPException(status_code=503, detail="Drift reference not built")
+    try:
+        hours = sorted({int(h) for h in windows.split(",") if h.strip()})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="windows must be integers (hours)")
+    if not hours or hours[0] < 1 or hours[-1] > 24 * 366:
+        raise HTTPException(status_code=400, detail="windows must be between 1 and 8784 hours")
+
+    out = {}
+    for h in hours:
+        live = window_counts(db, h)
+        features = {}
+        for f in FEATURES:
+            n = sum(live[f])
+            if n < max(MIN_SAMPLES, 1):
+                features[f] = {"n": n, "psi": None, "ks": None, "level": "insufficient_data"}
+                continue
+            p = psi(_reference[f], live[f])
+            features[f] = {"n": n, "psi": round(p, 4),
+                           "ks": round(ks(_reference[f], live[f]), 4), "level": _level(p)}
+        out[f"{h}h"] = features
+    return {"reference_rows": sum(_reference[FEATURES[0]]), "windows": out}
+
+@router.get("/bins")
+def drift_bins():
+    return {"bins": {f: {"lo": lo, "hi": hi, "n": n} for f, (lo, hi, n) in BINS.items()},
+            "reference": _reference}
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Drift monitor maintenance")
+    ap.add_argument("--build-reference", metavar="X_TRAIN_CSV",
+                    help="compute reference histograms from the training features")
+    ap.add_argument("--out", default=REFERENCE_PATH)
+    args = ap.parse_args()
+    if args.build_reference:
+        ref = build_reference(args.build_reference, args.out)
+        print({"rows": ref["rows"], "out": args.out})
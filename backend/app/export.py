@@ -0,0 +1,285 @@
+# backend/app/export.py
+#
+# Bulk extracts for researchers / MoH reporting:
+#   GET /export/{dataset}?start=&end=&facility_id=&format=csv|parquet&pseudonymize=true
+#   python -m app.export predictions --start 2025-01-01 --end 2025-07-01 --format parquet --out preds.parquet
+# datasets: predictions (gh_predictions), patient_risk, appointments.
+#
+# Rows come off a server-side cursor in EXPORT_BATCH-row partitions and
+# each partition is written and handed on before the next is fetched, so
+# memory stays flat however many rows match. CSV is written per batch;
+# Parquet (needs pyarrow) writes one row group per batch into a sink the
+# response drains. The generator is synchronous, so Starlette runs it in
+# the threadpool and the event loop keeps serving; EXPORT_MAX_CONCURRENT
+# caps how many pool connections exports can hold at once.
+#
+# pseudonymize replaces patient_id with HMAC-SHA256(EXPORT_PSEUDONYM_KEY, id)
+# (first 16 hex chars): stable across extracts with the same key, so
+# researchers can link rows, but not reversible without it.
+import argparse
+import csv
+import functools
+import hashlib
+import hmac
+import io
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import date, datetime
+from typing import Iterator, List, NamedTuple, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import text
+
+from .db import engine
+from .session_tokens import require_role
+from .slots import DEFAULT_FACILITY
+
+router = APIRouter(prefix="/export", tags=["export"])
+log = logging.getLogger("uvicorn.error")
+
+BATCH_SIZE     = int(os.getenv("EXPORT_BATCH", "10000"))
+MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "2"))
+PSEUDONYM_KEY  = os.getenv("EXPORT_PSEUDONYM_KEY", "")
+
+class Dataset(NamedTuple):
+    table: str
+    columns: List[tuple]   # (SQL expression, output name, arrow type name)
+    day: str               # expression filtered by start/end
+
+DATASETS = {
+    "predictions": Dataset("gh_predictions", [
+        ("id", "id", "int64"), ("patient_id", "patient_id", "int64"),
+        ("risk_class", "risk_class", "string"), ("risk_score", "risk_score", "float64"),
+        ("priority", "priority", "bool"), ("threshold_used", "threshold_used", "float64"),
+        ("reasons::text", "reasons", "string"), ("created_at", "created_at", "timestamp"),
+    ], "created_at"),
+    "patient_risk": Dataset("patient_risk", [
+        ("id", "id", "int64"), ("patient_id", "patient_id", "int64"),
+        ("risk_class", "risk_class", "string"), ("risk_score", "risk_score", "float64"),
+        ("priority", "priority", "bool"), ("screen_thr", "screen_thr", "float64"),
+        ("priority_thr", "priority_thr", "float64"), ("created_at", "created_at", "timestamp"),
+    ], "created_at"),
+    "appointments": Dataset("appointments", [
+        ("id", "id", "int64"), ("patient_id", "patient_id", "int64"),
+        ("status::text", "status", "string"), ("scheduled_for", "scheduled_for", "date"),
+        ("last_visit", "last_visit", "date"), ("next_visit", "next_visit", "date"),
+        ("facility_id", "facility_id", "int64"), ("clinician_id", "clinician_id", "int64"),
+        ("created_at", "created_at", "timestamp"),
+    ], "COALESCE(scheduled_for, next_visit)"),
+}
+
+_slots = threading.BoundedSemaphore(MAX_CONCURRENT)
+
+# ---------- Pseudonymization ----------
+@functools.lru_cache(maxsize=65536)
+def pseudonym(patient_id: int) -> str:
+    return hmac.new(PSEUDONYM_KEY.encode("utf-8"), str(patient_id).encode("ascii"),
+                    hashlib.sha256).hexdigest()[:16]
+
+# ---------- Query ----------
+def build_query(ds: Dataset, start: Optional[date], end: Optional[date],
+                facility_id: Optional[int]):
+    where, params = [], {}
+    if start:
+        where.append(f"{ds.day} >= :start")
+        params["start"] = start
+    if end:
+        where.append(f"{ds.day} < :end")
+        params["end"] = end
+    if facility_id is not None:
+        where.append("patient_id IN (SELECT id FROM patients "
+                     "WHERE COALESCE(facility_id, :default_facility) = :facility_id)")
+        params.update(facility_id=facility_id, default_facility=DEFAULT_FACILITY)
+    select = ", ".join(f"{expr} AS {name}" for expr, name, _ in ds.columns)
+    sql = f"SELECT {select} FROM {ds.table}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return text(sql + f" ORDER BY {ds.day}, id"), params
+
+def _batches(ds: Dataset, stmt, params, pseudonymize: bool) -> Iterator[list]:
+    pid_col = [name for _, name, _ in ds.columns].index("patient_id")
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=BATCH_SIZE).execute(stmt, params)
+        for batch in result.partitions(BATCH_SIZE):
+            if pseudonymize:
+                rows = []
+                for r in batch:
+                    r = list(r)
+                    r[pid_col] = pseudonym(r[pid_col]) if r[pid_col] is not None else None
+                    rows.append(r)
+                yield rows
+            else:
+                yield batch
+
+# ---------- Writers ----------
+def _csv_value(v):
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    return "" if v is None else v
+
+def write_csv(ds: Dataset, batches, pseudonymized: bool = False) -> Iterator[bytes]:
+    buf = io.StringIO()
+    w = csv.writer(buf, lineterminator="\n")
+    w.writerow([name for _, name, _ in ds.columns])
+    for batch in batches:
+        w.writerows([_csv_value(v) for v in r] for r in batch)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+class _Sink:
+    """Write-only file object for pyarrow; take() hands over what was written so far."""
+
+    def __init__(self):
+        self._chunks, self._pos, self.closed = [], 0, False
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        out, self._chunks = b"".join(self._chunks), []
+        return out
+
+def _arrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        return None, None
+    return pa, pq
+
+def write_parquet(ds: Dataset, batches, pseudonymized: bool = False) -> Iterator[bytes]:
+    pa, pq = _arrow()
+    types = {"int64": pa.int64(), "float64": pa.float64(), "bool": pa.bool_(), "string": pa.string(),
+             "date": pa.date32(), "timestamp": pa.timestamp("us", tz="UTC")}
+    schema = pa.schema([
+        pa.field(name, pa.string() if pseudonymized and name == "patient_id" else types[t])
+        for _, name, t in ds.columns
+    ])
+    sink = _Sink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    for batch in batches:
+        cols = list(zip(*batch))
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(c, type=f.type) for c, f in zip(cols, schema)], schema=schema))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+def export_stream(dataset: str, fmt: str, start: Optional[date], end: Optional[date],
+                  facility_id: Optional[int], pseudonymize: bool) -> Iterator[bytes]:
+    ds = DATASETS[dataset]
+    stmt, params = build_query(ds, start, end, facility_id)
+    rows = 0
+    t0 = time.perf_counter()
+
+    def counted():
+        nonlocal rows
+        for batch in _batches(ds, stmt, params, pseudonymize):
+            rows += len(batch)
+            yield batch
+
+    writer = write_parquet if fmt == "parquet" else write_csv
+    yield from writer(ds, counted(), pseudonymize)
+    log.info("[export] %s %s: %d rows in %.1fs", dataset, fmt, rows, time.perf_counter() - t0)
+
+def _check(dataset: str, fmt: str, pseudonymize: bool):
+    if dataset not in DATASETS:
+        raise ValueError(f"Unknown dataset {dataset}; one of {sorted(DATASETS)}")
+    if fmt not in ("csv", "parquet"):
+        raise ValueError("format must be csv or parquet")
+    if fmt == "parquet" and _arrow()[0] is None:
+        raise ValueError("Parquet export needs pyarrow")
+    if pseudonymize and not PSEUDONYM_KEY:
+        raise ValueError("Set EXPORT_PSEUDONYM_KEY to pseudonymize patient ids")
+
+class _Guarded:
+    """Holds an export slot until the stream ends, fails or is dropped unread."""
+
+    def __init__(self, stream: Iterator[bytes]):
+        self._stream, self._held = stream, True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        try:
+            return next(self._stream)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self._held:
+            self._held = False
+            _slots.release()
+            self._stream.close()
+
+    __del__ = close
+
+# ---------- Endpoint ----------
+@router.get("/{dataset}")
+def export_dataset(
+    dataset: str,
+    start: Optional[date] = Query(None),
+    end: Optional[date] = Query(None, description="Exclusive"),
+    facility_id: Optional[int] = Query(None),
+    format: str = Query("csv"),
+    pseudonymize: bool = Query(True),
+    _admin: dict = Depends(require_role("admin")),
+):
+    try:
+        _check(dataset, format, pseudonymize)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not _slots.acquire(blocking=False):
+        raise HTTPException(status_code=429, detail="Too many exports running; retry later")
+
+    stamp = f"{start or 'all'}_{end or 'now'}"
+    ext, media = ("parquet", "application/vnd.apache.parquet") if format == "parquet" else ("csv", "text/csv")
+    return StreamingResponse(
+        _Guarded(export_stream(dataset, format, start, end, facility_id, pseudonymize)),
+        media_type=media,
+        headers={"Content-Disposition": f'attachment; filename="{dataset}_{stamp}.{ext}"'},
+    )
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Export predictions/appointments")
+    ap.add_argument("dataset", choices=sorted(DATASETS))
+    ap.add_argument("--start", type=date.fromisoformat)
+    ap.add_argument("--end", type=date.fromisoformat, help="exclusive")
+    ap.add_argument("--facility", type=int)
+    ap.add_argument("--format", choices=("csv", "parquet"), default="csv")
+    ap.add_argument("--pseudonymize", action="store_true")
+    ap.add_argument("--out", help="output file (default: stdout)")
+    args = ap.parse_args()
+    try:
+        _check(args.dataset, args.format, args.pseudonymize)
+    except ValueError as e:
+        ap.error(str(e))
+    out = open(args.out, "wb") if args.out else sys.stdout.buffer
+    try:
+        for chunk in export_stream(args.dataset, args.format, args.start, args.end,
+                                   args.facility, args.pseudonymize):
+            out.write(chunk)
+    finally:
+        if args.out:
+            out.close()
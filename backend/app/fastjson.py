@@ -0,0 +1,94 @@
+# backend/app/fastjson.py
+#
+# Fast response path for hot read endpoints: DB rows (tuples) go straight to
+# JSON bytes through a per-shape function generated once at import time,
+# skipping pydantic model construction, jsonable_encoder and the stdlib
+# encoder. Uses orjson when installed, stdlib json otherwise.
+#
+#   PATIENT_ROW = RowSerializer(["id", "full_name", ...])
+#   return json_response(PATIENT_ROW.dumps(rows), response)
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Callable, Dict, Optional, Sequence
+
+from fastapi import Response
+
+try:
+    import orjson
+
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+except ImportError:  # pragma: no cover - depends on environment
+    import json
+
+    def _default(o):
+        if isinstance(o, (datetime, date)):
+            return o.isoformat()
+        if isinstance(o, Decimal):
+            return float(o)
+        raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+    def dumps(obj) -> bytes:
+        return json.dumps(obj, default=_default, ensure_ascii=False,
+                          separators=(",", ":")).encode("utf-8")
+
+
+# ---------- Common converters ----------
+def iso(v):
+    return v.isoformat()
+
+def to_float(v):
+    return float(v)
+
+def to_bool(v):
+    return bool(v)
+
+def to_str(v):
+    return str(v)
+
+
+class RowSerializer:
+    """
+    Compiles `fields` (in SELECT order) into a function that turns a row
+    tuple into a dict. `converters` maps field -> callable applied to
+    non-NULL values only. With by_name=True rows are mappings and are read
+    by column name instead of position.
+    """
+
+    def __init__(self, fields: Sequence[str], converters: Optional[Dict[str, Callable]] = None,
+                 by_name: bool = False):
+        self.fields = list(fields)
+        converters = converters or {}
+        ns = {}
+        items = []
+        for i, f in enumerate(self.fields):
+            col = f"r[{f!r}]" if by_name else f"r[{i}]"
+            if f in converters:
+                ns[f"c{i}"] = converters[f]
+                items.append(f"{f!r}: (c{i}({col}) if {col} is not None else None)")
+            else:
+                items.append(f"{f!r}: {col}")
+        body = "{" + ", ".join(items) + "}"
+        src = (
+            f"def one(r):\n    return {body}\n"
+            f"def many(rows):\n    return [{body} for r in rows]\n"
+        )
+        exec(compile(src, f"<RowSerializer {','.join(self.fields)}>", "exec"), ns)
+        self.one, self.many = ns["one"], ns["many"]
+
+    def dumps(self, rows) -> bytes:
+        return dumps(self.many(rows))
+
+    def dumps_one(self, row) -> bytes:
+        return dumps(self.one(row))
+
+
+def json_response(content: bytes, response: Optional[Response] = None,
+                  status_code: int = 200) -> Response:
+    """Wrap pre-encoded JSON, carrying over headers set on the injected Response (ETag etc.)."""
+    out = Response(content=content, status_code=status_code, media_type="application/json")
+    if response is not None:
+        for k, v in response.headers.items():
+            if k.lower() not in ("content-length", "content-type"):
+                out.headers[k] = v
+    return out
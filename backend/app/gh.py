@@ -13,6 +13,7 @@ from sqlalchemy.orm import Session
 
 from .db import get_db
 from .models_risk import PatientRisk
+from . import artifacts
 
 ROOT_ML   = "/Users/caesararuasa/GH_Risk_predictor_system/ml_model"
 ROOT_OUT  = "/Users/caesararuasa/GH_Risk_predictor_system/backend/ml_model"
@@ -37,7 +38,10 @@ except Exception:
 with open(FEAT_JSON) as f:
     FEATURE_ORDER: List[str] = json.load(f)
 
-if os.path.isfile(XTRAIN_PATH):
+_mmap_medians = artifacts.train_medians(os.path.join(ROOT_OUT, "mmap"))
+if _mmap_medians:
+    TRAIN_MEDIANS: Dict[str, float] = _mmap_medians
+elif os.path.isfile(XTRAIN_PATH):
     _Xtrain = pd.read_csv(XTRAIN_PATH)
     TRAIN_MEDIANS: Dict[str, float] = {c: float(pd.to_numeric(_Xtrain[c], errors="coerce").median()) for c in _Xtrain.columns}
 else:
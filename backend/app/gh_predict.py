@@ -1,14 +1,18 @@
 # backend/app/gh_predict.py
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
 from pydantic import BaseModel, Field, validator
 from sqlalchemy.orm import Session
 from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
 from typing import Optional, List
-import joblib, json, os, numpy as np, logging, traceback
+import joblib, json, os, numpy as np, logging
 
 from .db import get_db, engine
+from . import prediction_history, cohort, versions, drift, thresholds, artifacts, model_pool
+from .fastjson import RowSerializer, json_response, iso, to_float, to_bool
 
 router = APIRouter()
+log = logging.getLogger("uvicorn.error")
 
 # -------------------------------------------------
 #                MODEL / ARTIFACTS
@@ -23,11 +27,16 @@ THR_JSON   = os.path.join(MODEL_DIR, "threshold.json")
 FEAT_JSON  = os.path.join(MODEL_DIR, "feature_order.json")
 RULES_JSON = os.path.join(MODEL_DIR, "post_rules.json")
 
+_rss_before_load = artifacts.rss()
 _model = None
-for p in POSSIBLE_MODEL_FILES:
-    if os.path.isfile(p):
-        _model = joblib.load(p)
-        break
+if artifacts.available():
+    # Weights memory-mapped from ml_model/mmap, shared by all workers on the node
+    _model = artifacts.load_model()
+else:
+    for p in POSSIBLE_MODEL_FILES:
+        if os.path.isfile(p):
+            _model = joblib.load(p)
+            break
 if _model is None:
     raise RuntimeError(f"TabNet model not found in {POSSIBLE_MODEL_FILES}. Train/export first.")
 
@@ -40,9 +49,15 @@ if os.path.isfile(THR_JSON):
     except Exception:
         _threshold = 0.5
 if _threshold < 0.05 or _threshold > 0.95:
-    logging.getLogger("uvicorn.error").warning(f"[GH] Threshold {_threshold} looks suspicious; clamping to 0.5")
+    log.warning("[GH] Threshold %s looks suspicious; clamping to 0.5", _threshold)
     _threshold = 0.5
 
+_rss_after_load = artifacts.rss()
+log.info(
+    f"[GH] model loaded ({'mmap' if artifacts.available() else 'pickle'}): "
+    f"rss {_rss_before_load.get('rss_kb')} -> {_rss_after_load.get('rss_kb')} kB"
+)
+
 # Feature order from training export
 if not os.path.isfile(FEAT_JSON):
     raise RuntimeError("feature_order.json missing. Export it during training.")
@@ -66,6 +81,9 @@ _missing_crit = [f for f in EXPECTED_9 if f not in _feat_index]
 if _missing_crit:
     raise RuntimeError(f"Trained features missing critical fields: {_missing_crit}")
 
+# Requests routed to no other bundle (see model_pool.py) use this model
+model_pool.pool.set_default(model_pool.make_bundle(model_pool.DEFAULT, _model, _iso, _threshold, _features))
+
 _post_rules = {}
 if os.path.isfile(RULES_JSON):
     try:
@@ -76,55 +94,64 @@ if os.path.isfile(RULES_JSON):
 # -------------------------------------------------
 #                DB PERSISTENCE
 # -------------------------------------------------
-# Ensure table exists
-with engine.connect() as conn:
-    conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS gh_predictions (
-            id SERIAL PRIMARY KEY,
-            patient_id INTEGER NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
-            risk_class TEXT NOT NULL,
-            risk_score DOUBLE PRECISION NOT NULL,
-            priority BOOLEAN NOT NULL DEFAULT FALSE,
-            reasons JSONB,
-            threshold_used DOUBLE PRECISION,
-            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-        );
-    """))
-    conn.commit()
+# Ensure the (monthly partitioned) table and upcoming partitions exist
+prediction_history.ensure_schema(engine)
 
 def save_prediction(db: Session, patient_id: int, risk_class: str,
                     risk_score: float, priority: bool, reasons: Optional[List[str]],
                     threshold_used: float):
+    params = {
+        "pid": patient_id,
+        "rc": risk_class,
+        "rs": float(risk_score),
+        "pr": bool(priority),
+        "reasons": json.dumps(reasons or []),
+        "thr": float(threshold_used)
+    }
+    insert = text("""
+        INSERT INTO gh_predictions (patient_id, risk_class, risk_score, priority, reasons, threshold_used)
+        VALUES (:pid, :rc, :rs, :pr, CAST(:reasons AS JSONB), :thr)
+    """)
     try:
-        db.execute(text("""
-            INSERT INTO gh_predictions (patient_id, risk_class, risk_score, priority, reasons, threshold_used)
-            VALUES (:pid, :rc, :rs, :pr, CAST(:reasons AS JSONB), :thr)
-        """), {
-            "pid": patient_id,
-            "rc": risk_class,
-            "rs": float(risk_score),
-            "pr": bool(priority),
-            "reasons": json.dumps(reasons or []),
-            "thr": float(threshold_used)
-        })
+        try:
+            db.execute(insert, params)
+        except DBAPIError as e:
+            # Maintenance job hasn't run in a while: create this month's partition and retry once
+            if "no partition of relation" not in str(e.orig):
+                raise
+            db.rollback()
+            prediction_history.ensure_partitions(db.connection())
+            db.execute(insert, params)
+        cohort.on_prediction(db, patient_id, risk_class, priority, risk_score, threshold_used)
+        versions.bump(db, (versions.RISK, patient_id))
         db.commit()
-        logging.getLogger("uvicorn.error").info(f"[GH] saved prediction pid={patient_id}, rc={risk_class}, score={risk_score}")
+        thresholds.on_prediction(patient_id, risk_score, threshold_used)
+        log.info("[GH] saved prediction pid=%s rc=%s score=%s", patient_id, risk_class, risk_score,
+                 extra={"event": "gh.saved", "patient_id": patient_id})
     except Exception as e:
         db.rollback()
-        logging.getLogger("uvicorn.error").error(f"[GH] save failed: {e}")
-        traceback.print_exc()
+        log.error("[GH] save failed: %s", e, exc_info=True,
+                  extra={"event": "gh.save_failed", "patient_id": patient_id})
+
+_LATEST_SQL = """
+    SELECT id, patient_id, risk_class, risk_score, priority,
+           COALESCE(reasons, '[]'::jsonb) AS reasons,
+           COALESCE(threshold_used, 0.5) AS threshold_used,
+           created_at
+    FROM gh_predictions
+    WHERE patient_id = :pid {window}
+    ORDER BY created_at DESC, id DESC
+    LIMIT 1
+"""
 
 def latest_prediction(db: Session, patient_id: int):
-    row = db.execute(text("""
-        SELECT id, patient_id, risk_class, risk_score, priority,
-               COALESCE(reasons, '[]'::jsonb) AS reasons,
-               COALESCE(threshold_used, 0.5) AS threshold_used,
-               created_at
-        FROM gh_predictions
-        WHERE patient_id = :pid
-        ORDER BY created_at DESC, id DESC
-        LIMIT 1
-    """), {"pid": patient_id}).mappings().first()
+    # Hot path: bound created_at by a partition boundary so Postgres
+    # prunes to the recent partitions; only fall back to full history on a miss.
+    row = db.execute(text(_LATEST_SQL.format(window="AND created_at >= :since")), {
+        "pid": patient_id, "since": prediction_history.recent_cutoff()
+    }).mappings().first()
+    if row is None:
+        row = db.execute(text(_LATEST_SQL.format(window="")), {"pid": patient_id}).mappings().first()
     return row
 
 # -------------------------------------------------
@@ -132,6 +159,8 @@ def latest_prediction(db: Session, patient_id: int):
 # -------------------------------------------------
 class PredictIn(BaseModel):
     patient_id: Optional[int] = None
+    facility_id: Optional[int] = None   # model routing; defaults to the patient's facility
+    source: Optional[str] = None        # model routing by data source, e.g. "s1"
     age: int = Field(..., ge=10, le=60)
     bmi: float = Field(..., ge=10, le=80)
     systolic_bp: int = Field(..., ge=60, le=250)
@@ -157,13 +186,13 @@ class PredictOut(BaseModel):
     priority: Optional[bool] = False
     reasons: Optional[List[str]] = []
     created_at: Optional[str] = None
+    model: Optional[str] = None
 
 # -------------------------------------------------
 #             HELPER FUNCTIONS
 # -------------------------------------------------
-def _vector_from_payload(p: PredictIn):
-    row = np.zeros((1, len(_features)), dtype=np.float32)
-    values = {
+def _payload_values(p: PredictIn) -> dict:
+    return {
         "Age": float(p.age),
         "BMI": float(p.bmi),
         "Systolic BP": float(p.systolic_bp),
@@ -174,11 +203,26 @@ def _vector_from_payload(p: PredictIn):
         "Mental Health": float(p.mental_health),
         "Heart Rate": float(p.heart_rate),
     }
-    for name, val in values.items():
-        idx = _feat_index[name]
+
+def _vector_from_payload(p: PredictIn, values: Optional[dict] = None,
+                         bundle: Optional[model_pool.Bundle] = None):
+    features, feat_index = (bundle.features, bundle.feat_index) if bundle else (_features, _feat_index)
+    row = np.zeros((1, len(features)), dtype=np.float32)
+    for name, val in (values or _payload_values(p)).items():
+        idx = feat_index[name]
         row[0, idx] = val
     return row
 
+def score_matrix(bundle: model_pool.Bundle, X: np.ndarray) -> np.ndarray:
+    """Calibrated positive-class score for every row of X (one model call)."""
+    proba = bundle.model.predict_proba(X)
+    pos_idx = 1 if hasattr(bundle.model, "classes_") and 1 in list(bundle.model.classes_) else 0
+    scores = np.asarray(proba[:, pos_idx], dtype=float)
+    if bundle.iso is not None:
+        try: scores = np.asarray(bundle.iso.transform(scores), dtype=float)
+        except Exception: pass
+    return scores
+
 def _priority_reasons(p: PredictIn) -> (bool, List[str]):
     reasons = []
     if p.systolic_bp >= 140: reasons.append(f"SBP ≥ 140 ({p.systolic_bp})")
@@ -198,64 +242,81 @@ def _priority_reasons(p: PredictIn) -> (bool, List[str]):
 # -------------------------------------------------
 @router.post("/gh/predict-gh", response_model=PredictOut)
 def predict(payload: PredictIn, db: Session = Depends(get_db)):
-    X = _vector_from_payload(payload)
+    values = _payload_values(payload)
+    bundle = model_pool.route(db, payload.facility_id, payload.source, payload.patient_id)
+    X = _vector_from_payload(payload, values, bundle)
+    drift.observe(values)
 
     try:
-        proba = _model.predict_proba(X)[0]
-        pos_idx = 1 if hasattr(_model, "classes_") and 1 in list(_model.classes_) else 0
-        score = float(proba[pos_idx])
+        score = float(score_matrix(bundle, X)[0])
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Inference failed: {e}")
 
-    if _iso is not None:
-        try: score = float(_iso.transform([score])[0])
-        except Exception: pass
-
-    risk_class = "High" if score >= _threshold else "Low"
+    threshold = bundle.threshold
+    risk_class = "High" if score >= threshold else "Low"
     priority, reasons = _priority_reasons(payload)
 
-    logging.getLogger("uvicorn.error").info(
-        f"[GH] score={score:.3f} thr={_threshold:.3f} → {risk_class}; priority={priority}"
-    )
+    log.info("[GH] model=%s score=%.3f thr=%.3f → %s; priority=%s",
+             bundle.name, score, threshold, risk_class, priority,
+             extra={"event": "gh.predict", "model": bundle.name, "risk_class": risk_class})
 
     created_iso = None
     if payload.patient_id:
         try:
             save_prediction(db, int(payload.patient_id), risk_class, round(score, 4),
-                            priority, reasons, _threshold)
+                            priority, reasons, threshold)
             row = latest_prediction(db, int(payload.patient_id))
             created_iso = row["created_at"].isoformat() if row and row.get("created_at") else None
         except Exception as e:
-            logging.getLogger("uvicorn.error").warning(f"[GH] save failed: {e}")
+            log.warning("[GH] save failed: %s", e, extra={"event": "gh.save_failed"})
 
     return PredictOut(
         risk_score=round(score, 4),
         risk_class=risk_class,
-        threshold_used=_threshold,
+        threshold_used=threshold,
         priority=priority,
         reasons=reasons,
-        created_at=created_iso
+        created_at=created_iso,
+        model=bundle.name
     )
 
+@router.get("/gh/model/memory")
+def model_memory():
+    return {
+        "pid": os.getpid(),
+        "format": "mmap" if artifacts.available() else "pickle",
+        "before_load": _rss_before_load,
+        "after_load": _rss_after_load,
+        "now": artifacts.rss(),
+        "mapped": artifacts.mapped(),
+    }
+
 # -------------------------------------------------
 #             GET LATEST PREDICTION
 # -------------------------------------------------
+def _reasons_list(v):
+    if isinstance(v, str):
+        try: v = json.loads(v)
+        except Exception: return [v]
+    return v
+
+# PredictOut-shaped JSON straight from the latest_prediction() mapping
+LATEST_OUT = RowSerializer(
+    ["risk_score", "risk_class", "threshold_used", "priority", "reasons", "created_at"],
+    {"risk_score": to_float, "threshold_used": to_float, "priority": to_bool,
+     "reasons": _reasons_list, "created_at": iso},
+    by_name=True,
+)
+
 @router.get("/gh/latest/{patient_id}", response_model=PredictOut)
-def get_latest(patient_id: int, db: Session = Depends(get_db)):
+def get_latest(patient_id: int, request: Request, response: Response,
+               db: Session = Depends(get_db)):
+    cached = versions.check(request, response, db, versions.RISK, patient_id)
+    if cached:
+        return cached
+
     row = latest_prediction(db, patient_id)
     if not row:
         raise HTTPException(status_code=404, detail="Not Found")
 
-    reasons = row["reasons"]
-    if isinstance(reasons, str):
-        try: reasons = json.loads(reasons)
-        except Exception: reasons = [reasons]
-
-    return PredictOut(
-        risk_score=float(row["risk_score"]),
-        risk_class=row["risk_class"],
-        threshold_used=float(row["threshold_used"]),
-        priority=bool(row["priority"]),
-        reasons=reasons,
-        created_at=row["created_at"].isoformat() if row.get("created_at") else None
-    )
+    return json_response(LATEST_OUT.dumps_one(row), response)
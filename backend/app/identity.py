@@ -0,0 +1,267 @@
+# backend/app/identity.py
+#
+# In-process cache for identity lookups: email / patient id / MRN / firebase
+# uid -> (user_id, patient_id, role, email, full_name).
+#
+# Entries expire after IDENTITY_CACHE_TTL seconds (misses after
+# IDENTITY_NEGATIVE_TTL). Writers that change users/patients call
+# invalidate() inside their transaction: it evicts locally and issues
+# pg_notify, so every other worker's listener thread evicts the same keys
+# once the transaction commits.
+import json
+import logging
+import os
+import select
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, NamedTuple, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .db import engine
+
+log = logging.getLogger("uvicorn.error")
+
+CACHE_MAX    = int(os.getenv("IDENTITY_CACHE_MAX", "10000"))
+CACHE_TTL    = float(os.getenv("IDENTITY_CACHE_TTL", "300"))
+NEGATIVE_TTL = float(os.getenv("IDENTITY_NEGATIVE_TTL", "30"))
+CHANNEL      = "identity_changed"
+NOTIFY_MAX_BYTES = 7000  # Postgres rejects NOTIFY payloads of 8000 bytes or more
+
+
+class Identity(NamedTuple):
+    user_id: int
+    patient_id: Optional[int]
+    role: Optional[str]
+    email: Optional[str]
+    full_name: Optional[str]
+    facility_id: Optional[int] = None  # model routing (model_pool.bundle_name)
+
+
+class TTLCache:
+    """
+    Bounded LRU with per-entry expiry. A cached None is a negative result.
+
+    index(value) -> group key (or None) lets evict() drop a whole group
+    without scanning the cache. epoch counts evictions: a reader takes it
+    before loading and passes it to set(), which skips the write if an
+    eviction happened in between (the loaded row may already be stale).
+    """
+
+    def __init__(self, maxsize: int = CACHE_MAX, ttl: float = CACHE_TTL,
+                 negative_ttl: float = NEGATIVE_TTL, index: Optional[Callable] = None):
+        self.maxsize, self.ttl, self.negative_ttl = maxsize, ttl, negative_ttl
+        self._data = OrderedDict()
+        self._index_fn = index
+        self._groups: Dict[object, set] = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+        self.epoch = 0
+
+    # Caller holds self._lock
+    def _pop(self, key):
+        item = self._data.pop(key, None)
+        if item is not None and self._index_fn is not None and item[1] is not None:
+            g = self._index_fn(item[1])
+            keys = self._groups.get(g)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._groups[g]
+        return item
+
+    def get(self, key):
+        """Returns (found, value)."""
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < now:
+                if item is not None:
+                    self._pop(key)
+                self.misses += 1
+                return False, None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return True, item[1]
+
+    def set(self, key, value, ttl: Optional[float] = None, epoch: Optional[int] = None):
+        if ttl is None:
+            ttl = self.ttl if value is not None else self.negative_ttl
+        with self._lock:
+            if epoch is not None and epoch != self.epoch:
+                return
+            self._pop(key)
+            self._data[key] = (time.monotonic() + ttl, value)
+            if self._index_fn is not None and value is not None:
+                self._groups.setdefault(self._index_fn(value), set()).add(key)
+            while len(self._data) > self.maxsize:
+                self._pop(next(iter(self._data)))
+
+    def evict(self, *keys, groups=()):
+        """Drop keys, every entry in the same index group as a dropped value,
+        and the given groups."""
+        with self._lock:
+            self.epoch += 1
+            groups = set(groups)
+            for k in keys:
+                item = self._pop(k)
+                if item is not None and self._index_fn is not None and item[1] is not None:
+                    groups.add(self._index_fn(item[1]))
+            for g in groups:
+                for k in list(self._groups.get(g, ())):
+                    self._pop(k)
+
+    def clear(self):
+        with self._lock:
+            self.epoch += 1
+            self._data.clear()
+            self._groups.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+_cache = TTLCache(index=lambda ident: ident.user_id)
+
+# ---------- Keys ----------
+def _k_email(email: str): return ("email", email.strip().lower())
+def _k_pid(pid: int):     return ("pid", int(pid))
+def _k_mrn(mrn: str):     return ("mrn", mrn.strip())
+def _k_uid(uid: str):     return ("uid", uid)
+
+# ---------- Lookups ----------
+_SELECT = """
+    SELECT u.id AS user_id, p.id AS patient_id, u.role::text AS role,
+           u.email, COALESCE(u.full_name, u.email) AS full_name, p.facility_id
+    FROM users u
+    LEFT JOIN patients p ON p.user_id = u.id
+"""
+
+def _lookup(db: Session, key, where: str, params: dict) -> Optional[Identity]:
+    found, val = _cache.get(key)
+    if found:
+        return val
+    epoch = _cache.epoch  # an invalidation during the SELECT makes the row unsafe to cache
+    row = db.execute(text(_SELECT + " WHERE " + where + " LIMIT 1"), params).mappings().first()
+    ident = Identity(**row) if row else None
+    _cache.set(key, ident, epoch=epoch)
+    return ident
+
+def by_email(db: Session, email: str) -> Optional[Identity]:
+    return _lookup(db, _k_email(email), "lower(u.email) = lower(:em)", {"em": email.strip()})
+
+def by_patient_id(db: Session, patient_id: int) -> Optional[Identity]:
+    return _lookup(db, _k_pid(patient_id), "p.id = :pid", {"pid": int(patient_id)})
+
+def by_mrn(db: Session, mrn: str) -> Optional[Identity]:
+    return _lookup(db, _k_mrn(mrn), "p.medical_record_number = :mrn", {"mrn": mrn.strip()})
+
+def by_firebase_uid(db: Session, uid: str) -> Optional[Identity]:
+    return _lookup(db, _k_uid(uid), "u.firebase_uid = :uid", {"uid": uid})
+
+def peek_email(email: str) -> Optional[Identity]:
+    """Cache-only lookup; never touches the database."""
+    return _cache.get(_k_email(email))[1]
+
+def stats() -> dict:
+    return _cache.stats()
+
+# ---------- Invalidation ----------
+def _keys(email=None, patient_id=None, uid=None, mrn=None, user_id=None) -> list:
+    keys = []
+    if email:      keys.append(_k_email(email))
+    if patient_id: keys.append(_k_pid(patient_id))
+    if uid:        keys.append(_k_uid(uid))
+    if mrn:        keys.append(_k_mrn(mrn))
+    if user_id:    keys.append(("user", int(user_id)))
+    return keys
+
+def invalidate(db: Session, *, email: Optional[str] = None, patient_id: Optional[int] = None,
+               uid: Optional[str] = None, mrn: Optional[str] = None, user_id: Optional[int] = None):
+    """
+    Evict the given identity keys here and, once the caller's transaction
+    commits, in every other worker. Pass every identifier that may have
+    changed (old and new values).
+    """
+    keys = _keys(email, patient_id, uid, mrn, user_id)
+    if not keys:
+        return
+    _evict(keys)
+    db.execute(text("SELECT pg_notify(:ch, :payload)"),
+               {"ch": CHANNEL, "payload": json.dumps(keys)})
+
+def invalidate_many(db: Session, items):
+    """
+    invalidate() for a bulk write: items are dicts of invalidate()'s keyword
+    arguments. Every key is evicted here at once and sent to the other
+    workers in as few NOTIFYs as fit under Postgres' payload limit.
+    """
+    keys = list(dict.fromkeys(k for item in items for k in _keys(**item)))
+    if not keys:
+        return
+    _evict(keys)
+    payloads, batch, size = [], [], 2
+    for k in keys:
+        n = len(json.dumps(k)) + 2
+        if batch and size + n > NOTIFY_MAX_BYTES:
+            payloads.append(json.dumps(batch))
+            batch, size = [], 2
+        batch.append(k)
+        size += n
+    payloads.append(json.dumps(batch))
+    for payload in payloads:
+        db.execute(text("SELECT pg_notify(:ch, :payload)"), {"ch": CHANNEL, "payload": payload})
+
+def _evict(keys):
+    # A changed row can be cached under any of its identifiers, so drop every
+    # entry that points at the same user as well as the keys themselves.
+    keys = [tuple(k) for k in keys]
+    _cache.evict(*keys, groups=[k[1] for k in keys if k[0] == "user"])
+
+# ---------- Cross-worker listener ----------
+def _listen_forever():
+    import psycopg2
+    import psycopg2.extensions
+
+    args = engine.url.translate_connect_args(username="user", database="dbname")
+    backoff = 1.0
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(**args)
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            conn.cursor().execute(f"LISTEN {CHANNEL}")
+            # Anything could have changed while we weren't listening
+            _cache.clear()
+            backoff = 1.0
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    n = conn.notifies.pop(0)
+                    try:
+                        _evict(json.loads(n.payload))
+                    except Exception:
+                        _cache.clear()
+        except Exception as e:
+            log.warning("[identity] listener error: %s; retrying in %.0fs", e, backoff)
+            _cache.clear()
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 60.0)
+        finally:
+            if conn is not None:
+                try: conn.close()
+                except Exception: pass
+
+_listener = None
+
+def start_listener():
+    global _listener
+    if _listener is None:
+        _listener = threading.Thread(target=_listen_forever, name="identity-listen", daemon=True)
+        _listener.start()
+    return _listener
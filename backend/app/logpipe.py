@@ -0,0 +1,220 @@
+# backend/app/logpipe.py
+#
+# Non-blocking logging for the API loggers (uvicorn.error, uvicorn.access).
+#   - The request thread only puts the record on a bounded queue; a
+#     QueueListener thread formats it (JSON by default) and writes stderr,
+#     so a slow or contended stderr never stalls a request.
+#   - When the queue is full, INFO/DEBUG records are dropped; a WARNING or
+#     worse makes room by discarding the oldest queued record instead. Both
+#     are counted and shown at GET /debug/logging (admin).
+#   - High-volume success events are sampled before they are queued:
+#         LOG_SAMPLE="gh.predict=0.1,gh.saved=0.1,uvicorn.access=0.05"
+#     keys are the record's `event` (extra={"event": ...}) or logger name;
+#     WARNING and above are never sampled.
+#   - install(app) adds a middleware that takes X-Request-ID (or makes one),
+#     echoes it on the response and stamps it on every record logged while
+#     handling that request.
+import contextvars
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+import uuid
+from collections import Counter
+from typing import Dict, Optional
+
+from fastapi import APIRouter, Depends, Request
+
+from .fastjson import dumps
+from .session_tokens import require_role
+
+router = APIRouter(prefix="/debug", tags=["debug"])
+
+ENABLED    = os.getenv("LOG_PIPELINE", "1").lower() in ("1", "true", "yes")
+FORMAT     = os.getenv("LOG_FORMAT", "json")          # json | text
+QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+SAMPLE     = os.getenv("LOG_SAMPLE", "gh.predict=0.1,gh.saved=0.1")
+LOGGERS    = ("uvicorn.error", "uvicorn.access")
+
+request_id: contextvars.ContextVar = contextvars.ContextVar("request_id", default=None)
+
+def _parse_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        key, _, rate = part.partition("=")
+        try:
+            rates[key.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            pass
+    return rates
+
+# ---------- Sampling ----------
+class SamplingFilter(logging.Filter):
+    """Keeps every 1/rate-th record per event (deterministic, no RNG on the hot path)."""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.every = {k: (round(1 / r) if r > 0 else 0) for k, r in rates.items()}
+        self._counters = {k: itertools.count() for k in rates}
+        self.sampled_out: Counter = Counter()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.every:
+            return True
+        key = getattr(record, "event", None)
+        if key not in self.every:
+            key = record.name
+            if key not in self.every:
+                return True
+        every = self.every[key]
+        if every and next(self._counters[key]) % every == 0:
+            return True
+        self.sampled_out[key] += 1
+        return False
+
+# ---------- Queue handler ----------
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, maxsize: int = QUEUE_SIZE):
+        super().__init__(queue.Queue(maxsize=maxsize))
+        self.enqueued = 0
+        self.dropped: Counter = Counter()   # by level name
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only resolve the message and the request id here; formatting (and
+        # rendering tracebacks) happens on the listener thread.
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if not hasattr(record, "request_id"):
+            record.request_id = request_id.get()
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+            self.enqueued += 1
+            return
+        except queue.Full:
+            pass
+        if record.levelno >= logging.WARNING:
+            try:
+                old = self.queue.get_nowait()
+                self.dropped[old.levelname] += 1
+                self.queue.put_nowait(record)
+                self.enqueued += 1
+                return
+            except (queue.Empty, queue.Full):
+                pass
+        self.dropped[record.levelname] += 1
+
+# ---------- Formatting ----------
+_STD = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "request_id", "event"}
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            out["request_id"] = record.request_id
+        if getattr(record, "event", None):
+            out["event"] = record.event
+        for k, v in vars(record).items():  # anything passed via extra=
+            if k not in _STD and not k.startswith("_"):
+                out[k] = v
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            out["exc"] = record.exc_text
+        try:
+            return dumps(out).decode("utf-8")
+        except TypeError:
+            return json.dumps(out, default=str, ensure_ascii=False)
+
+class _TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        rid = getattr(record, "request_id", None)
+        line = super().format(record)
+        return f"{line} [rid={rid}]" if rid else line
+
+# ---------- Pipeline ----------
+handler: Optional[BoundedQueueHandler] = None
+sampler: Optional[SamplingFilter] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+_out: Optional["_CountingStreamHandler"] = None
+
+class _CountingStreamHandler(logging.StreamHandler):
+    written = 0  # only the listener thread writes
+
+    def emit(self, record):
+        super().emit(record)
+        self.written += 1
+
+def start():
+    """Route LOGGERS through the queue; idempotent."""
+    global handler, sampler, _listener, _out
+    if not ENABLED or _listener is not None:
+        return
+    _out = out = _CountingStreamHandler(sys.stderr)
+    out.setFormatter(JsonFormatter() if FORMAT == "json"
+                     else _TextFormatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    handler = BoundedQueueHandler(QUEUE_SIZE)
+    sampler = SamplingFilter(_parse_rates(SAMPLE))
+    handler.addFilter(sampler)
+    _listener = logging.handlers.QueueListener(handler.queue, out, respect_handler_level=False)
+    _listener.start()
+    for name in LOGGERS:
+        lg = logging.getLogger(name)
+        lg.handlers = [handler]
+        lg.propagate = False
+        if lg.level == logging.NOTSET:
+            lg.setLevel(logging.INFO)
+
+def stop():
+    """Drain the queue (shutdown)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def stats() -> dict:
+    if handler is None:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        "format": FORMAT,
+        "queue": {"size": handler.queue.qsize(), "capacity": QUEUE_SIZE},
+        "enqueued": handler.enqueued,
+        "written": _out.written,
+        "dropped": dict(handler.dropped),
+        "dropped_total": sum(handler.dropped.values()),
+        "sampled_out": dict(sampler.sampled_out),
+        "sample_rates": _parse_rates(SAMPLE),
+    }
+
+def install(app):
+    start()
+
+    @app.middleware("http")
+    async def _request_id(request: Request, call_next):
+        rid = request.headers.get("x-request-id") or uuid.uuid4().hex
+        token = request_id.set(rid[:64])
+        try:
+            response = await call_next(request)
+        finally:
+            request_id.reset(token)
+        response.headers["X-Request-ID"] = rid[:64]
+        return response
+
+    app.add_event_handler("shutdown", stop)
+
+# ---------- Endpoint ----------
+@router.get("/logging")
+def logging_stats(_admin: dict = Depends(require_role("admin"))):
+    return stats()
@@ -6,10 +6,27 @@ from pathlib import Path
 from .db import Base, engine
 from .auth import router as auth_router
 from .patients import router as patients_router
+from .cohort_import import router as cohort_import_router
 from .visits import router as visits_router
 from .gh_predict import router as gh_router 
+from .sensitivity import router as sensitivity_router
+from .trajectory import router as trajectory_router
+from .model_pool import router as models_router
+from .thresholds import router as thresholds_router, start_refresher as start_threshold_refresher
+from .drift import router as drift_router, start_flusher as start_drift_flusher
 from .risk import router as risk_router  
 from .notifications import router as notifications_router
+from .campaigns import router as campaigns_router
+from .cohort import router as cohort_router, start_reconciler
+from .dashboard import router as dashboard_router
+from .timeline import router as timeline_router
+from .slots import router as slots_router
+from .calendar_feed import router as calendar_router
+from .reminders import router as reminders_router, start_sweeper
+from .export import router as export_router
+from .identity import start_listener as start_identity_listener
+from .outbox import start_workers as start_outbox_workers
+from . import sqlprof, sampler, logpipe
 from dotenv import load_dotenv
 load_dotenv()
 from .models_risk import RiskPrediction, PatientAdvice  #
@@ -27,6 +44,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+sqlprof.install(app)
+logpipe.install(app)
 
 # Create tables (include our new models)
 Base.metadata.create_all(bind=engine)
@@ -42,7 +61,33 @@ load_dotenv(dotenv_path=ENV_PATH, override=True)
 # Routers
 app.include_router(auth_router)
 app.include_router(patients_router)
+app.include_router(cohort_import_router)
 app.include_router(visits_router)
 app.include_router(gh_router)    
+app.include_router(sensitivity_router)
+app.include_router(trajectory_router)
+app.include_router(models_router)
+app.include_router(thresholds_router)
+app.include_router(drift_router)
 app.include_router(risk_router) 
-app.include_router(notifications_router)
\ No newline at end of file
+app.include_router(notifications_router)
+app.include_router(campaigns_router)
+app.include_router(cohort_router)
+app.include_router(dashboard_router)
+app.include_router(timeline_router)
+app.include_router(slots_router)
+app.include_router(calendar_router)
+app.include_router(reminders_router)
+app.include_router(export_router)
+app.include_router(sqlprof.router)
+app.include_router(sampler.router)
+app.include_router(logpipe.router)
+
+@app.on_event("startup")
+def _start_background_jobs():
+    start_reconciler()
+    start_identity_listener()
+    start_outbox_workers()
+    start_sweeper()
+    start_drift_flusher()
+    start_threshold_refresher()
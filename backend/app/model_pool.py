@@ -0,0 +1,277 @@
+# backend/app/model_pool.py
+#
+# Per-facility / per-source model routing.
+#
+# Extra model bundles live in ml_model/bundles/<name>/, each laid out like
+# ml_model itself (tabnet_model.pkl or an mmap/ export, optional
+# isotonic_calibrator.pkl and threshold.json, feature_order.json).
+# ml_model/routing.json maps requests to bundles:
+#     {"facilities": {"3": "kathmandu"}, "sources": {"s1": "kathmandu"}}
+# facility beats source; anything unmapped, missing or failing to load is
+# served by the default bundle (the model gh_predict loads at startup).
+#
+# Bundles load lazily on first use into an LRU pool bounded by count and
+# by bytes of weights (MODEL_POOL_MAX_BUNDLES / MODEL_POOL_MAX_MB); a
+# per-bundle lock makes concurrent cold requests wait for one load instead
+# of each loading a copy. GET /gh/models reports the pool and its metrics.
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional
+
+import joblib
+from fastapi import APIRouter
+from sqlalchemy.orm import Session
+
+from . import artifacts
+from .drift import FEATURES as REQUIRED_FEATURES
+from . import identity
+from .identity import TTLCache
+
+router = APIRouter(prefix="/gh", tags=["gh"])
+log = logging.getLogger("uvicorn.error")
+
+MODEL_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "ml_model"))
+BUNDLES_DIR = os.getenv("MODEL_BUNDLES_DIR", os.path.join(MODEL_DIR, "bundles"))
+ROUTING_PATH = os.getenv("MODEL_ROUTING", os.path.join(MODEL_DIR, "routing.json"))
+MAX_BUNDLES = int(os.getenv("MODEL_POOL_MAX_BUNDLES", "4"))
+MAX_BYTES = int(float(os.getenv("MODEL_POOL_MAX_MB", "512")) * 1024 * 1024)
+DEFAULT = "default"
+
+class Bundle(NamedTuple):
+    name: str
+    model: object
+    iso: Optional[object]
+    threshold: float
+    features: List[str]
+    feat_index: Dict[str, int]
+    nbytes: int
+
+def _weights_bytes(model) -> int:
+    try:
+        return int(sum(t.numel() * t.element_size() for t in model.network.state_dict().values()))
+    except Exception:
+        return 0
+
+def make_bundle(name: str, model, iso, threshold: float, features: List[str]) -> Bundle:
+    return Bundle(name, model, iso, float(threshold), list(features),
+                  {f: i for i, f in enumerate(features)}, _weights_bytes(model))
+
+def read_threshold(name: str) -> float:
+    """A bundle's threshold.json, without loading its model (0.5 if absent)."""
+    thr_json = os.path.join(BUNDLES_DIR, name, "threshold.json")
+    if os.path.isfile(thr_json):
+        return float(json.load(open(thr_json))["threshold"])
+    return 0.5
+
+def load_bundle(name: str) -> Bundle:
+    path = os.path.join(BUNDLES_DIR, name)
+    mmap_dir = os.path.join(path, "mmap")
+    if artifacts.available(mmap_dir):
+        model = artifacts.load_model(mmap_dir)
+    else:
+        for fname in ("tabnet_model.joblib", "tabnet_model.pkl"):
+            if os.path.isfile(os.path.join(path, fname)):
+                model = joblib.load(os.path.join(path, fname))
+                break
+        else:
+            raise FileNotFoundError(f"No model in bundle {path}")
+    cal = os.path.join(path, "isotonic_calibrator.pkl")
+    iso = joblib.load(cal) if os.path.isfile(cal) else None
+    threshold = read_threshold(name)
+    if not 0.05 <= threshold <= 0.95:
+        raise ValueError(f"Bundle {name}: suspicious threshold {threshold}")
+    features = json.load(open(os.path.join(path, "feature_order.json")))
+    missing = [f for f in REQUIRED_FEATURES if f not in features]
+    if missing:
+        raise ValueError(f"Bundle {name}: features missing {missing}")
+    return make_bundle(name, model, iso, threshold, features)
+
+# ---------- Metrics ----------
+class _Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routed = self.fallbacks = self.hits = self.loads = self.load_errors = self.evictions = 0
+        self.route_seconds = 0.0
+        self.load_seconds = []  # recent cold-load latencies
+        self.per_bundle: Dict[str, int] = {}
+
+    def add(self, **kw):
+        with self._lock:
+            for k, v in kw.items():
+                setattr(self, k, getattr(self, k) + v)
+
+    def routed_to(self, name: str, seconds: float, fallback: bool):
+        with self._lock:
+            self.routed += 1
+            self.route_seconds += seconds
+            self.fallbacks += int(fallback)
+            self.per_bundle[name] = self.per_bundle.get(name, 0) + 1
+
+    def loaded(self, seconds: float):
+        with self._lock:
+            self.loads += 1
+            self.load_seconds = (self.load_seconds + [seconds])[-100:]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            ls = sorted(self.load_seconds)
+            return {
+                "routed": self.routed, "fallbacks": self.fallbacks, "pool_hits": self.hits,
+                "cold_loads": self.loads, "load_errors": self.load_errors, "evictions": self.evictions,
+                "route_overhead_us_avg": round(self.route_seconds / self.routed * 1e6, 1) if self.routed else None,
+                "cold_load_ms": {"last": round(self.load_seconds[-1] * 1000, 1),
+                                 "p50": round(ls[len(ls) // 2] * 1000, 1),
+                                 "max": round(ls[-1] * 1000, 1)} if ls else None,
+                "per_bundle": dict(self.per_bundle),
+            }
+
+metrics = _Metrics()
+
+# ---------- Pool ----------
+class ModelPool:
+    def __init__(self, max_bundles: int = MAX_BUNDLES, max_bytes: int = MAX_BYTES):
+        self.max_bundles, self.max_bytes = max_bundles, max_bytes
+        self._default: Optional[Bundle] = None
+        self._pool: "OrderedDict[str, Bundle]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading: Dict[str, threading.Lock] = {}
+        self._failed = TTLCache(maxsize=256, ttl=60, negative_ttl=60)  # don't retry a broken bundle per request
+
+    def set_default(self, bundle: Bundle):
+        self._default = bundle
+
+    @property
+    def default(self) -> Bundle:
+        return self._default
+
+    def _evict(self):
+        # Caller holds self._lock
+        while self._pool and (len(self._pool) > self.max_bundles
+                              or sum(b.nbytes for b in self._pool.values()) > self.max_bytes):
+            name, _ = self._pool.popitem(last=False)
+            metrics.add(evictions=1)
+            log.info("[models] evicted bundle %s", name)
+
+    def get(self, name: str) -> Optional[Bundle]:
+        if name == DEFAULT:
+            return self._default
+        with self._lock:
+            b = self._pool.get(name)
+            if b is not None:
+                self._pool.move_to_end(name)
+                metrics.add(hits=1)
+                return b
+            load_lock = self._loading.setdefault(name, threading.Lock())
+        if self._failed.get(name)[0]:
+            return None
+        with load_lock:
+            with self._lock:  # someone else may have finished loading while we waited
+                if name in self._pool:
+                    self._pool.move_to_end(name)
+                    return self._pool[name]
+            t0 = time.perf_counter()
+            try:
+                b = load_bundle(name)
+            except Exception as e:
+                metrics.add(load_errors=1)
+                self._failed.set(name, True)
+                log.error("[models] bundle %s failed to load: %s", name, e)
+                return None
+            metrics.loaded(time.perf_counter() - t0)
+            with self._lock:
+                self._pool[name] = b
+                self._evict()
+            return b
+
+    def peek(self, name: str) -> Optional[Bundle]:
+        """The bundle if it is already loaded; never loads or touches LRU order."""
+        if name == DEFAULT:
+            return self._default
+        with self._lock:
+            return self._pool.get(name)
+
+    def status(self) -> dict:
+        with self._lock:
+            loaded = [{"name": b.name, "mb": round(b.nbytes / 2**20, 2), "threshold": b.threshold}
+                      for b in self._pool.values()]
+        return {"default": self._default.name if self._default else None,
+                "loaded": loaded, "max_bundles": self.max_bundles,
+                "max_mb": round(self.max_bytes / 2**20, 1),
+                "used_mb": round(sum(l["mb"] for l in loaded), 2)}
+
+pool = ModelPool()
+
+# ---------- Routing ----------
+_routing = {"facilities": {}, "sources": {}, "mtime": None}
+_routing_lock = threading.Lock()
+
+def _routes() -> dict:
+    try:
+        mtime = os.path.getmtime(ROUTING_PATH)
+    except OSError:
+        return _routing
+    if mtime != _routing["mtime"]:
+        with _routing_lock:
+            try:
+                cfg = json.load(open(ROUTING_PATH))
+                _routing.update(facilities={str(k): v for k, v in cfg.get("facilities", {}).items()},
+                                sources={str(k).lower(): v for k, v in cfg.get("sources", {}).items()},
+                                mtime=mtime)
+            except Exception as e:
+                log.error("[models] bad routing config %s: %s", ROUTING_PATH, e)
+                _routing["mtime"] = mtime
+    return _routing
+
+def bundle_name(db: Session, facility_id: Optional[int], source: Optional[str],
+                patient_id: Optional[int]) -> str:
+    routes = _routes()
+    if not routes["facilities"] and not routes["sources"]:
+        return DEFAULT
+    if facility_id is None and patient_id and routes["facilities"]:
+        # Through the identity cache, which every patient write invalidates (all workers)
+        ident = identity.by_patient_id(db, patient_id)
+        facility_id = ident.facility_id if ident else None
+    if facility_id is not None and str(facility_id) in routes["facilities"]:
+        return routes["facilities"][str(facility_id)]
+    if source and source.lower() in routes["sources"]:
+        return routes["sources"][source.lower()]
+    return DEFAULT
+
+def route(db: Session, facility_id: Optional[int] = None, source: Optional[str] = None,
+          patient_id: Optional[int] = None) -> Bundle:
+    """The bundle to score this request with; never None once a default is set."""
+    t0 = time.perf_counter()
+    name = bundle_name(db, facility_id, source, patient_id)
+    # A cold load is measured separately; keep it out of the routing overhead
+    t_route = time.perf_counter() - t0
+    bundle = pool.get(name)
+    fallback = bundle is None
+    if fallback:
+        bundle = pool.default
+    metrics.routed_to(bundle.name, t_route, fallback)
+    return bundle
+
+def thresholds() -> Dict[str, float]:
+    """Screening threshold of the default bundle and of every bundle routing can pick."""
+    out = {DEFAULT: pool.default.threshold} if pool.default else {}
+    routes = _routes()
+    for name in sorted(set(routes["facilities"].values()) | set(routes["sources"].values())):
+        if name in out:
+            continue
+        b = pool.peek(name)
+        try:
+            out[name] = b.threshold if b is not None else read_threshold(name)
+        except Exception as e:
+            log.error("[models] bundle %s threshold unreadable: %s", name, e)
+    return out
+
+# ---------- Endpoint ----------
+@router.get("/models")
+def models_status():
+    routes = _routes()
+    return {"routing": {"facilities": routes["facilities"], "sources": routes["sources"]},
+            "pool": pool.status(), "metrics": metrics.snapshot()}
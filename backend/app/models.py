@@ -84,6 +84,9 @@ class Patient(Base):
     # Optional hospital MRN
     medical_record_number = Column(String(64), unique=True, index=True, nullable=True)
 
+    # Home facility for ANC slot allocation (see slots.py); NULL = default facility
+    facility_id = Column(Integer, nullable=True)
+
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     __table_args__ = (
@@ -111,6 +114,7 @@ class AppointmentStatus(PyEnum):
     completed = "completed"
     rescheduled = "rescheduled"
     cancelled = "cancelled"
+    missed = "missed"          # set by reminders.py once the day has passed unconfirmed
 
 
 class Appointment(Base):
@@ -132,3 +136,13 @@ class Appointment(Base):
     # For UI logic you mentioned
     last_visit = Column(Date, nullable=True)
     next_visit = Column(Date, nullable=True)
+
+    # Slot booked by slots.allocate (slot_index counts slot_minutes from open_time)
+    facility_id = Column(Integer, nullable=True)
+    slot_index = Column(Integer, nullable=True)
+
+    # Set by the reminder sweeper; cleared when the visit moves to a new day
+    reminder_sent_at = Column(DateTime(timezone=True), nullable=True)
+
+    # Clinician (users.id) the visit is booked with; filters the calendar feed
+    clinician_id = Column(Integer, nullable=True, index=True)
@@ -1,5 +1,6 @@
 # notifications.py
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
 from pydantic import BaseModel, EmailStr
 from pathlib import Path
 from dotenv import load_dotenv
@@ -12,6 +13,9 @@ from email.message import EmailMessage
 from datetime import datetime
 import logging
 
+from .db import get_db
+from . import outbox
+
 router = APIRouter(prefix="/notifications", tags=["notifications"])
 log = logging.getLogger("uvicorn.error")
 
@@ -24,43 +28,47 @@ APP_NAME  = os.getenv("APP_NAME", "GH Risk Predictor")
 DEV_MAIL_DIR = os.getenv("DEV_MAIL_DIR", "")      # optional local file outbox
 SMTP_TIMEOUT = int(os.getenv("SMTP_TIMEOUT", "12"))
 
+SMTP_SECURITY = os.getenv("SMTP_SECURITY", "auto").lower()  # auto | ssl | starttls | none
+
 def _smtp_connect_and_auth():
     """
     Connect and authenticate; returns an smtplib SMTP/SMTP_SSL instance.
-    Supports STARTTLS on 587 and SMTPS on 465.
+    Supports STARTTLS on 587 and SMTPS on 465. SMTP_SECURITY=none with no
+    SMTP_USER talks plain SMTP to a local sink.
     """
-    if not (SMTP_HOST and SMTP_PORT and SMTP_USER and SMTP_PASS and SMTP_FROM):
+    if not (SMTP_HOST and SMTP_PORT and SMTP_FROM):
+        raise RuntimeError("CONFIG_MISSING: Set SMTP_HOST/PORT/USER/PASS/FROM.")
+    if SMTP_USER and not SMTP_PASS:
         raise RuntimeError("CONFIG_MISSING: Set SMTP_HOST/PORT/USER/PASS/FROM.")
 
-    # 465 => SMTPS; 587 => STARTTLS
-    if SMTP_PORT == 465:
-        context = ssl.create_default_context()
-        server = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT, context=context)
-        server.ehlo()
-        server.login(SMTP_USER, SMTP_PASS)
-        return server
-    else:
-        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
-        server.ehlo()
-        context = ssl.create_default_context()
-        server.starttls(context=context)
-        server.ehlo()
-        server.login(SMTP_USER, SMTP_PASS)
-        return server
+    security = SMTP_SECURITY
+    if security == "auto":
+        # 465 => SMTPS; 587 => STARTTLS
+        security = "ssl" if SMTP_PORT == 465 else "starttls"
 
-def _send_email(to_email: str, subject: str, text: str, html: Optional[str] = None):
-    # Dev “file outbox” so UI keeps working even if SMTP is down
-    if DEV_MAIL_DIR:
-        os.makedirs(DEV_MAIL_DIR, exist_ok=True)
-        ts = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
-        fn = os.path.join(DEV_MAIL_DIR, f"{ts}-{to_email}.eml")
-        with open(fn, "w", encoding="utf-8") as f:
-            f.write(f"From: {SMTP_FROM or '<unset>'}\nTo: {to_email}\nSubject: {subject}\n\n{text}\n\n{html or ''}")
-        return
-
-    if not (SMTP_HOST and SMTP_PORT and SMTP_USER and SMTP_PASS and SMTP_FROM):
-        raise RuntimeError("CONFIG_MISSING: Set SMTP_HOST/PORT/USER/PASS/FROM.")
+    try:
+        if security == "ssl":
+            context = ssl.create_default_context()
+            server = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT, context=context)
+            server.ehlo()
+        else:
+            server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+            server.ehlo()
+            if security == "starttls":
+                context = ssl.create_default_context()
+                server.starttls(context=context)
+                server.ehlo()
+        if SMTP_USER:
+            server.login(SMTP_USER, SMTP_PASS)
+        return server
+    except smtplib.SMTPAuthenticationError as e:
+        # Wrong password / missing Gmail App Password
+        raise RuntimeError(f"AUTH_FAILED: {e}")
+    except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, socket.timeout, OSError) as e:
+        # Port blocked / host unreachable / TLS handshake issues
+        raise RuntimeError(f"NETWORK_ERROR: {e}")
 
+def _build_message(to_email: str, subject: str, text: str, html: Optional[str] = None) -> EmailMessage:
     msg = EmailMessage()
     msg["Subject"] = subject
     msg["From"] = SMTP_FROM
@@ -68,21 +76,31 @@ def _send_email(to_email: str, subject: str, text: str, html: Optional[str] = No
     msg.set_content(text or "")
     if html:
         msg.add_alternative(html, subtype="html")
+    return msg
 
-    try:
-        server = _smtp_connect_and_auth()
-        server.send_message(msg)
-    except smtplib.SMTPAuthenticationError as e:
-        # Wrong password / missing Gmail App Password
-        raise RuntimeError(f"AUTH_FAILED: {e}")
-    except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, socket.timeout, OSError) as e:
-        # Port blocked / host unreachable / TLS handshake issues
-        raise RuntimeError(f"NETWORK_ERROR: {e}")
-    finally:
-        try:
-            server.quit()
-        except Exception:
-            pass
+def _write_dev_mail(to_email: str, subject: str, text: str, html: Optional[str] = None):
+    # Dev “file outbox” so UI keeps working even if SMTP is down
+    os.makedirs(DEV_MAIL_DIR, exist_ok=True)
+    ts = datetime.utcnow().strftime("%Y%m%d-%H%M%S-%f")
+    fn = os.path.join(DEV_MAIL_DIR, f"{ts}-{to_email}.eml")
+    with open(fn, "w", encoding="utf-8") as f:
+        f.write(f"From: {SMTP_FROM or '<unset>'}\nTo: {to_email}\nSubject: {subject}\n\n{text}\n\n{html or ''}")
+
+class _Transport:
+    """What the outbox workers need from this module."""
+    connect = staticmethod(_smtp_connect_and_auth)
+    build = staticmethod(_build_message)
+    write_dev = staticmethod(_write_dev_mail)
+    dev_dir = DEV_MAIL_DIR
+
+transport = _Transport()
+
+def _queue_email(db: Session, to_email: str, subject: str, text: str,
+                 html: Optional[str] = None, kind: str = "generic") -> dict:
+    """Emails are delivered by the outbox workers; the request only records them."""
+    outbox_id = outbox.enqueue(db, to_email, subject, text, html, kind=kind)
+    db.commit()
+    return {"ok": True, "queued": outbox_id}
 
 # -----------------------------
 # Schemas
@@ -109,6 +127,35 @@ class SendVisitIn(BaseModel):
     last_visit: str
     next_visit: Optional[str] = None
 
+# -----------------------------
+# Templates
+# -----------------------------
+def render_visit(last_visit: Optional[str], next_visit: Optional[str]):
+    """(subject, text) for an ANC visit email; shared with the campaign sender."""
+    subject = f"{APP_NAME}: ANC Visit Details"
+    nxt = next_visit or "(to be confirmed)"
+    text = (
+        "Hello,\n\n"
+        "Your ANC visit details are below:\n"
+        f"• Last visit: {last_visit or '(not recorded)'}\n"
+        f"• Next visit: {nxt}\n\n"
+        "Please attend your appointment for a comprehensive check-up.\n"
+        f"- {APP_NAME}\n"
+    )
+    return subject, text
+
+def render_missed(visit_day: str):
+    """(subject, text) for a missed ANC visit follow-up."""
+    subject = f"{APP_NAME}: We missed you at your ANC visit"
+    text = (
+        "Hello,\n\n"
+        f"Our records show you were not able to attend your ANC visit on {visit_day}.\n"
+        "Regular check-ups help catch blood pressure problems early. Please\n"
+        "reschedule your visit as soon as you can.\n"
+        f"- {APP_NAME}\n"
+    )
+    return subject, text
+
 # -----------------------------
 # Routes
 # -----------------------------
@@ -121,8 +168,6 @@ def notifications_diag():
     status = "OK"
     detail = ""
     try:
-        if not (SMTP_HOST and SMTP_PORT and SMTP_USER and SMTP_PASS and SMTP_FROM):
-            raise RuntimeError("CONFIG_MISSING")
         srv = _smtp_connect_and_auth()
         try:
             srv.noop()
@@ -141,21 +186,17 @@ def notifications_diag():
         "user_set": bool(SMTP_USER),
         "pass_set": bool(SMTP_PASS),
         "from_set": bool(SMTP_FROM),
+        "security": SMTP_SECURITY,
         "dev_outbox": bool(DEV_MAIL_DIR),
         "app_name": APP_NAME,
     }
 
 @router.post("/send-email")
-def send_email_generic(body: SendEmailIn):
-    try:
-        _send_email(body.email, body.subject, body.text or "", body.html)
-        return {"ok": True}
-    except Exception as e:
-        log.exception("send-email failed")
-        raise HTTPException(status_code=502, detail=f"{e}")
+def send_email_generic(body: SendEmailIn, db: Session = Depends(get_db)):
+    return _queue_email(db, body.email, body.subject, body.text or "", body.html)
 
 @router.post("/send-prediction")
-def send_prediction(body: SendPredictionIn):
+def send_prediction(body: SendPredictionIn, db: Session = Depends(get_db)):
     p = body.prediction
     when = p.created_at
     try:
@@ -179,28 +220,20 @@ def send_prediction(body: SendPredictionIn):
         f"This screening supports — not replaces — clinical judgment.\n"
         f"- {APP_NAME}\n"
     )
-    try:
-        _send_email(body.email, subject, text)
-        return {"ok": True}
-    except Exception as e:
-        log.exception("send-prediction failed")
-        raise HTTPException(status_code=502, detail=f"{e}")
+    return _queue_email(db, body.email, subject, text, kind="prediction")
 
 @router.post("/send-visit")
-def send_visit(body: SendVisitIn):
-    subject = f"{APP_NAME}: ANC Visit Details"
-    nxt = body.next_visit or "(to be confirmed)"
-    text = (
-        "Hello,\n\n"
-        "Your ANC visit details are below:\n"
-        f"• Last visit: {body.last_visit}\n"
-        f"• Next visit: {nxt}\n\n"
-        "Please attend your appointment for a comprehensive check-up.\n"
-        f"- {APP_NAME}\n"
-    )
-    try:
-        _send_email(body.email, subject, text)
-        return {"ok": True}
-    except Exception as e:
-        log.exception("send-visit failed")
-        raise HTTPException(status_code=502, detail=f"{e}")
+def send_visit(body: SendVisitIn, db: Session = Depends(get_db)):
+    subject, text = render_visit(body.last_visit, body.next_visit)
+    return _queue_email(db, body.email, subject, text, kind="visit")
+
+@router.get("/outbox/stats")
+def outbox_stats(db: Session = Depends(get_db)):
+    return {"counts": outbox.stats(db), "workers": outbox.WORKERS}
+
+@router.get("/outbox/{outbox_id}")
+def outbox_status(outbox_id: int, db: Session = Depends(get_db)):
+    row = outbox.status(db, outbox_id)
+    if not row:
+        raise HTTPException(status_code=404, detail="Outbox message not found")
+    return row
@@ -0,0 +1,335 @@
+# backend/app/outbox.py
+#
+# Durable email outbox.
+#   - enqueue()/enqueue_many() insert into notification_outbox inside the
+#     caller's transaction and return immediately.
+#   - Background worker threads claim due rows with FOR UPDATE SKIP LOCKED,
+#     send them over a small pool of already-authenticated SMTP sessions,
+#     and record sent / retry-with-backoff / failed (a refused recipient
+#     fails at once). If the server can't be reached the rest of the batch
+#     is handed back untried instead of each row timing out in turn.
+# Any number of API workers can run senders; rows are never sent twice
+# concurrently, and rows stuck in 'sending' (crashed worker) are reclaimed
+# after OUTBOX_LEASE_SECONDS.
+#
+# Local testing: point SMTP_HOST/SMTP_PORT at a sink such as
+#   python -m aiosmtpd -n -l localhost:1025
+# with SMTP_SECURITY=none and no SMTP_USER.
+import logging
+import os
+import queue
+import smtplib
+import socket
+import threading
+import time
+from typing import Iterable, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .db import engine
+
+log = logging.getLogger("uvicorn.error")
+
+WORKERS       = int(os.getenv("OUTBOX_WORKERS", "2"))
+BATCH_SIZE    = int(os.getenv("OUTBOX_BATCH", "20"))
+POLL_SECONDS  = float(os.getenv("OUTBOX_POLL_SECONDS", "2"))
+MAX_ATTEMPTS  = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))
+BACKOFF_BASE  = float(os.getenv("OUTBOX_BACKOFF_SECONDS", "30"))
+BACKOFF_MAX   = float(os.getenv("OUTBOX_BACKOFF_MAX_SECONDS", "3600"))
+LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "300"))
+SESSION_IDLE  = float(os.getenv("OUTBOX_SMTP_IDLE_SECONDS", "60"))
+RATE_PER_SEC  = float(os.getenv("OUTBOX_RATE_PER_SEC", "0"))  # 0 = unlimited
+
+# ---------- Schema ----------
+with engine.begin() as conn:
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            id BIGSERIAL PRIMARY KEY,
+            kind TEXT NOT NULL DEFAULT 'generic',
+            to_email TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body_text TEXT NOT NULL DEFAULT '',
+            body_html TEXT,
+            dedupe_key TEXT UNIQUE,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            locked_at TIMESTAMPTZ,
+            last_error TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            sent_at TIMESTAMPTZ
+        )
+    """))
+    conn.execute(text("ALTER TABLE notification_outbox ADD COLUMN IF NOT EXISTS campaign_id BIGINT"))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_outbox_campaign
+        ON notification_outbox (campaign_id, status)
+        WHERE campaign_id IS NOT NULL
+    """))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_outbox_due
+        ON notification_outbox (next_attempt_at)
+        WHERE status IN ('pending', 'sending')
+    """))
+
+# ---------- Enqueue ----------
+_INSERT = text("""
+    INSERT INTO notification_outbox (kind, to_email, subject, body_text, body_html, dedupe_key)
+    VALUES (:kind, :to, :subject, :text, :html, :dedupe)
+    ON CONFLICT (dedupe_key) DO NOTHING
+    RETURNING id
+""")
+
+def enqueue(db: Session, to_email: str, subject: str, text_body: str,
+            html: Optional[str] = None, kind: str = "generic",
+            dedupe_key: Optional[str] = None) -> Optional[int]:
+    """Queue one message; caller commits. Returns None if dedupe_key was already queued."""
+    return db.execute(_INSERT, {"kind": kind, "to": to_email, "subject": subject,
+                                "text": text_body or "", "html": html,
+                                "dedupe": dedupe_key}).scalar()
+
+_INSERT_MANY = text("""
+    INSERT INTO notification_outbox (kind, to_email, subject, body_text, body_html, dedupe_key, campaign_id)
+    SELECT m.kind, m.to_email, m.subject, m.body_text, m.body_html, m.dedupe_key, :campaign
+    FROM unnest(CAST(:kind AS text[]), CAST(:to AS text[]), CAST(:subject AS text[]),
+                CAST(:text AS text[]), CAST(:html AS text[]), CAST(:dedupe AS text[]))
+         AS m(kind, to_email, subject, body_text, body_html, dedupe_key)
+    ON CONFLICT (dedupe_key) DO NOTHING
+    RETURNING id
+""")
+
+def enqueue_many(db: Session, messages: Iterable[dict], campaign_id: Optional[int] = None) -> int:
+    """
+    Bulk insert dicts with keys to/subject/text[/html/kind/dedupe] in one
+    statement (column arrays + unnest); caller commits. Returns how many rows
+    were actually queued, i.e. excluding dedupe_key duplicates.
+    """
+    cols = {"kind": [], "to": [], "subject": [], "text": [], "html": [], "dedupe": []}
+    for m in messages:
+        cols["kind"].append(m.get("kind", "generic"))
+        cols["to"].append(m["to"])
+        cols["subject"].append(m["subject"])
+        cols["text"].append(m.get("text") or "")
+        cols["html"].append(m.get("html"))
+        cols["dedupe"].append(m.get("dedupe"))
+    if not cols["to"]:
+        return 0
+    return len(db.execute(_INSERT_MANY, dict(cols, campaign=campaign_id)).all())
+
+def status(db: Session, outbox_id: int) -> Optional[dict]:
+    row = db.execute(text("""
+        SELECT id, kind, to_email, status, attempts, last_error,
+               created_at, next_attempt_at, sent_at
+        FROM notification_outbox WHERE id = :id
+    """), {"id": outbox_id}).mappings().first()
+    return dict(row) if row else None
+
+def stats(db: Session) -> dict:
+    rows = db.execute(text("""
+        SELECT status, count(*) AS n FROM notification_outbox GROUP BY status
+    """)).all()
+    return {r.status: int(r.n) for r in rows}
+
+# ---------- SMTP session pool ----------
+class SMTPPool:
+    """A few long-lived authenticated SMTP sessions shared by sender threads."""
+
+    def __init__(self, connect, size: int):
+        self._connect = connect
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def acquire(self):
+        try:
+            server, last_used = self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+        if time.monotonic() - last_used > SESSION_IDLE:
+            # Servers drop idle sessions; probe before reuse
+            try:
+                server.noop()
+            except Exception:
+                self.discard(server)
+                return self._connect()
+        return server
+
+    def release(self, server):
+        try:
+            self._idle.put_nowait((server, time.monotonic()))
+        except queue.Full:
+            self.discard(server)
+
+    @staticmethod
+    def discard(server):
+        try:
+            server.quit()
+        except Exception:
+            try: server.close()
+            except Exception: pass
+
+
+class RateLimiter:
+    """Token bucket shared by all sender threads of this process."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+# ---------- Sender ----------
+_CLAIM = text("""
+    UPDATE notification_outbox o
+    SET status = 'sending', attempts = o.attempts + 1, locked_at = NOW()
+    WHERE o.id IN (
+        SELECT id FROM notification_outbox
+        WHERE (status = 'pending' AND next_attempt_at <= NOW())
+           OR (status = 'sending' AND locked_at < NOW() - make_interval(secs => :lease))
+        ORDER BY next_attempt_at
+        LIMIT :n
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING o.id, o.to_email, o.subject, o.body_text, o.body_html, o.attempts
+""")
+
+def claim_batch(n: int = BATCH_SIZE) -> List:
+    with engine.begin() as conn:
+        return conn.execute(_CLAIM, {"n": n, "lease": LEASE_SECONDS}).all()
+
+def _mark_sent(ids: List[int]):
+    if not ids:
+        return
+    with engine.begin() as conn:
+        conn.execute(text("""
+            UPDATE notification_outbox
+            SET status = 'sent', sent_at = NOW(), locked_at = NULL, last_error = NULL
+            WHERE id = ANY(:ids)
+        """), {"ids": ids})
+
+def _mark_failed(row, err: str, permanent: bool = False):
+    """Retry with backoff until MAX_ATTEMPTS; permanent errors fail at once."""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** max(0, row.attempts - 1)))
+    with engine.begin() as conn:
+        conn.execute(text("""
+            UPDATE notification_outbox
+            SET status = CASE WHEN CAST(:permanent AS BOOLEAN) OR attempts >= :max THEN 'failed' ELSE 'pending' END,
+                next_attempt_at = NOW() + make_interval(secs => :delay),
+                locked_at = NULL,
+                last_error = :err
+            WHERE id = :id
+        """), {"id": row.id, "max": MAX_ATTEMPTS, "delay": delay, "err": err[:2000],
+               "permanent": permanent})
+
+def _reschedule(rows, delay: float, err: str):
+    """Hand claimed rows back untried: the attempt claim_batch counted is undone."""
+    if not rows:
+        return
+    with engine.begin() as conn:
+        conn.execute(text("""
+            UPDATE notification_outbox
+            SET status = 'pending', attempts = GREATEST(attempts - 1, 0),
+                next_attempt_at = NOW() + make_interval(secs => :delay),
+                locked_at = NULL,
+                last_error = :err
+            WHERE id = ANY(:ids)
+        """), {"ids": [r.id for r in rows], "delay": delay, "err": err[:2000]})
+
+
+class Sender:
+    """Claims and delivers outbox batches. `transport` is notifications' SMTP/dev-file plumbing."""
+
+    def __init__(self, transport, workers: int = WORKERS, rate: float = RATE_PER_SEC):
+        self.transport = transport
+        self.workers = workers
+        self.pool = SMTPPool(transport.connect, size=workers)
+        self.limiter = RateLimiter(rate)
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"outbox-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if not self.process_batch():
+                    self._stop.wait(POLL_SECONDS)
+            except Exception as e:
+                log.error("[outbox] worker error: %s", e)
+                self._stop.wait(POLL_SECONDS)
+
+    def process_batch(self) -> int:
+        rows = claim_batch()
+        if not rows:
+            return 0
+        if self.transport.dev_dir:
+            for r in rows:
+                self.transport.write_dev(r.to_email, r.subject, r.body_text, r.body_html)
+            _mark_sent([r.id for r in rows])
+            return len(rows)
+
+        sent, server = [], None
+        try:
+            for i, r in enumerate(rows):
+                self.limiter.acquire()
+                if server is None:
+                    try:
+                        server = self.pool.acquire()
+                    except (smtplib.SMTPException, socket.timeout, OSError, RuntimeError) as e:
+                        # The server is unreachable: don't make every other row
+                        # wait out its own connect timeout; retry them all later
+                        err = f"CONNECT {type(e).__name__}: {e}"
+                        _mark_failed(r, err)
+                        _reschedule(rows[i + 1:], BACKOFF_BASE, err)
+                        log.warning("[outbox] SMTP connect failed, %d rows rescheduled: %s",
+                                    len(rows) - i, e)
+                        break
+                try:
+                    server.send_message(self.transport.build(r.to_email, r.subject, r.body_text, r.body_html))
+                    sent.append(r.id)
+                except smtplib.SMTPRecipientsRefused as e:
+                    # The address itself was rejected; retrying won't change that
+                    _mark_failed(r, f"RECIPIENT_REFUSED: {e}", permanent=True)
+                except (smtplib.SMTPException, socket.timeout, OSError, RuntimeError) as e:
+                    # Session is suspect: drop it and retry later on a fresh one
+                    _mark_failed(r, f"{type(e).__name__}: {e}")
+                    self.pool.discard(server)
+                    server = None
+        finally:
+            if server is not None:
+                self.pool.release(server)
+            _mark_sent(sent)
+        return len(rows)
+
+
+_sender: Optional[Sender] = None
+
+def start_workers(workers: int = WORKERS) -> Optional[Sender]:
+    global _sender
+    if workers <= 0 or _sender is not None:
+        return _sender
+    from . import notifications  # SMTP config lives there; imported lazily to avoid a cycle
+    _sender = Sender(notifications.transport, workers=workers)
+    _sender.start()
+    return _sender
@@ -1,12 +1,14 @@
 # app/patients.py
 from typing import Optional, List
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
 from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 
 from .db import get_db, Base, engine
 from .models_risk import PatientAdvice  # ORM for advice table
+from . import versions, identity
+from .fastjson import RowSerializer, json_response, dumps, iso, to_str
 
 # Ensure tables exist (advice table etc.)
 Base.metadata.create_all(bind=engine)
@@ -42,6 +44,18 @@ class PatientDetail(BaseModel):
     vitals: Optional[dict] = None
     advice: List[AdviceOut] = []
 
+# ---------- Fast serializers (field order == SELECT order) ----------
+ADVICE_ROW  = RowSerializer(["id", "patient_id", "text", "created_at"], {"created_at": iso})
+PATIENT_ROW = RowSerializer(["id", "full_name", "email", "phone_number", "next_visit", "appt_status"],
+                            {"appt_status": to_str})
+
+_ADVICE_SQL = text("""
+    SELECT id, patient_id, text, created_at
+    FROM patient_advice
+    WHERE patient_id = :pid
+    ORDER BY created_at DESC, id DESC
+""")
+
 # ---------- Advice ----------
 @router.post("/patients/{patient_id}/advice")
 def add_advice(patient_id: int, payload: AdviceIn, db: Session = Depends(get_db)):
@@ -59,30 +73,25 @@ def add_advice(patient_id: int, payload: AdviceIn, db: Session = Depends(get_db)
 
     adv = PatientAdvice(patient_id=patient_id, text=txt)
     db.add(adv)
+    versions.bump(db, (versions.ADVICE, patient_id), (versions.PROFILE, patient_id))
     db.commit()
     db.refresh(adv)
     return {"ok": True, "id": adv.id}
 
 @router.get("/patients/{patient_id}/advice", response_model=List[AdviceOut])
-def list_advice(patient_id: int, db: Session = Depends(get_db)):
-    rows = (
-        db.query(PatientAdvice)
-          .filter(PatientAdvice.patient_id == patient_id)
-          .order_by(PatientAdvice.created_at.desc(), PatientAdvice.id.desc())
-          .all()
-    )
-    return [
-        AdviceOut(
-            id=r.id,
-            patient_id=r.patient_id,
-            text=r.text,
-            created_at=r.created_at.isoformat()
-        )
-        for r in rows
-    ]
+def list_advice(patient_id: int, request: Request, response: Response,
+                db: Session = Depends(get_db)):
+    cached = versions.check(request, response, db, versions.ADVICE, patient_id)
+    if cached:
+        return cached
+
+    rows = db.execute(_ADVICE_SQL, {"pid": patient_id}).all()
+    return json_response(ADVICE_ROW.dumps(rows), response)
 
 # ---------- Resolve (email or ID) ----------
-@router.get("/patients/resolve")
+def _resolved(ident: identity.Identity) -> dict:
+    return {"id": ident.patient_id, "full_name": ident.full_name, "email": ident.email}
+
 @router.get("/patients/resolve")
 def resolve_patient(
     q: str = Query(..., min_length=1),
@@ -93,27 +102,15 @@ def resolve_patient(
 
     # If numeric, treat as patient_id
     if qs.isdigit():
-        row = db.execute(text("""
-            SELECT p.id, COALESCE(u.full_name, u.email) AS full_name, u.email
-            FROM patients p
-            JOIN users u ON u.id = p.user_id
-            WHERE p.id = :pid
-            LIMIT 1
-        """), {"pid": int(qs)}).mappings().first()
-        return row or {}
+        ident = identity.by_patient_id(db, int(qs))
+        return _resolved(ident) if ident else {}
 
     # If email
     if "@" in qs:
         # 1) Return existing patient for this email if present
-        row = db.execute(text("""
-            SELECT p.id, COALESCE(u.full_name, u.email) AS full_name, u.email
-            FROM users u
-            JOIN patients p ON p.user_id = u.id
-            WHERE lower(u.email) = lower(:em)
-            LIMIT 1
-        """), {"em": qs}).mappings().first()
-        if row:
-            return row
+        ident = identity.by_email(db, qs)
+        if ident and ident.patient_id:
+            return _resolved(ident)
 
         # 2) Optionally create missing user/patient
         if create_if_missing:
@@ -132,6 +129,7 @@ def resolve_patient(
                     VALUES (:em, 'patient')
                     RETURNING id, email
                 """), {"em": qs}).mappings().first()
+                identity.invalidate(db, email=qs)
                 db.commit()
 
             # ensure a patients row linked to that user
@@ -148,6 +146,7 @@ def resolve_patient(
                     VALUES (:uid)
                     RETURNING id
                 """), {"uid": urow["id"]}).mappings().first()
+                identity.invalidate(db, email=qs, user_id=urow["id"])
                 db.commit()
 
             return {
@@ -201,12 +200,20 @@ def list_patients(q: Optional[str] = None, db: Session = Depends(get_db)):
         ORDER BY COALESCE(u.full_name, u.email)
         LIMIT 200
     """)
-    rows = db.execute(sql, {"qq": (q or None)}).mappings().all()
-    return rows
+    rows = db.execute(sql, {"qq": (q or None)}).all()
+    return json_response(PATIENT_ROW.dumps(rows))
 
 # ---------- Detail ----------
 @router.get("/patients/{patient_id}", response_model=PatientDetail)
-def patient_detail(patient_id: int, db: Session = Depends(get_db)):
+def patient_detail(patient_id: int, request: Request, response: Response,
+                   db: Session = Depends(get_db)):
+    cached = versions.check(request, response, db, versions.PROFILE, patient_id)
+    if cached:
+        return cached
+    return json_response(dumps(_patient_detail(patient_id, db)), response)
+
+def _patient_detail(patient_id: int, db: Session) -> dict:
+    """PatientDetail-shaped dict built straight from rows (see fastjson.py)."""
     base = db.execute(text("""
         SELECT p.id,
                COALESCE(u.full_name, u.email) AS full_name,
@@ -230,43 +237,25 @@ def patient_detail(patient_id: int, db: Session = Depends(get_db)):
         LIMIT 1
     """), {"pid": patient_id}).mappings().first() or {}
 
-    advice_rows = (
-        db.query(PatientAdvice)
-          .filter(PatientAdvice.patient_id == patient_id)
-          .order_by(PatientAdvice.created_at.desc(), PatientAdvice.id.desc())
-          .all()
-    )
-    advice = [
-        AdviceOut(
-            id=r.id,
-            patient_id=r.patient_id,
-            text=r.text,
-            created_at=r.created_at.isoformat()
-        )
-        for r in advice_rows
-    ]
-
-    return PatientDetail(
-        id=base["id"],
-        full_name=base["full_name"],
-        email=base["email"],
-        phone_number=base["phone_number"],
-        last_visit=appt.get("last_visit"),
-        next_visit=appt.get("next_visit"),
-        appt_status=appt.get("appt_status"),
-        advice=advice
-    )
+    advice = ADVICE_ROW.many(db.execute(_ADVICE_SQL, {"pid": patient_id}).all())
+
+    appt_status = appt.get("appt_status")
+    return {
+        "id": base["id"],
+        "full_name": base["full_name"],
+        "email": base["email"],
+        "phone_number": base["phone_number"],
+        "last_visit": appt.get("last_visit"),
+        "next_visit": appt.get("next_visit"),
+        "appt_status": str(appt_status) if appt_status is not None else None,
+        "vitals": None,
+        "advice": advice,
+    }
 
 # ---------- Convenience for Patient dashboard ----------
 @router.get("/patients/by-email/{email}", response_model=PatientDetail)
 def patient_by_email(email: str, db: Session = Depends(get_db)):
-    row = db.execute(text("""
-        SELECT p.id
-        FROM users u
-        JOIN patients p ON p.user_id = u.id
-        WHERE lower(u.email) = lower(:em)
-        LIMIT 1
-    """), {"em": email}).mappings().first()
-    if not row:
+    ident = identity.by_email(db, email)
+    if not ident or not ident.patient_id:
         raise HTTPException(status_code=404, detail="Patient not found")
-    return patient_detail(row["id"], db)
+    return json_response(dumps(_patient_detail(ident.patient_id, db)))
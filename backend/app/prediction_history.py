@@ -0,0 +1,238 @@
+# backend/app/prediction_history.py
+#
+# gh_predictions is range-partitioned by month on created_at.
+#   - ensure_schema() creates the partitioned parent (migrating a legacy
+#     unpartitioned table in place) and the next few monthly partitions.
+#   - run_retention() rolls partitions older than the retention window up
+#     into gh_prediction_daily (one row per patient/day) and detaches them.
+#
+# Run the maintenance job from cron / a scheduler, e.g. daily:
+#   python -m app.prediction_history --retain-months 24
+import argparse
+import logging
+import os
+import re
+from datetime import date, datetime, timezone
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+log = logging.getLogger("uvicorn.error")
+
+PARENT = "gh_predictions"
+ROLLUP = "gh_prediction_daily"
+
+PARTITIONS_AHEAD = int(os.getenv("GH_PARTITIONS_AHEAD", "3"))
+RETAIN_MONTHS    = int(os.getenv("GH_PREDICTION_RETENTION_MONTHS", "24"))
+# Hot window used by "latest" lookups before falling back to full history
+RECENT_MONTHS    = int(os.getenv("GH_PREDICTION_RECENT_MONTHS", "3"))
+
+_SCHEMA_LOCK = 7_202_700  # pg advisory lock key
+
+_PART_RE = re.compile(rf"^{PARENT}_p(\d{{4}})_(\d{{2}})$")
+
+
+# ---------- Month helpers ----------
+def month_start(d: date) -> date:
+    return date(d.year, d.month, 1)
+
+def add_months(d: date, n: int) -> date:
+    y, m = divmod(d.month - 1 + n, 12)
+    return date(d.year + y, m + 1, 1)
+
+def partition_name(month: date) -> str:
+    return f"{PARENT}_p{month.year:04d}_{month.month:02d}"
+
+def recent_cutoff(months: int = RECENT_MONTHS) -> datetime:
+    """Lower created_at bound for hot-path queries (a partition boundary)."""
+    start = add_months(month_start(datetime.now(timezone.utc).date()), -(months - 1))
+    return datetime(start.year, start.month, 1, tzinfo=timezone.utc)
+
+
+# ---------- DDL ----------
+_PARENT_DDL = f"""
+    CREATE TABLE IF NOT EXISTS {PARENT} (
+        id SERIAL,
+        patient_id INTEGER NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
+        risk_class TEXT NOT NULL,
+        risk_score DOUBLE PRECISION NOT NULL,
+        priority BOOLEAN NOT NULL DEFAULT FALSE,
+        reasons JSONB,
+        threshold_used DOUBLE PRECISION,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at)
+"""
+
+_ROLLUP_DDL = f"""
+    CREATE TABLE IF NOT EXISTS {ROLLUP} (
+        patient_id INTEGER NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
+        day DATE NOT NULL,
+        n_predictions INTEGER NOT NULL,
+        n_high INTEGER NOT NULL,
+        n_priority INTEGER NOT NULL,
+        min_score DOUBLE PRECISION NOT NULL,
+        max_score DOUBLE PRECISION NOT NULL,
+        avg_score DOUBLE PRECISION NOT NULL,
+        last_score DOUBLE PRECISION NOT NULL,
+        last_class TEXT NOT NULL,
+        PRIMARY KEY (patient_id, day)
+    )
+"""
+
+def _relkind(conn: Connection, name: str) -> Optional[str]:
+    return conn.execute(text("""
+        SELECT c.relkind
+        FROM pg_class c
+        WHERE c.oid = to_regclass(:name)
+    """), {"name": name}).scalar()
+
+def create_partition(conn: Connection, month: date) -> str:
+    month = month_start(month)
+    nxt = add_months(month, 1)
+    name = partition_name(month)
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {name}
+        PARTITION OF {PARENT}
+        FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') TO ('{nxt.isoformat()} 00:00:00+00')
+    """))
+    return name
+
+def ensure_partitions(conn: Connection, ahead: int = PARTITIONS_AHEAD,
+                      start: Optional[date] = None) -> List[str]:
+    """Create monthly partitions from `start` (default: this month) through `ahead` months out."""
+    first = month_start(start or datetime.now(timezone.utc).date())
+    last = add_months(month_start(datetime.now(timezone.utc).date()), ahead)
+    names, m = [], first
+    while m <= last:
+        names.append(create_partition(conn, m))
+        m = add_months(m, 1)
+    return names
+
+def _migrate_legacy(conn: Connection):
+    """Move an unpartitioned gh_predictions into the partitioned layout (one transaction)."""
+    log.warning("[GH] migrating %s to monthly partitions", PARENT)
+    conn.execute(text(f"ALTER TABLE {PARENT} RENAME TO {PARENT}_legacy"))
+    conn.execute(text(f"ALTER TABLE {PARENT}_legacy RENAME CONSTRAINT {PARENT}_pkey TO {PARENT}_legacy_pkey"))
+    conn.execute(text(_PARENT_DDL))
+
+    oldest = conn.execute(text(f"SELECT min(created_at) FROM {PARENT}_legacy")).scalar()
+    ensure_partitions(conn, start=oldest.astimezone(timezone.utc).date() if oldest else None)
+
+    conn.execute(text(f"""
+        INSERT INTO {PARENT} (id, patient_id, risk_class, risk_score, priority,
+                              reasons, threshold_used, created_at)
+        SELECT id, patient_id, risk_class, risk_score, priority,
+               reasons, threshold_used, created_at
+        FROM {PARENT}_legacy
+    """))
+    conn.execute(text(f"""
+        SELECT setval(pg_get_serial_sequence('{PARENT}', 'id'),
+                      COALESCE((SELECT max(id) FROM {PARENT}), 0) + 1, false)
+    """))
+    conn.execute(text(f"DROP TABLE {PARENT}_legacy"))
+
+def ensure_schema(engine: Engine):
+    with engine.begin() as conn:
+        # Every worker runs this at import; serialize them so only the first
+        # one to get the lock sees the legacy table and migrates it, and the
+        # rest re-check after its commit and find the partitioned parent
+        conn.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": _SCHEMA_LOCK})
+        kind = _relkind(conn, PARENT)
+        if kind == "r":
+            _migrate_legacy(conn)
+        elif kind is None:
+            conn.execute(text(_PARENT_DDL))
+        # Declared on the parent so every partition gets its own local copy
+        conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS ix_{PARENT}_patient_created
+            ON {PARENT} (patient_id, created_at DESC, id DESC)
+        """))
+        conn.execute(text(_ROLLUP_DDL))
+        ensure_partitions(conn)
+
+
+# ---------- Retention ----------
+def list_partitions(conn: Connection) -> List[tuple]:
+    """[(month, relname)] for currently attached monthly partitions, oldest first."""
+    rows = conn.execute(text("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(:parent)
+    """), {"parent": PARENT}).scalars().all()
+    out = []
+    for name in rows:
+        m = _PART_RE.match(name)
+        if m:
+            out.append((date(int(m.group(1)), int(m.group(2)), 1), name))
+    return sorted(out)
+
+def rollup_partition(conn: Connection, name: str) -> int:
+    """Fold one partition into per-patient/per-day summaries. Idempotent."""
+    res = conn.execute(text(f"""
+        INSERT INTO {ROLLUP} (patient_id, day, n_predictions, n_high, n_priority,
+                              min_score, max_score, avg_score, last_score, last_class)
+        SELECT patient_id,
+               (created_at AT TIME ZONE 'UTC')::date AS day,
+               count(*),
+               count(*) FILTER (WHERE risk_class = 'High'),
+               count(*) FILTER (WHERE priority),
+               min(risk_score),
+               max(risk_score),
+               avg(risk_score),
+               (array_agg(risk_score ORDER BY created_at DESC, id DESC))[1],
+               (array_agg(risk_class ORDER BY created_at DESC, id DESC))[1]
+        FROM {name}
+        GROUP BY 1, 2
+        ON CONFLICT (patient_id, day) DO UPDATE SET
+            n_predictions = EXCLUDED.n_predictions,
+            n_high        = EXCLUDED.n_high,
+            n_priority    = EXCLUDED.n_priority,
+            min_score     = EXCLUDED.min_score,
+            max_score     = EXCLUDED.max_score,
+            avg_score     = EXCLUDED.avg_score,
+            last_score    = EXCLUDED.last_score,
+            last_class    = EXCLUDED.last_class
+    """))
+    return res.rowcount or 0
+
+def run_retention(engine: Engine, retain_months: int = RETAIN_MONTHS,
+                  drop: bool = False) -> List[dict]:
+    """
+    Roll up and detach every partition that ends before the retention window.
+    Each partition is handled in its own transaction so a failure leaves the
+    rest attached and the job can simply be re-run.
+    """
+    with engine.begin() as conn:
+        ensure_partitions(conn)
+        parts = list_partitions(conn)
+
+    cutoff = add_months(month_start(datetime.now(timezone.utc).date()), -retain_months)
+    done = []
+    for month, name in parts:
+        if add_months(month, 1) > cutoff:
+            break
+        with engine.begin() as conn:
+            days = rollup_partition(conn, name)
+            conn.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {name}"))
+            if drop:
+                conn.execute(text(f"DROP TABLE {name}"))
+        log.info("[GH] retention: %s rolled up (%d patient-days), %s",
+                 name, days, "dropped" if drop else "detached")
+        done.append({"partition": name, "patient_days": days, "dropped": drop})
+    return done
+
+
+if __name__ == "__main__":
+    from .db import engine
+
+    ap = argparse.ArgumentParser(description="gh_predictions partition maintenance")
+    ap.add_argument("--retain-months", type=int, default=RETAIN_MONTHS)
+    ap.add_argument("--drop", action="store_true", help="drop partitions after detaching")
+    args = ap.parse_args()
+
+    ensure_schema(engine)
+    for r in run_retention(engine, retain_months=args.retain_months, drop=args.drop):
+        print(r)
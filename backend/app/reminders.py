@@ -0,0 +1,223 @@
+# backend/app/reminders.py
+#
+# Background reminder sweeper. Every REMINDER_SWEEP_SECONDS each worker:
+#   1) claims appointments due within REMINDER_DAYS_AHEAD days that have no
+#      reminder yet, stamps reminder_sent_at and queues a visit reminder;
+#   2) claims open appointments whose day has passed (REMINDER_MISSED_GRACE_DAYS)
+#      without confirmation, moves them to 'missed' and queues a follow-up.
+# Claims are batched UPDATE ... FROM (SELECT ... FOR UPDATE SKIP LOCKED), so
+# any number of workers share the work; the status change and the outbox
+# row commit together.
+#
+# Both scans are index range scans over partial indexes that only contain
+# outstanding work (unsent reminders / open visits), so neither needs to
+# remember where it stopped: a visit skipped because another transaction
+# held it, or booked/moved onto a past day later, is still in the index and
+# is picked up by the next run. The missed sweep's watermark is only a
+# floor fixed on its first run (REMINDER_MISSED_LOOKBACK_DAYS), so old
+# history isn't mass-marked when the sweeper is first deployed. A missed
+# visit also gives its slot back (slots.release_many, one statement per batch).
+import logging
+import os
+import threading
+import time
+from datetime import date, timedelta
+from typing import Optional
+
+from fastapi import APIRouter, Depends
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .db import get_db, engine, SessionLocal
+from . import cohort, versions, outbox, slots
+from .notifications import render_visit, render_missed
+from .session_tokens import require_role
+
+router = APIRouter(prefix="/reminders", tags=["reminders"])
+log = logging.getLogger("uvicorn.error")
+
+SWEEP_SECONDS  = int(os.getenv("REMINDER_SWEEP_SECONDS", "900"))
+DAYS_AHEAD     = int(os.getenv("REMINDER_DAYS_AHEAD", "2"))
+MISSED_GRACE   = int(os.getenv("REMINDER_MISSED_GRACE_DAYS", "1"))
+MISSED_LOOKBACK = int(os.getenv("REMINDER_MISSED_LOOKBACK_DAYS", "30"))  # first run only
+BATCH_SIZE     = int(os.getenv("REMINDER_BATCH", "200"))
+
+# ---------- Schema ----------
+# ALTER TYPE ... ADD VALUE can't be used in the transaction that adds it
+with engine.connect() as conn:
+    conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+    conn.execute(text("""
+        DO $$
+        BEGIN
+            IF to_regtype('appointment_status_enum') IS NOT NULL THEN
+                ALTER TYPE appointment_status_enum ADD VALUE IF NOT EXISTS 'missed';
+            END IF;
+        END $$
+    """))
+
+with engine.begin() as conn:
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS sweeper_watermarks (
+            name TEXT PRIMARY KEY,
+            mark DATE NOT NULL,
+            processed BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+    """))
+    conn.execute(text("""
+        DO $$
+        BEGIN
+            IF to_regclass('appointments') IS NOT NULL THEN
+                ALTER TABLE appointments ADD COLUMN IF NOT EXISTS reminder_sent_at TIMESTAMPTZ;
+                CREATE INDEX IF NOT EXISTS ix_appointments_reminder_due
+                    ON appointments ((COALESCE(scheduled_for, next_visit)))
+                    WHERE reminder_sent_at IS NULL AND status IN ('scheduled', 'rescheduled');
+                CREATE INDEX IF NOT EXISTS ix_appointments_open_day
+                    ON appointments ((COALESCE(scheduled_for, next_visit)))
+                    WHERE status IN ('scheduled', 'rescheduled');
+            END IF;
+        END $$
+    """))
+
+# ---------- Claims ----------
+# Predicates repeat the partial-index conditions verbatim so the planner uses them
+_CLAIM_UPCOMING = text("""
+    UPDATE appointments a
+    SET reminder_sent_at = NOW()
+    FROM (
+        SELECT id FROM appointments
+        WHERE COALESCE(scheduled_for, next_visit) >= :today
+          AND COALESCE(scheduled_for, next_visit) < :until
+          AND reminder_sent_at IS NULL AND status IN ('scheduled', 'rescheduled')
+        ORDER BY COALESCE(scheduled_for, next_visit)
+        LIMIT :n
+        FOR UPDATE SKIP LOCKED
+    ) due, patients p, users u
+    WHERE a.id = due.id AND p.id = a.patient_id AND u.id = p.user_id
+    RETURNING a.id, a.last_visit, COALESCE(a.scheduled_for, a.next_visit)::date AS day, u.email
+""")
+
+_CLAIM_MISSED = text("""
+    UPDATE appointments a
+    SET status = 'missed'
+    FROM (
+        SELECT id, status::text AS prev_status FROM appointments
+        WHERE COALESCE(scheduled_for, next_visit) >= :since
+          AND COALESCE(scheduled_for, next_visit) < :cutoff
+          AND status IN ('scheduled', 'rescheduled')
+        ORDER BY COALESCE(scheduled_for, next_visit)
+        LIMIT :n
+        FOR UPDATE SKIP LOCKED
+    ) due, patients p, users u
+    WHERE a.id = due.id AND p.id = a.patient_id AND u.id = p.user_id
+    RETURNING a.id, a.patient_id, a.facility_id, a.slot_index, due.prev_status,
+              COALESCE(a.scheduled_for, a.next_visit)::date AS day, u.email
+""")
+
+def sweep_upcoming(today: Optional[date] = None, batch_size: int = BATCH_SIZE) -> int:
+    today = today or date.today()
+    until = today + timedelta(days=DAYS_AHEAD + 1)
+    total = 0
+    while True:
+        with SessionLocal() as db:
+            rows = db.execute(_CLAIM_UPCOMING, {"today": today, "until": until, "n": batch_size}).all()
+            if not rows:
+                return total
+            rendered = {}
+            messages = []
+            for r in rows:
+                key = (r.last_visit, r.day)
+                if key not in rendered:
+                    rendered[key] = render_visit(r.last_visit.isoformat() if r.last_visit else None,
+                                                 r.day.isoformat())
+                subject, body = rendered[key]
+                # Same key as campaigns.py, so a campaign and the sweeper never both send
+                messages.append({"kind": "visit_reminder", "to": r.email, "subject": subject,
+                                 "text": body, "dedupe": f"visit_reminder:{r.id}:{r.day.isoformat()}"})
+            outbox.enqueue_many(db, messages)
+            db.commit()
+        total += len(rows)
+
+def _floor(name: str, default: date) -> date:
+    """The sweep's fixed lower bound; the first run stores `default`."""
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO sweeper_watermarks (name, mark) VALUES (:n, :d)
+            ON CONFLICT (name) DO NOTHING
+        """), {"n": name, "d": default})
+        return conn.execute(text("SELECT mark FROM sweeper_watermarks WHERE name = :n"),
+                            {"n": name}).scalar()
+
+def sweep_missed(today: Optional[date] = None, batch_size: int = BATCH_SIZE) -> int:
+    today = today or date.today()
+    cutoff = today - timedelta(days=max(MISSED_GRACE - 1, 0))  # visits before cutoff are missed
+    since = _floor("missed", today - timedelta(days=MISSED_LOOKBACK))
+    if since >= cutoff:
+        return 0
+
+    total = 0
+    while True:
+        with SessionLocal() as db:
+            rows = db.execute(_CLAIM_MISSED, {"since": since, "cutoff": cutoff, "n": batch_size}).all()
+            if not rows:
+                break
+            cohort.on_appointment_changes(db, [(r.day, r.prev_status, r.day, "missed") for r in rows])
+            slots.release_many(db, [(r.facility_id, r.day, r.slot_index) for r in rows])
+            messages = []
+            for r in rows:
+                subject, body = render_missed(r.day.isoformat())
+                messages.append({"kind": "visit_missed", "to": r.email, "subject": subject,
+                                 "text": body, "dedupe": f"visit_missed:{r.id}"})
+            outbox.enqueue_many(db, messages)
+            versions.bump(db, *[(versions.PROFILE, r.patient_id) for r in rows],
+                          *[versions.appointments(r.facility_id) for r in rows])
+            db.commit()
+        total += len(rows)
+
+    if total:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                UPDATE sweeper_watermarks
+                SET processed = processed + :n, updated_at = NOW()
+                WHERE name = 'missed'
+            """), {"n": total})
+    return total
+
+def sweep(today: Optional[date] = None) -> dict:
+    t0 = time.perf_counter()
+    out = {"reminded": sweep_upcoming(today), "missed": sweep_missed(today)}
+    out["seconds"] = round(time.perf_counter() - t0, 3)
+    if out["reminded"] or out["missed"]:
+        log.info("[reminders] sweep: %s", out)
+    return out
+
+def _sweep_loop(interval: int):
+    while True:
+        try:
+            sweep()
+        except Exception as e:
+            log.error("[reminders] sweep failed: %s", e)
+        time.sleep(interval)
+
+def start_sweeper(interval: int = SWEEP_SECONDS):
+    """Background sweep thread; SKIP LOCKED lets every worker run one."""
+    if interval <= 0:
+        return None
+    t = threading.Thread(target=_sweep_loop, args=(interval,), name="reminder-sweep", daemon=True)
+    t.start()
+    return t
+
+# ---------- Endpoints ----------
+@router.get("/status")
+def reminders_status(db: Session = Depends(get_db)):
+    rows = db.execute(text("SELECT name, mark, processed, updated_at FROM sweeper_watermarks")).mappings().all()
+    return {"days_ahead": DAYS_AHEAD, "missed_grace_days": MISSED_GRACE,
+            "watermarks": [dict(r) for r in rows]}
+
+@router.post("/sweep")
+def reminders_sweep(_admin: dict = Depends(require_role("admin"))):
+    return {"ok": True, **sweep()}
+
+
+if __name__ == "__main__":
+    print(sweep())
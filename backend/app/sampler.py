@@ -0,0 +1,111 @@
+# backend/app/sampler.py
+#
+# On-demand statistical profiler for a live worker (admin only):
+#   POST /debug/profile?seconds=10&interval_ms=10&route=/gh/predict-gh
+# Every interval the profiling thread reads every other thread's current
+# stack with sys._current_frames() and counts it; nothing is installed in
+# the traced code, so the cost is one stack walk per thread per tick and
+# stops when the window ends. The answer is collapsed stacks, one
+# "frame;frame;frame count" line per distinct stack (root first), which
+# flamegraph.pl, speedscope and inferno read directly.
+#
+# route= keeps only samples taken while that route's endpoint function is
+# on the stack. Output is bounded: stacks are cut to MAX_DEPTH frames and
+# only the most frequent max_stacks are kept (the rest are summed into one
+# "[other]" line). One profile runs at a time per worker.
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional, Set
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse
+
+from .session_tokens import require_role
+
+router = APIRouter(prefix="/debug", tags=["debug"])
+
+MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+MAX_DEPTH = 64
+# Leaf frames in these files mean the thread is parked, not working
+_IDLE_FILES = ("threading.py", "selectors.py", "queue.py", "socket.py", "ssl.py")
+
+_busy = threading.Lock()
+
+def _label(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+def _route_codes(request: Request, path: str) -> Set:
+    codes = {getattr(r.endpoint, "__code__", None) for r in request.app.routes
+             if getattr(r, "path", None) == path and getattr(r, "endpoint", None)}
+    codes.discard(None)
+    if not codes:
+        raise HTTPException(status_code=404, detail=f"No route {path}")
+    return codes
+
+def sample(seconds: float, interval: float, codes: Optional[Set] = None,
+           include_idle: bool = False) -> (Counter, int):
+    me = threading.get_ident()
+    stacks: Counter = Counter()
+    ticks = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for tid, frame in sys._current_frames().items():
+            if tid == me:
+                continue
+            if not include_idle and os.path.basename(frame.f_code.co_filename) in _IDLE_FILES:
+                continue
+            names, matched, depth, f = [], codes is None, 0, frame
+            while f is not None:
+                if not matched and f.f_code in codes:
+                    matched = True
+                if depth < MAX_DEPTH:
+                    names.append(_label(f.f_code))
+                depth += 1
+                f = f.f_back
+            if depth > MAX_DEPTH:
+                names.append("[truncated]")
+            if matched:
+                stacks[";".join(reversed(names))] += 1
+        ticks += 1
+        time.sleep(interval)
+    return stacks, ticks
+
+def collapse(stacks: Counter, max_stacks: int) -> str:
+    top = stacks.most_common(max_stacks)
+    lines = [f"{s} {n}" for s, n in top]
+    rest = sum(stacks.values()) - sum(n for _, n in top)
+    if rest:
+        lines.append(f"[other] {rest}")
+    return "\n".join(lines) + "\n"
+
+@router.post("/profile", response_class=PlainTextResponse)
+def profile(
+    request: Request,
+    seconds: float = Query(10.0, gt=0),
+    interval_ms: float = Query(10.0, ge=1, le=1000),
+    route: Optional[str] = Query(None, description="Only samples inside this route's endpoint, e.g. /gh/predict-gh"),
+    max_stacks: int = Query(2000, ge=1, le=20000),
+    include_idle: bool = Query(False),
+    _admin: dict = Depends(require_role("admin")),
+):
+    if seconds > MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be <= {MAX_SECONDS:g}")
+    codes = _route_codes(request, route) if route else None
+    if not _busy.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="A profile is already running on this worker")
+    try:
+        t0 = time.perf_counter()
+        stacks, ticks = sample(seconds, interval_ms / 1000.0, codes, include_idle)
+        elapsed = time.perf_counter() - t0
+    finally:
+        _busy.release()
+    return PlainTextResponse(collapse(stacks, max_stacks), headers={
+        "X-Profile-Pid": str(os.getpid()),
+        "X-Profile-Ticks": str(ticks),
+        "X-Profile-Samples": str(sum(stacks.values())),
+        "X-Profile-Stacks": str(len(stacks)),
+        "X-Profile-Seconds": f"{elapsed:.2f}",
+    })
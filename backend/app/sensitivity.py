@@ -0,0 +1,171 @@
+# backend/app/sensitivity.py
+#
+# "What if" scoring for one patient:
+#   POST /gh/sensitivity
+#   {"inputs": {...same body as /gh/predict-gh...},
+#    "grid": {"systolic_bp": [-30, -20, -10, 0], "bmi": [-4, -2, 0]}}
+# grid maps input fields to changes applied to the patient's values
+# (binary fields take -1/+1 to clear/set the flag); omitted, DEFAULT_GRID
+# is used. Every combination is built as one numpy matrix and scored with a
+# single predict_proba + calibration call (gh_predict.score_matrix) on the
+# bundle /gh/predict-gh would route the patient to, so a few thousand
+# points answer in tens of milliseconds. Nothing is saved and drift is not
+# fed: these are hypothetical inputs, not observations.
+#
+# The answer has the score surface (flat, C-order over the grid axes;
+# null where a combination leaves the PredictIn bounds), the smallest
+# combined change that moves the patient across the screening threshold,
+# and per field the smallest change that does so on its own. "Smallest" is
+# the sum of |change| / STEP over the fields changed, so 10 mmHg SBP
+# weighs the same as 1 kg/m2 BMI.
+import os
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel, validator
+from sqlalchemy.orm import Session
+
+from .db import get_db
+from . import model_pool
+from .fastjson import dumps, json_response
+from .gh_predict import PredictIn, _payload_values, _vector_from_payload, score_matrix
+
+router = APIRouter()
+
+MAX_POINTS = int(os.getenv("SENSITIVITY_MAX_POINTS", "5000"))
+
+# input field -> (model feature, min, max, step); bounds as in PredictIn
+FIELDS = {
+    "age":                    ("Age", 10, 60, 1),
+    "bmi":                    ("BMI", 10, 80, 1),
+    "systolic_bp":            ("Systolic BP", 60, 250, 10),
+    "diastolic_bp":           ("Diastolic BP", 40, 150, 5),
+    "previous_complications": ("Previous Complications", 0, 1, 1),
+    "preexisting_diabetes":   ("Preexisting Diabetes", 0, 1, 1),
+    "gestational_diabetes":   ("Gestational Diabetes", 0, 1, 1),
+    "mental_health":          ("Mental Health", 0, 1, 1),
+    "heart_rate":             ("Heart Rate", 40, 220, 10),
+}
+BINARY = {"previous_complications", "preexisting_diabetes", "gestational_diabetes", "mental_health"}
+
+DEFAULT_GRID = {
+    "systolic_bp":  list(range(-40, 21, 10)),
+    "diastolic_bp": list(range(-20, 11, 5)),
+    "bmi":          [-6, -4, -3, -2, -1, 0, 1, 2],
+    "gestational_diabetes": [-1, 0, 1],
+    "mental_health":        [-1, 0, 1],
+}
+
+# ---------- Schemas ----------
+class SensitivityIn(BaseModel):
+    inputs: PredictIn
+    grid: Optional[Dict[str, List[float]]] = None
+
+    @validator("grid")
+    def _known_fields(cls, grid):
+        if grid is None:
+            return grid
+        unknown = sorted(set(grid) - set(FIELDS))
+        if unknown:
+            raise ValueError(f"Unknown grid fields {unknown}; one of {sorted(FIELDS)}")
+        for field, deltas in grid.items():
+            if not deltas:
+                raise ValueError(f"grid.{field} is empty")
+            if field in BINARY and any(d not in (-1, 0, 1) for d in deltas):
+                raise ValueError(f"grid.{field} takes -1, 0 or 1")
+        return grid
+
+# ---------- Grid ----------
+def build_grid(p: PredictIn, grid: Dict[str, List[float]], bundle: model_pool.Bundle):
+    """Returns (fields, axes, deltas (N, k), X (N, features), in_bounds (N,))."""
+    fields = list(grid)
+    # 0 is always on each axis so single-field changes can be read off the grid
+    axes = [np.unique(np.append(np.asarray(grid[f], dtype=np.float64), 0.0)) for f in fields]
+    n = int(np.prod([len(a) for a in axes]))
+    if n > MAX_POINTS:
+        raise ValueError(f"Grid has {n} points; the limit is {MAX_POINTS}")
+    deltas = np.stack([m.ravel() for m in np.meshgrid(*axes, indexing="ij")], axis=1)
+
+    base = _vector_from_payload(p, _payload_values(p), bundle)
+    X = np.repeat(base, n, axis=0)
+    in_bounds = np.ones(n, dtype=bool)
+    for j, f in enumerate(fields):
+        feat, lo, hi, _ = FIELDS[f]
+        col = bundle.feat_index[feat]
+        X[:, col] += deltas[:, j]
+        in_bounds &= (X[:, col] >= lo) & (X[:, col] <= hi)
+    return fields, axes, deltas, X, in_bounds
+
+def smallest_crossing(fields: List[str], deltas: np.ndarray, scores: np.ndarray,
+                      valid: np.ndarray, threshold: float, baseline_high: bool) -> Optional[int]:
+    """Row index of the cheapest change that flips the class, ties broken by
+    fewer fields changed, then by the larger margin past the threshold."""
+    crossed = valid & ((scores < threshold) if baseline_high else (scores >= threshold))
+    if not crossed.any():
+        return None
+    steps = np.array([FIELDS[f][3] for f in fields], dtype=np.float64)
+    cost = (np.abs(deltas) / steps).sum(axis=1)
+    changed = (deltas != 0).sum(axis=1)
+    margin = np.abs(scores - threshold)
+    idx = np.flatnonzero(crossed)
+    order = np.lexsort((-margin[idx], changed[idx], cost[idx]))
+    return int(idx[order[0]])
+
+def _change(fields: List[str], row: np.ndarray) -> Dict[str, float]:
+    return {f: float(d) for f, d in zip(fields, row) if d != 0}
+
+# ---------- Endpoint ----------
+@router.post("/gh/sensitivity")
+def sensitivity(body: SensitivityIn, db: Session = Depends(get_db)):
+    t0 = time.perf_counter()
+    p = body.inputs
+    grid = body.grid or DEFAULT_GRID
+    bundle = model_pool.route(db, p.facility_id, p.source, p.patient_id)
+    try:
+        fields, axes, deltas, X, valid = build_grid(p, grid, bundle)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        scores = score_matrix(bundle, X)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Inference failed: {e}")
+
+    threshold = bundle.threshold
+    origin = int(np.flatnonzero((deltas == 0).all(axis=1))[0])
+    baseline = float(scores[origin])
+    baseline_high = baseline >= threshold
+
+    best = smallest_crossing(fields, deltas, scores, valid, threshold, baseline_high)
+    crossing = None if best is None else {
+        "change": _change(fields, deltas[best]),
+        "risk_score": round(float(scores[best]), 4),
+        "risk_class": "High" if scores[best] >= threshold else "Low",
+    }
+
+    # One field at a time: rows where every other delta is 0
+    single = {}
+    for j, f in enumerate(fields):
+        others = np.delete(deltas, j, axis=1)
+        alone = (others == 0).all(axis=1) if others.size else np.ones(len(deltas), dtype=bool)
+        k = smallest_crossing(fields, deltas, scores, valid & alone, threshold, baseline_high)
+        single[f] = None if k is None else {
+            "change": float(deltas[k, j]), "risk_score": round(float(scores[k]), 4)}
+
+    surface = np.where(valid, np.round(scores, 4), np.nan)
+    out = {
+        "model": bundle.name,
+        "threshold_used": threshold,
+        "baseline": {"risk_score": round(baseline, 4), "risk_class": "High" if baseline_high else "Low"},
+        "fields": fields,
+        "axes": [a.tolist() for a in axes],
+        "shape": [len(a) for a in axes],
+        "points": int(len(scores)),
+        "surface": [None if np.isnan(s) else s for s in surface.tolist()],
+        "smallest_crossing": crossing,
+        "single_field": single,
+        "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1),
+    }
+    return json_response(dumps(out))
@@ -0,0 +1,179 @@
+# backend/app/session_tokens.py
+#
+# Two layers so only the first request of a session needs Firebase:
+#   1) FirebaseVerifier: verifies Firebase ID tokens locally against Google's
+#      public certs (cached per their Cache-Control max-age) and caches the
+#      decoded claims until the token's own exp.
+#   2) Session tokens: after login we issue a compact HMAC-SHA256 signed
+#      token (payload.signature, base64url). Every later request is checked
+#      with one local HMAC; no network hop, no DB.
+#
+# For tests, pass a fetch_certs callable returning ({kid: cert_pem}, ttl)
+# built from a locally generated RSA key pair and sign ID tokens with the
+# private key (RS256, "kid" header, iss/aud for FIREBASE_PROJECT_ID).
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+import urllib.request
+from typing import Callable, Dict, Optional, Tuple
+
+from fastapi import Depends, Header, HTTPException
+
+from .identity import TTLCache
+
+log = logging.getLogger("uvicorn.error")
+
+GOOGLE_CERTS_URL = ("https://www.googleapis.com/robot/v1/metadata/x509/"
+                    "securetoken@system.gserviceaccount.com")
+FIREBASE_PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID", "")
+CLOCK_SKEW = int(os.getenv("AUTH_CLOCK_SKEW", "60"))
+
+SESSION_SECRET = os.getenv("SECRET_KEY", "")
+SESSION_TTL    = int(os.getenv("SESSION_TTL", str(12 * 3600)))
+# Local development only: allow a throwaway per-process secret
+DEV_SECRET     = os.getenv("SESSION_DEV_SECRET", "").lower() in ("1", "true", "yes")
+
+if not SESSION_SECRET:
+    if not DEV_SECRET:
+        # A generated secret differs per worker and per restart, so tokens
+        # issued by one process would be rejected by every other one
+        raise RuntimeError("SECRET_KEY is not set; session tokens need one secret shared by "
+                           "all workers (set SESSION_DEV_SECRET=1 to run locally without it)")
+    SESSION_SECRET = secrets.token_urlsafe(32)
+    log.warning("[auth] SESSION_DEV_SECRET: using a per-process session secret; "
+                "tokens won't survive restarts or work across workers")
+
+
+# ---------- Firebase ID token verification ----------
+def fetch_google_certs() -> Tuple[Dict[str, str], float]:
+    with urllib.request.urlopen(GOOGLE_CERTS_URL, timeout=10) as resp:
+        certs = json.loads(resp.read().decode("utf-8"))
+        m = re.search(r"max-age=(\d+)", resp.headers.get("Cache-Control", ""))
+    return certs, float(m.group(1)) if m else 3600.0
+
+
+class FirebaseVerifier:
+    def __init__(self, project_id: Optional[str] = None,
+                 fetch_certs: Callable[[], Tuple[Dict[str, str], float]] = fetch_google_certs,
+                 claims_cache_size: int = 10000):
+        self._project_id = project_id
+        self._fetch_certs = fetch_certs
+        self._certs: Dict[str, str] = {}
+        self._certs_expiry = 0.0
+        self._certs_lock = threading.Lock()
+        self._claims = TTLCache(maxsize=claims_cache_size)
+
+    @property
+    def project_id(self) -> str:
+        if not self._project_id:
+            self._project_id = FIREBASE_PROJECT_ID
+        if not self._project_id:
+            import firebase_admin
+            self._project_id = firebase_admin.get_app().project_id
+        return self._project_id
+
+    def certs(self, force: bool = False) -> Dict[str, str]:
+        with self._certs_lock:
+            if force or time.monotonic() >= self._certs_expiry:
+                self._certs, ttl = self._fetch_certs()
+                self._certs_expiry = time.monotonic() + ttl
+            return self._certs
+
+    def verify(self, id_token: str) -> dict:
+        """Decoded claims (with "uid"), or ValueError if the token is not valid."""
+        key = hashlib.sha256(id_token.encode("utf-8")).digest()
+        found, claims = self._claims.get(key)
+        if found:
+            if claims["exp"] > time.time():
+                return claims
+            self._claims.evict(key)
+
+        from google.auth import jwt as gjwt
+
+        header = gjwt.decode_header(id_token)
+        if header.get("alg") != "RS256":
+            raise ValueError("Firebase ID token must be RS256")
+        certs = self.certs()
+        if header.get("kid") not in certs:
+            # Google rotates keys; refetch once before giving up
+            certs = self.certs(force=True)
+        claims = gjwt.decode(id_token, certs=certs, audience=self.project_id,
+                             clock_skew_in_seconds=CLOCK_SKEW)
+
+        if claims.get("iss") != f"https://securetoken.google.com/{self.project_id}":
+            raise ValueError("Firebase ID token has incorrect issuer")
+        sub = claims.get("sub")
+        if not isinstance(sub, str) or not sub or len(sub) > 128:
+            raise ValueError("Firebase ID token has invalid subject")
+        if claims.get("auth_time", 0) > time.time() + CLOCK_SKEW:
+            raise ValueError("Firebase ID token auth_time is in the future")
+
+        claims = dict(claims, uid=sub)
+        self._claims.set(key, claims, ttl=max(0.0, claims["exp"] - time.time()))
+        return claims
+
+
+verifier = FirebaseVerifier()
+
+
+# ---------- Session tokens ----------
+def _b64e(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+def _b64d(s: str) -> bytes:
+    return base64.urlsafe_b64decode(s + "=" * (-len(s) % 4))
+
+def _secret() -> bytes:
+    return SESSION_SECRET.encode("utf-8")
+
+def issue(user_id: int, role: Optional[str], patient_id: Optional[int] = None,
+          ttl: int = SESSION_TTL) -> Tuple[str, int]:
+    """Returns (token, exp epoch seconds)."""
+    now = int(time.time())
+    payload = {"sub": user_id, "role": role, "pid": patient_id, "iat": now, "exp": now + ttl}
+    body = _b64e(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+    sig = _b64e(hmac.new(_secret(), body.encode("ascii"), hashlib.sha256).digest())
+    return f"{body}.{sig}", payload["exp"]
+
+def verify(token: str) -> dict:
+    try:
+        body, sig = token.split(".")
+        expected = hmac.new(_secret(), body.encode("ascii"), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, _b64d(sig)):
+            raise ValueError("bad signature")
+        payload = json.loads(_b64d(body))
+    except Exception:
+        raise HTTPException(status_code=401, detail="Invalid session token")
+    if payload.get("exp", 0) < time.time():
+        raise HTTPException(status_code=401, detail="Session expired")
+    return payload
+
+# ---------- Capability tokens ----------
+def capability(purpose: str) -> str:
+    """Long-lived signature over `purpose` (e.g. one calendar feed's scope) for
+    clients that can't send a bearer token. Rotating SECRET_KEY revokes them all."""
+    return _b64e(hmac.new(_secret(), b"cap:" + purpose.encode("utf-8"), hashlib.sha256).digest())
+
+def check_capability(purpose: str, token: Optional[str]) -> bool:
+    return bool(token) and hmac.compare_digest(capability(purpose).encode("ascii"), token.encode("utf-8"))
+
+
+# ---------- FastAPI dependencies ----------
+def current_session(authorization: Optional[str] = Header(None)) -> dict:
+    if not authorization or not authorization.lower().startswith("bearer "):
+        raise HTTPException(status_code=401, detail="Missing bearer token")
+    return verify(authorization[7:].strip())
+
+def require_role(*roles: str):
+    def _dep(session: dict = Depends(current_session)) -> dict:
+        if session.get("role") not in roles:
+            raise HTTPException(status_code=403, detail="Forbidden")
+        return session
+    return _dep
@@ -0,0 +1,325 @@
+# backend/app/slots.py
+#
+# Capacity-aware ANC slot allocation.
+#   - facilities: daily_capacity, slot_minutes, open/close time, clinic weekdays
+#   - appointment_slot_load: one row per (facility, clinic day) holding the
+#     day's booked count and per-slot counts. It is the occupancy index: an
+#     allocation reads a handful of these rows, never scans appointments.
+#
+# allocate() picks the least-loaded clinic day in the window (ties go to the
+# day nearest the preferred date), then the least-loaded slot in that day.
+# Candidate rows are taken with FOR UPDATE SKIP LOCKED so concurrent
+# bookings spread over different days instead of queueing on one row; the
+# caller's commit makes the booking and the appointment row atomic.
+#
+# rebuild_load() recomputes the index from appointments (first deploy, or
+# after manual edits):  python -m app.slots --rebuild
+import argparse
+import logging
+import os
+from datetime import date, datetime, time, timedelta
+from typing import List, NamedTuple, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from pydantic import BaseModel, Field
+from sqlalchemy import text, bindparam
+from sqlalchemy.orm import Session
+
+from .db import get_db, engine
+from .identity import TTLCache
+from .session_tokens import require_role
+
+router = APIRouter(prefix="/slots", tags=["slots"])
+log = logging.getLogger("uvicorn.error")
+
+DEFAULT_FACILITY = int(os.getenv("SLOT_DEFAULT_FACILITY", "1"))
+DEFAULT_CAPACITY = int(os.getenv("SLOT_DAILY_CAPACITY", "40"))
+DEFAULT_SLOT_MIN = int(os.getenv("SLOT_MINUTES", "15"))
+# Appointments that hold a slot
+BOOKED_STATUSES = ("scheduled", "rescheduled", "confirmed")
+
+# ---------- Schema ----------
+with engine.begin() as conn:
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS facilities (
+            id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL,
+            daily_capacity INTEGER NOT NULL CHECK (daily_capacity > 0),
+            slot_minutes INTEGER NOT NULL CHECK (slot_minutes > 0),
+            open_time TIME NOT NULL DEFAULT '08:00',
+            close_time TIME NOT NULL DEFAULT '16:00',
+            weekdays SMALLINT[] NOT NULL DEFAULT '{1,2,3,4,5}'   -- ISO: Mon=1 .. Sun=7
+        )
+    """))
+    conn.execute(text("""
+        INSERT INTO facilities (id, name, daily_capacity, slot_minutes)
+        VALUES (:id, 'Main clinic', :cap, :mins)
+        ON CONFLICT (id) DO NOTHING
+    """), {"id": DEFAULT_FACILITY, "cap": DEFAULT_CAPACITY, "mins": DEFAULT_SLOT_MIN})
+    conn.execute(text("SELECT setval(pg_get_serial_sequence('facilities', 'id'), (SELECT max(id) FROM facilities))"))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS appointment_slot_load (
+            facility_id INTEGER NOT NULL REFERENCES facilities(id) ON DELETE CASCADE,
+            day DATE NOT NULL,
+            booked INTEGER NOT NULL DEFAULT 0,
+            slot_counts INTEGER[] NOT NULL DEFAULT '{}',
+            PRIMARY KEY (facility_id, day)
+        )
+    """))
+    # Existing databases; fresh ones get these columns from models.py
+    conn.execute(text("""
+        DO $$
+        BEGIN
+            IF to_regclass('patients') IS NOT NULL THEN
+                ALTER TABLE patients ADD COLUMN IF NOT EXISTS facility_id INTEGER;
+            END IF;
+            IF to_regclass('appointments') IS NOT NULL THEN
+                ALTER TABLE appointments ADD COLUMN IF NOT EXISTS facility_id INTEGER;
+                ALTER TABLE appointments ADD COLUMN IF NOT EXISTS slot_index INTEGER;
+            END IF;
+        END $$
+    """))
+
+# ---------- Facilities ----------
+class Facility(NamedTuple):
+    id: int
+    name: str
+    daily_capacity: int
+    slot_minutes: int
+    open_time: time
+    close_time: time
+    weekdays: List[int]
+
+    @property
+    def n_slots(self) -> int:
+        span = (datetime.combine(date.min, self.close_time)
+                - datetime.combine(date.min, self.open_time)).total_seconds() / 60
+        return max(1, int(span // self.slot_minutes))
+
+    def slot_start(self, day: date, slot_index: int) -> datetime:
+        return datetime.combine(day, self.open_time) + timedelta(minutes=slot_index * self.slot_minutes)
+
+_facilities = TTLCache(maxsize=1024, ttl=60, negative_ttl=60)
+
+def get_facility(db: Session, facility_id: Optional[int] = None) -> Facility:
+    fid = facility_id or DEFAULT_FACILITY
+    found, fac = _facilities.get(fid)
+    if not found:
+        row = db.execute(text("""
+            SELECT id, name, daily_capacity, slot_minutes, open_time, close_time, weekdays
+            FROM facilities WHERE id = :id
+        """), {"id": fid}).first()
+        fac = Facility(*row[:6], list(row.weekdays)) if row else None
+        _facilities.set(fid, fac)
+    if fac is None:
+        if fid != DEFAULT_FACILITY:
+            return get_facility(db, DEFAULT_FACILITY)
+        raise HTTPException(status_code=500, detail="Default facility is not configured")
+    return fac
+
+def facility_for_patient(db: Session, patient_id: int) -> Optional[int]:
+    return db.execute(text("SELECT facility_id FROM patients WHERE id = :pid"),
+                      {"pid": patient_id}).scalar()
+
+# ---------- Allocation ----------
+class Slot(NamedTuple):
+    facility_id: int
+    day: date
+    slot_index: int
+    starts_at: datetime
+
+# Only clinic weekdays, unless the caller asked for one exact date: a row
+# made for an explicit request (or left behind by a weekdays change) must
+# not attract automatic bookings onto a closed day
+_CANDIDATES = """
+    FROM appointment_slot_load
+    WHERE facility_id = :fid AND day BETWEEN :lo AND :hi AND booked < :cap
+      AND (CAST(:exact AS boolean) OR extract(isodow FROM day)::smallint = ANY(:wd))
+"""
+_PICK = """
+    SELECT day, booked, slot_counts
+""" + _CANDIDATES + """
+    ORDER BY booked, abs(day - CAST(:pref AS date)), day
+    LIMIT 1
+    FOR UPDATE {skip}
+"""
+_PICK_SKIP = text(_PICK.format(skip="SKIP LOCKED"))
+_PICK_WAIT = text(_PICK.format(skip=""))
+_HAS_ROOM  = text("SELECT EXISTS (SELECT 1" + _CANDIDATES + ")")
+PICK_ATTEMPTS = 3
+
+def allocate(db: Session, lo: date, hi: date, preferred: Optional[date] = None,
+             facility_id: Optional[int] = None) -> Slot:
+    """
+    Book the least-loaded slot on a clinic day in [lo, hi]. Caller commits
+    (together with the appointment row). 409 if the window is full.
+    A single-day window (an explicitly requested date) is honoured even if
+    it is not one of the facility's clinic weekdays.
+    """
+    fac = get_facility(db, facility_id)
+    preferred = preferred or lo
+    db.execute(text("""
+        INSERT INTO appointment_slot_load (facility_id, day)
+        SELECT :fid, d::date
+        FROM generate_series(CAST(:lo AS date), CAST(:hi AS date), interval '1 day') d
+        WHERE CAST(:exact AS boolean) OR extract(isodow FROM d)::smallint = ANY(:wd)
+        ON CONFLICT (facility_id, day) DO NOTHING
+    """), {"fid": fac.id, "lo": lo, "hi": hi, "wd": fac.weekdays, "exact": lo == hi})
+
+    params = {"fid": fac.id, "lo": lo, "hi": hi, "pref": preferred, "cap": fac.daily_capacity,
+              "wd": fac.weekdays, "exact": lo == hi}
+    row = None
+    for _ in range(PICK_ATTEMPTS):
+        row = db.execute(_PICK_SKIP, params).first()
+        if row is None:
+            # Every free day is being booked right now; wait for one of them
+            row = db.execute(_PICK_WAIT, params).first()
+        # The day we waited on may have filled up meanwhile; only give up
+        # once no day in the window has room left
+        if row is not None or not db.execute(_HAS_ROOM, params).scalar():
+            break
+    if row is None:
+        raise HTTPException(status_code=409, detail=f"No free ANC slots between {lo} and {hi}")
+
+    counts = list(row.slot_counts or [])[:fac.n_slots]
+    counts += [0] * (fac.n_slots - len(counts))
+    idx = min(range(len(counts)), key=counts.__getitem__)
+    counts[idx] += 1
+    db.execute(text("""
+        UPDATE appointment_slot_load
+        SET booked = booked + 1, slot_counts = :counts
+        WHERE facility_id = :fid AND day = :day
+    """), {"fid": fac.id, "day": row.day, "counts": counts})
+    return Slot(fac.id, row.day, idx, fac.slot_start(row.day, idx))
+
+def release(db: Session, facility_id: Optional[int], day: Optional[date], slot_index: Optional[int]):
+    """Give back a slot taken by allocate(). No-op for appointments booked before slots existed."""
+    release_many(db, [(facility_id, day, slot_index)])
+
+def release_many(db: Session, items):
+    """release() for many slots in one statement: items = [(facility_id, day, slot_index)]."""
+    per_slot = {}
+    for fid, day, idx in items:
+        if day is not None and idx is not None:
+            key = (int(fid or DEFAULT_FACILITY), day, int(idx))
+            per_slot[key] = per_slot.get(key, 0) + 1
+    if not per_slot:
+        return
+    keys = sorted(per_slot)
+    db.execute(text("""
+        WITH rel AS (
+            SELECT * FROM unnest(CAST(:fids AS INTEGER[]), CAST(:days AS DATE[]),
+                                 CAST(:idxs AS INTEGER[]), CAST(:ns AS INTEGER[])) AS r(fid, day, idx, n)
+        ), per_day AS (
+            SELECT fid, day, sum(n) AS total FROM rel GROUP BY fid, day
+        )
+        UPDATE appointment_slot_load l
+        SET booked = GREATEST(l.booked - d.total, 0),
+            slot_counts = ARRAY(
+                SELECT GREATEST(s.c - COALESCE(r.n, 0), 0)
+                FROM unnest(l.slot_counts) WITH ORDINALITY AS s(c, i)
+                LEFT JOIN rel r ON r.fid = l.facility_id AND r.day = l.day AND r.idx + 1 = s.i
+                ORDER BY s.i
+            )
+        FROM per_day d
+        WHERE l.facility_id = d.fid AND l.day = d.day
+    """), {"fids": [k[0] for k in keys], "days": [k[1] for k in keys],
+           "idxs": [k[2] for k in keys], "ns": [per_slot[k] for k in keys]})
+
+# ---------- Maintenance ----------
+def rebuild_load(only_facility: Optional[int] = None) -> int:
+    """Recompute appointment_slot_load from booked appointments. Returns rows written."""
+    scope = "AND f.id = :fid" if only_facility else ""
+    with engine.begin() as conn:
+        conn.execute(text("LOCK TABLE appointment_slot_load IN SHARE ROW EXCLUSIVE MODE"))
+        conn.execute(text(
+            "DELETE FROM appointment_slot_load" + (" WHERE facility_id = :fid" if only_facility else "")
+        ), {"fid": only_facility})
+        return conn.execute(text(f"""
+            WITH per_slot AS (
+                SELECT f.id AS facility_id,
+                       COALESCE(a.scheduled_for, a.next_visit)::date AS day,
+                       a.slot_index,
+                       count(*) AS n
+                FROM appointments a
+                JOIN facilities f ON f.id = COALESCE(a.facility_id, :default)
+                WHERE a.status::text IN :booked
+                  AND COALESCE(a.scheduled_for, a.next_visit) IS NOT NULL
+                  {scope}
+                GROUP BY 1, 2, 3
+            ),
+            days AS (
+                SELECT facility_id, day, sum(n) AS booked, max(slot_index) AS max_idx
+                FROM per_slot
+                GROUP BY 1, 2
+            )
+            INSERT INTO appointment_slot_load (facility_id, day, booked, slot_counts)
+            SELECT d.facility_id, d.day, d.booked,
+                   COALESCE((
+                       SELECT array_agg(COALESCE(ps.n, 0)::int ORDER BY i)
+                       FROM generate_series(0, d.max_idx) i
+                       LEFT JOIN per_slot ps
+                         ON ps.facility_id = d.facility_id AND ps.day = d.day AND ps.slot_index = i
+                   ), '{{}}')
+            FROM days d
+        """).bindparams(bindparam("booked", expanding=True)),
+            {"default": DEFAULT_FACILITY, "booked": list(BOOKED_STATUSES), "fid": only_facility}).rowcount
+
+# ---------- Schemas ----------
+class FacilityIn(BaseModel):
+    name: str
+    daily_capacity: int = Field(..., gt=0)
+    slot_minutes: int = Field(..., gt=0, le=240)
+    open_time: time = time(8, 0)
+    close_time: time = time(16, 0)
+    weekdays: List[int] = [1, 2, 3, 4, 5]
+
+class DayLoadOut(BaseModel):
+    day: date
+    booked: int
+    capacity: int
+
+# ---------- Endpoints ----------
+@router.put("/facilities/{facility_id}")
+def upsert_facility(facility_id: int, body: FacilityIn, db: Session = Depends(get_db),
+                    _admin: dict = Depends(require_role("admin"))):
+    from . import versions  # imported late: versions imports this module
+    if body.close_time <= body.open_time:
+        raise HTTPException(status_code=400, detail="close_time must be after open_time")
+    if not body.weekdays or any(d < 1 or d > 7 for d in body.weekdays):
+        raise HTTPException(status_code=400, detail="weekdays must be ISO day numbers 1..7")
+    db.execute(text("""
+        INSERT INTO facilities (id, name, daily_capacity, slot_minutes, open_time, close_time, weekdays)
+        VALUES (:id, :name, :cap, :mins, :open, :close, :wd)
+        ON CONFLICT (id) DO UPDATE
+        SET name = EXCLUDED.name, daily_capacity = EXCLUDED.daily_capacity,
+            slot_minutes = EXCLUDED.slot_minutes, open_time = EXCLUDED.open_time,
+            close_time = EXCLUDED.close_time, weekdays = EXCLUDED.weekdays
+    """), {"id": facility_id, "name": body.name, "cap": body.daily_capacity,
+           "mins": body.slot_minutes, "open": body.open_time, "close": body.close_time,
+           "wd": sorted(set(body.weekdays))})
+    # Calendar LOCATION/DURATION come from this row
+    versions.bump(db, versions.appointments(facility_id))
+    db.commit()
+    _facilities.evict(facility_id)
+    return {"ok": True, "id": facility_id}
+
+@router.get("/load", response_model=List[DayLoadOut])
+def slot_load(start: date = Query(...), end: date = Query(...),
+              facility_id: Optional[int] = Query(None), db: Session = Depends(get_db)):
+    fac = get_facility(db, facility_id)
+    rows = db.execute(text("""
+        SELECT day, booked FROM appointment_slot_load
+        WHERE facility_id = :fid AND day BETWEEN :s AND :e
+        ORDER BY day
+    """), {"fid": fac.id, "s": start, "e": end}).all()
+    return [DayLoadOut(day=r.day, booked=r.booked, capacity=fac.daily_capacity) for r in rows]
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="ANC slot occupancy maintenance")
+    ap.add_argument("--rebuild", action="store_true", help="recompute appointment_slot_load")
+    ap.add_argument("--facility", type=int, default=None)
+    args = ap.parse_args()
+    if args.rebuild:
+        print({"rows": rebuild_load(args.facility)})
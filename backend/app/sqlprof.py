@@ -0,0 +1,259 @@
+# backend/app/sqlprof.py
+#
+# Per-request SQL profiling from SQLAlchemy cursor events.
+#   - install(app) adds a middleware that opens a QueryStats for every
+#     request (a contextvar, which Starlette copies into the threadpool that
+#     runs sync endpoints) and answers with
+#         X-DB-Queries, X-DB-Time-Ms, and X-DB-NPlus1 when flagged.
+#   - The same statement shape run SQL_NPLUS1_MIN or more times in one
+#     request is logged as a possible N+1 (shape = SQL with literals and
+#     IN-lists collapsed, so it also catches queries built by formatting).
+#   - With SQL_EXPLAIN_SLOW_MS > 0, slow SELECTs get a plain EXPLAIN (no
+#     ANALYZE, so nothing runs twice) captured on the same connection.
+#   - GET /debug/sql (admin) shows per-route totals and the worst statements.
+#   - query_budget() lets a test pin how many queries a route may issue:
+#         with query_budget(3, route="/patients/by-email/{email}"):
+#             client.get(f"/patients/by-email/{email}")
+# Queries outside a request (background threads, CLIs) are not recorded.
+import contextlib
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from fastapi import APIRouter, Depends, Request
+from sqlalchemy import event
+
+from .db import engine
+from .session_tokens import require_role
+
+router = APIRouter(prefix="/debug", tags=["debug"])
+log = logging.getLogger("uvicorn.error")
+
+ENABLED      = os.getenv("SQL_PROFILE", "1").lower() in ("1", "true", "yes")
+NPLUS1_MIN   = int(os.getenv("SQL_NPLUS1_MIN", "5"))
+WARN_QUERIES = int(os.getenv("SQL_WARN_QUERIES", "25"))
+EXPLAIN_MS   = float(os.getenv("SQL_EXPLAIN_SLOW_MS", "0"))  # 0 = off
+KEEP_SLOWEST = 5
+
+_current: contextvars.ContextVar = contextvars.ContextVar("sqlprof_stats", default=None)
+_seq = itertools.count()
+
+# ---------- Statement shapes ----------
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\((?:\s*(?:\?|%\([^)]*\)s|%s|:\w+)\s*,?)+\)", re.I)
+_SPACE = re.compile(r"\s+")
+
+def shape(statement: str) -> str:
+    s = _STRING.sub("?", statement)
+    s = _NUMBER.sub("?", s)
+    s = _IN_LIST.sub("IN (...)", s)
+    return _SPACE.sub(" ", s).strip()
+
+# ---------- Stats ----------
+class QueryStats:
+    def __init__(self, route: Optional[str] = None):
+        self.route = route
+        self.path: Optional[str] = None
+        self.count = 0
+        self.seconds = 0.0
+        self._statements: Counter = Counter()
+        self._slowest: List[tuple] = []   # min-heap of (seconds, seq, statement, plan)
+        self._lock = threading.Lock()     # a request can fan out to several threads
+
+    def record(self, statement: str, seconds: float, plan: Optional[str] = None):
+        with self._lock:
+            self.count += 1
+            self.seconds += seconds
+            self._statements[statement] += 1
+            item = (seconds, next(_seq), statement, plan)
+            if len(self._slowest) < KEEP_SLOWEST:
+                heapq.heappush(self._slowest, item)
+            elif seconds > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, item)
+
+    def repeated(self, min_count: int = NPLUS1_MIN) -> Dict[str, int]:
+        """Statement shapes run at least min_count times."""
+        shapes: Counter = Counter()
+        for stmt, n in self._statements.items():  # normalize each distinct string once
+            shapes[shape(stmt)] += n
+        return {s: n for s, n in shapes.items() if n >= min_count}
+
+    def slowest(self) -> List[dict]:
+        return [{"ms": round(sec * 1000, 2), "sql": shape(stmt)[:500], "plan": plan}
+                for sec, _, stmt, plan in sorted(self._slowest, reverse=True)]
+
+    def summary(self) -> dict:
+        return {"route": self.route, "queries": self.count, "db_ms": round(self.seconds * 1000, 2),
+                "nplus1": self.repeated(), "slowest": self.slowest()}
+
+# ---------- Engine events ----------
+def _explain(cursor, statement: str, parameters) -> Optional[str]:
+    if statement.lstrip()[:6].upper() not in ("SELECT", "WITH"):
+        return None
+    try:
+        cur = cursor.connection.cursor()
+        try:
+            # A failing EXPLAIN must not abort the request's transaction
+            cur.execute("SAVEPOINT sqlprof_explain")
+            try:
+                cur.execute("EXPLAIN " + statement, parameters)
+                plan = "\n".join(r[0] for r in cur.fetchall())
+            except Exception:
+                cur.execute("ROLLBACK TO SAVEPOINT sqlprof_explain")
+                raise
+            cur.execute("RELEASE SAVEPOINT sqlprof_explain")
+            return plan
+        finally:
+            cur.close()
+    except Exception as e:
+        return f"EXPLAIN failed: {e}"
+
+@event.listens_for(engine, "before_cursor_execute")
+def _before(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("sqlprof_t0", []).append(time.perf_counter())
+
+@event.listens_for(engine, "after_cursor_execute")
+def _after(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    if stats is None or not conn.info.get("sqlprof_t0"):
+        return
+    elapsed = time.perf_counter() - conn.info["sqlprof_t0"].pop()
+    plan = None
+    if EXPLAIN_MS and elapsed * 1000 >= EXPLAIN_MS and not executemany:
+        plan = _explain(cursor, statement, parameters)
+    stats.record(statement, elapsed, plan)
+
+@event.listens_for(engine, "handle_error")
+def _failed(context):
+    # after_cursor_execute doesn't fire for a failed statement; without this its
+    # start time would stay on the pooled connection and skew every later pop
+    conn = context.connection
+    if conn is None or not conn.info.get("sqlprof_t0"):
+        return
+    elapsed = time.perf_counter() - conn.info["sqlprof_t0"].pop()
+    stats = _current.get()
+    if stats is not None and context.statement:
+        stats.record(context.statement, elapsed, None)  # still a round trip
+
+# ---------- Per-route totals ----------
+class _RouteTotals:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes: Dict[str, dict] = {}
+
+    def add(self, s: QueryStats):
+        with self._lock:
+            r = self._routes.setdefault(s.route, {"requests": 0, "queries": 0, "max_queries": 0,
+                                                  "db_ms": 0.0, "nplus1_requests": 0, "slowest": []})
+            r["requests"] += 1
+            r["queries"] += s.count
+            r["max_queries"] = max(r["max_queries"], s.count)
+            r["db_ms"] += s.seconds * 1000
+            repeated = s.repeated()
+            if repeated:
+                r["nplus1_requests"] += 1
+                r["nplus1_shapes"] = repeated
+            r["slowest"] = sorted(r["slowest"] + s.slowest(), key=lambda x: -x["ms"])[:KEEP_SLOWEST]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {route: {**r, "db_ms": round(r["db_ms"], 2),
+                            "avg_queries": round(r["queries"] / r["requests"], 2)}
+                    for route, r in self._routes.items()}
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+
+totals = _RouteTotals()
+
+# ---------- Budgets ----------
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+_budgets: List[dict] = []
+_budgets_lock = threading.Lock()
+
+@contextlib.contextmanager
+def query_budget(max_queries: int, route: Optional[str] = None):
+    """Fail if any request to `route` (or any request, and queries run directly
+    in this context) issues more than max_queries statements."""
+    budget = {"route": route, "seen": []}
+    direct = QueryStats(route="(direct)")
+    token = _current.set(direct)
+    with _budgets_lock:
+        _budgets.append(budget)
+    try:
+        yield budget["seen"]
+    finally:
+        _current.reset(token)
+        with _budgets_lock:
+            _budgets.remove(budget)
+    over = [s for s in budget["seen"] + ([direct] if direct.count else []) if s.count > max_queries]
+    if over:
+        worst = max(over, key=lambda s: s.count)
+        raise QueryBudgetExceeded(
+            f"{worst.route}: {worst.count} queries > budget {max_queries}; "
+            f"repeated shapes: {worst.repeated(2) or 'none'}")
+
+def _report(stats: QueryStats):
+    if _budgets:
+        with _budgets_lock:
+            for b in _budgets:
+                if b["route"] in (None, stats.route, stats.path):
+                    b["seen"].append(stats)
+
+# ---------- Middleware ----------
+UNMATCHED = "<unmatched>"
+
+def _route_of(request: Request) -> str:
+    # 404s and scanner traffic share one key, so raw paths can't grow the totals
+    route = request.scope.get("route")
+    return getattr(route, "path", None) or UNMATCHED
+
+def install(app):
+    if not ENABLED:
+        return
+
+    @app.middleware("http")
+    async def _sql_profile(request: Request, call_next):
+        stats = QueryStats()
+        token = _current.set(stats)
+        try:
+            response = await call_next(request)
+        finally:
+            _current.reset(token)
+        stats.path = _route_of(request)
+        stats.route = f"{request.method} {stats.path}"
+        response.headers["X-DB-Queries"] = str(stats.count)
+        response.headers["X-DB-Time-Ms"] = f"{stats.seconds * 1000:.1f}"
+        repeated = stats.repeated()
+        if repeated:
+            response.headers["X-DB-NPlus1"] = str(max(repeated.values()))
+            log.warning("[sql] possible N+1 on %s: %s", stats.route,
+                        {s[:120]: n for s, n in repeated.items()})
+        elif stats.count > WARN_QUERIES:
+            log.warning("[sql] %s ran %d queries", stats.route, stats.count)
+        totals.add(stats)
+        _report(stats)
+        return response
+
+# ---------- Endpoint ----------
+@router.get("/sql")
+def sql_profile(_admin: dict = Depends(require_role("admin"))):
+    return {"enabled": ENABLED, "nplus1_min": NPLUS1_MIN, "explain_slow_ms": EXPLAIN_MS,
+            "routes": totals.snapshot()}
+
+@router.delete("/sql")
+def sql_profile_reset(_admin: dict = Depends(require_role("admin"))):
+    totals.clear()
+    return {"ok": True}
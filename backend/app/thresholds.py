@@ -0,0 +1,338 @@
+# backend/app/thresholds.py
+#
+# Threshold what-if analysis and live performance against delivery outcomes.
+#   GET  /thresholds/simulate?t=0.3&t=0.5   flag counts/rates for candidate thresholds
+#   POST /thresholds/outcomes               record GH yes/no per patient (batch)
+#   GET  /thresholds/performance?step=0.05  confusion matrices, recall/precision, ROC
+#
+# Two in-process structures, rebuilt every THRESHOLD_REFRESH_SECONDS by a
+# background thread (start_refresher) and updated in place by this
+# worker's writes:
+#   - ScoreIndex: every patient's latest score as a sorted array, read from
+#     cohort_patient_state (one row per patient, kept current by the
+#     prediction write paths), so the number flagged at any threshold is one
+#     binary search. Writes since the last rebuild sit in a small overlay
+#     that counts() corrects for, so update() is O(1).
+#   - OutcomeMatrix: per-class histograms of the score each labelled patient
+#     had before delivery, on the 1e-4 grid scores are stored at. Reverse
+#     cumulative sums give TP/FP at every threshold at once; a new outcome
+#     moves one count, no rescan.
+# Routed model_pool bundles each have their own threshold, so "current"
+# figures compare every score with the threshold it was classed with.
+import logging
+import os
+import threading
+import time
+from datetime import date
+from typing import Dict, List, Optional
+
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Query
+from pydantic import BaseModel, Field
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .db import get_db, engine, SessionLocal
+from . import model_pool
+
+router = APIRouter(prefix="/thresholds", tags=["thresholds"])
+log = logging.getLogger("uvicorn.error")
+
+REFRESH_SECONDS = int(os.getenv("THRESHOLD_REFRESH_SECONDS", "300"))
+TARGET_RECALL   = float(os.getenv("TARGET_RECALL", "0.90"))  # technical report target
+MAX_OUTCOMES    = int(os.getenv("THRESHOLD_MAX_OUTCOMES", "5000"))
+_RES = 10_000  # bins per unit score; save_prediction rounds to 4 decimals
+
+# np.trapz is deprecated in NumPy 2
+_trapezoid = getattr(np, "trapezoid", None) or np.trapz
+
+# ---------- Schema ----------
+with engine.begin() as conn:
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS gh_outcomes (
+            patient_id INTEGER PRIMARY KEY,
+            gh BOOLEAN NOT NULL,
+            delivered_on DATE,
+            score DOUBLE PRECISION,
+            recorded_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+    """))
+    # threshold_used of the prediction the score came from
+    conn.execute(text("ALTER TABLE gh_outcomes ADD COLUMN IF NOT EXISTS threshold DOUBLE PRECISION"))
+
+def _bin(score: float) -> int:
+    return min(max(int(round(score * _RES)), 0), _RES)
+
+def current_threshold() -> float:
+    """Threshold of the default bundle; see model_pool.thresholds() for routed ones."""
+    b = model_pool.pool.default
+    return b.threshold if b is not None else 0.5
+
+def _flagged(score: float, threshold: Optional[float]) -> bool:
+    return score >= (threshold if threshold is not None else current_threshold())
+
+# ---------- Score index ----------
+class ScoreIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._scores = np.empty(0, dtype=np.float64)  # sorted, as of the last refresh
+        self._base: Dict[int, tuple] = {}             # patient -> (score, flagged), same snapshot
+        self._flagged = 0                             # base patients at/above their own threshold
+        self._pending: Dict[int, tuple] = {}          # patient -> (score, flagged, seq) since then
+        self._seq = 0
+        self._loaded_at = 0.0
+
+    def refresh(self):
+        with self._lock:
+            seq = self._seq
+        with SessionLocal() as db:
+            rows = db.execute(text("""
+                SELECT patient_id, risk_score, threshold FROM cohort_patient_state
+                WHERE risk_score IS NOT NULL
+            """)).all()
+        base = {r.patient_id: (float(r.risk_score), _flagged(r.risk_score, r.threshold)) for r in rows}
+        scores = np.sort(np.fromiter((v[0] for v in base.values()), dtype=np.float64, count=len(base)))
+        flagged = sum(f for _, f in base.values())
+        with self._lock:
+            self._base, self._scores, self._flagged = base, scores, flagged
+            # Writes committed before the SELECT are in the snapshot; later ones
+            # may or may not be, and re-applying them on top is harmless
+            self._pending = {p: v for p, v in self._pending.items() if v[2] > seq}
+            self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        if self._loaded_at:
+            return
+        with self._load_lock:  # the refresher hasn't run yet; load once, not per request
+            if not self._loaded_at:
+                self.refresh()
+
+    def update(self, patient_id: int, score: float, threshold: Optional[float] = None):
+        flagged = _flagged(score, threshold)
+        with self._lock:
+            self._seq += 1
+            self._pending[patient_id] = (score, flagged, self._seq)
+
+    def counts(self, thresholds: List[float]) -> dict:
+        self._ensure_loaded()
+        with self._lock:
+            scores, base, flagged = self._scores, self._base, self._flagged
+            pending = list(self._pending.items())
+        # The snapshot is replaced on refresh, never mutated, so it is safe to read unlocked
+        t = np.asarray(thresholds, dtype=np.float64)[:, None]
+        old = [base[p] for p, _ in pending if p in base]
+        n = len(scores) + len(pending) - len(old)
+        new_scores = np.array([v[0] for _, v in pending], dtype=np.float64)
+        old_scores = np.array([v[0] for v in old], dtype=np.float64)
+        high = (len(scores) - np.searchsorted(scores, t[:, 0], side="left")  # High when score >= t
+                - (old_scores >= t).sum(axis=1) + (new_scores >= t).sum(axis=1))
+        flagged += sum(v[1] for _, v in pending) - sum(v[1] for v in old)
+        items = [{"threshold": float(x), "high": int(h), "low": n - int(h),
+                  "flag_rate": round(int(h) / n, 4) if n else None} for x, h in zip(t[:, 0], high)]
+        return {"patients": n,
+                "current": {"high": flagged, "low": n - flagged,
+                            "flag_rate": round(flagged / n, 4) if n else None},
+                "items": items}
+
+# ---------- Outcomes ----------
+class OutcomeMatrix:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._pos = np.zeros(_RES + 1, dtype=np.int64)
+        self._neg = np.zeros(_RES + 1, dtype=np.int64)
+        self._flag = np.zeros(2, dtype=np.int64)  # positives / negatives at or above their own threshold
+        self._loaded_at = 0.0
+
+    def refresh(self):
+        with SessionLocal() as db:
+            rows = db.execute(text(
+                "SELECT gh, score, threshold FROM gh_outcomes WHERE score IS NOT NULL"
+            )).all()
+        pos = np.zeros(_RES + 1, dtype=np.int64)
+        neg = np.zeros(_RES + 1, dtype=np.int64)
+        flag = np.zeros(2, dtype=np.int64)
+        for r in rows:
+            (pos if r.gh else neg)[_bin(r.score)] += 1
+            flag[0 if r.gh else 1] += _flagged(r.score, r.threshold)
+        with self._lock:
+            self._pos, self._neg, self._flag = pos, neg, flag
+            self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        if self._loaded_at:
+            return
+        with self._load_lock:
+            if not self._loaded_at:
+                self.refresh()
+
+    def apply(self, old: Optional[tuple], new: Optional[tuple]):
+        """Move one patient's (gh, score, threshold) from old to new."""
+        with self._lock:
+            if not self._loaded_at:
+                return
+            for item, sign in ((old, -1), (new, 1)):
+                if item and item[1] is not None:
+                    gh, score, threshold = item
+                    (self._pos if gh else self._neg)[_bin(score)] += sign
+                    self._flag[0 if gh else 1] += sign * _flagged(score, threshold)
+
+    def curves(self, thresholds: np.ndarray) -> dict:
+        self._ensure_loaded()
+        with self._lock:
+            pos, neg, flag = self._pos.copy(), self._neg.copy(), self._flag.copy()
+        # tp[i] / fp[i] = labelled positives / negatives with score >= i / _RES
+        tp_all = np.cumsum(pos[::-1])[::-1]
+        fp_all = np.cumsum(neg[::-1])[::-1]
+        P, N = int(pos.sum()), int(neg.sum())
+        idx = np.clip(np.ceil(thresholds * _RES - 1e-9).astype(int), 0, _RES)
+        tp, fp = tp_all[idx], fp_all[idx]
+        return {"P": P, "N": N, "tp": tp, "fp": fp, "fn": P - tp, "tn": N - fp,
+                "tp_all": tp_all, "fp_all": fp_all,
+                "tp_current": int(flag[0]), "fp_current": int(flag[1])}
+
+score_index = ScoreIndex()
+outcomes = OutcomeMatrix()
+
+def on_prediction(patient_id: int, score: float, threshold: Optional[float] = None):
+    """Called after a prediction is committed, with the threshold it was classed with."""
+    score_index.update(int(patient_id), float(score), None if threshold is None else float(threshold))
+
+def _refresh_loop(interval: int):
+    while True:
+        for name, target in (("scores", score_index), ("outcomes", outcomes)):
+            try:
+                target.refresh()
+            except Exception as e:
+                log.error("[thresholds] %s refresh failed: %s", name, e)
+        time.sleep(interval)
+
+def start_refresher(interval: int = REFRESH_SECONDS):
+    """Keeps both snapshots fresh off the request path (one thread per worker)."""
+    if interval <= 0:
+        return None
+    t = threading.Thread(target=_refresh_loop, args=(interval,), name="thresholds-refresh", daemon=True)
+    t.start()
+    return t
+
+# ---------- Metrics ----------
+def _ratio(a, b):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(b > 0, a / np.maximum(b, 1), np.nan)
+
+def _r(v):
+    return None if v is None or np.isnan(v) else round(float(v), 4)
+
+def performance(step: float) -> dict:
+    grid = np.round(np.arange(0.0, 1.0 + 1e-9, step), 4)
+    c = outcomes.curves(grid)
+    P, N = c["P"], c["N"]
+    recall = _ratio(c["tp"], np.full(len(c["tp"]), P))
+    precision = _ratio(c["tp"], c["tp"] + c["fp"])
+    fpr = _ratio(c["fp"], np.full(len(c["fp"]), N))
+
+    # ROC AUC from the full-resolution curve (every stored score is a threshold)
+    auc = None
+    if P and N:
+        tpr_all = np.concatenate(([0.0], (c["tp_all"] / P)[::-1]))
+        fpr_all = np.concatenate(([0.0], (c["fp_all"] / N)[::-1]))
+        auc = round(float(_trapezoid(tpr_all, fpr_all)), 4)
+
+    # Highest threshold that still meets the recall target
+    recommended = None
+    if P:
+        ok = np.flatnonzero(c["tp_all"] >= TARGET_RECALL * P)
+        if len(ok):
+            recommended = round(int(ok[-1]) / _RES, 4)
+
+    def point(i):
+        return {"threshold": float(grid[i]),
+                "tp": int(c["tp"][i]), "fp": int(c["fp"][i]),
+                "fn": int(c["fn"][i]), "tn": int(c["tn"][i]),
+                "recall": _r(recall[i]), "precision": _r(precision[i]), "fpr": _r(fpr[i])}
+
+    # Each outcome scored against the threshold of the bundle that classed it
+    tp, fp = c["tp_current"], c["fp_current"]
+    current = {"threshold": current_threshold(), "thresholds": model_pool.thresholds(),
+               "tp": tp, "fp": fp, "fn": P - tp, "tn": N - fp,
+               "recall": round(tp / P, 4) if P else None,
+               "precision": round(tp / (tp + fp), 4) if tp + fp else None,
+               "fpr": round(fp / N, 4) if N else None}
+    return {
+        "labelled": P + N, "positives": P, "negatives": N,
+        "target_recall": TARGET_RECALL,
+        "current": {**current, "meets_target": (current["recall"] or 0) >= TARGET_RECALL if P else None},
+        "recommended_threshold": recommended,
+        "auc": auc,
+        "grid": [point(i) for i in range(len(grid))],
+    }
+
+# ---------- Schemas ----------
+class OutcomeIn(BaseModel):
+    patient_id: int
+    gh: bool
+    delivered_on: Optional[date] = None
+
+class OutcomesIn(BaseModel):
+    items: List[OutcomeIn] = Field(..., min_items=1)
+
+# The score that counts is the latest one before delivery (or now, if no date)
+_UPSERT_OUTCOMES = text("""
+    WITH input AS (
+        SELECT * FROM unnest(CAST(:pids AS INTEGER[]), CAST(:ghs AS BOOLEAN[]), CAST(:days AS DATE[]))
+               AS i(patient_id, gh, delivered_on)
+    ), old AS (
+        SELECT o.patient_id, o.gh, o.score, o.threshold FROM gh_outcomes o JOIN input USING (patient_id)
+    ), up AS (
+        INSERT INTO gh_outcomes (patient_id, gh, delivered_on, score, threshold)
+        SELECT i.patient_id, i.gh, i.delivered_on, s.risk_score, s.threshold_used
+        FROM input i
+        JOIN patients p ON p.id = i.patient_id
+        LEFT JOIN LATERAL (
+            SELECT risk_score, threshold_used FROM gh_predictions g
+            WHERE g.patient_id = i.patient_id
+              AND (i.delivered_on IS NULL OR g.created_at < i.delivered_on + 1)
+            ORDER BY g.created_at DESC, g.id DESC
+            LIMIT 1
+        ) s ON TRUE
+        ON CONFLICT (patient_id) DO UPDATE
+        SET gh = EXCLUDED.gh, delivered_on = EXCLUDED.delivered_on,
+            score = EXCLUDED.score, threshold = EXCLUDED.threshold, recorded_at = NOW()
+        RETURNING patient_id, gh, score, threshold
+    )
+    SELECT up.patient_id, up.gh, up.score, up.threshold,
+           old.gh AS old_gh, old.score AS old_score, old.threshold AS old_threshold
+    FROM up LEFT JOIN old USING (patient_id)
+""")
+
+# ---------- Endpoints ----------
+@router.get("/simulate")
+def simulate(t: List[float] = Query(..., description="Candidate thresholds (repeatable)")):
+    if len(t) > 100 or any(not 0.0 <= x <= 1.0 for x in t):
+        raise HTTPException(status_code=400, detail="Up to 100 thresholds in [0, 1]")
+    return {"current_threshold": current_threshold(), "bundle_thresholds": model_pool.thresholds(),
+            **score_index.counts(t)}
+
+@router.post("/outcomes")
+def record_outcomes(body: OutcomesIn, db: Session = Depends(get_db)):
+    items = list({o.patient_id: o for o in body.items}.values())  # last one per patient wins
+    if len(items) > MAX_OUTCOMES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_OUTCOMES} outcomes per request")
+    rows = db.execute(_UPSERT_OUTCOMES, {
+        "pids": [o.patient_id for o in items],
+        "ghs": [o.gh for o in items],
+        "days": [o.delivered_on for o in items],
+    }).all()
+    db.commit()
+    for r in rows:
+        outcomes.apply((r.old_gh, r.old_score, r.old_threshold) if r.old_gh is not None else None,
+                       (r.gh, r.score, r.threshold))
+    saved = {r.patient_id for r in rows}
+    return {"ok": True, "saved": len(rows),
+            "without_prediction": [r.patient_id for r in rows if r.score is None],
+            "unknown_patients": [o.patient_id for o in items if o.patient_id not in saved]}
+
+@router.get("/performance")
+def threshold_performance(step: float = Query(0.05, ge=0.001, le=0.5)):
+    return performance(step)
@@ -0,0 +1,145 @@
+# backend/app/timeline.py
+#
+# One time-ordered feed of everything that happened to a patient:
+#   prediction (gh_predictions), risk (patient_risk), advice (patient_advice),
+#   doctor_advice (doctor_advice), doctor_note (legacy `advice` table, if present),
+#   appointment (appointments, at the visit day).
+#
+# A single UNION ALL query pages through it newest-first with a keyset
+# cursor on (ts, kind, id). Every branch applies the cursor and its own
+# LIMIT against a (patient_id, ts DESC, id DESC) index, so a page reads at
+# most `limit` rows per source however long the record gets; the outer
+# query merges them and keeps `limit`. A statement timeout caps latency.
+import base64
+import json
+import os
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from .db import get_db, engine
+from .fastjson import RowSerializer, json_response, dumps, iso
+
+router = APIRouter(tags=["patients"])
+
+MAX_PAGE = int(os.getenv("TIMELINE_MAX_PAGE", "200"))
+STATEMENT_TIMEOUT_MS = int(os.getenv("TIMELINE_STATEMENT_TIMEOUT_MS", "2000"))
+
+# ---------- Indexes ----------
+with engine.begin() as conn:
+    has_legacy_advice = conn.execute(text("SELECT to_regclass('advice') IS NOT NULL")).scalar()
+    conn.execute(text("""
+        DO $$
+        BEGIN
+            IF to_regclass('patient_advice') IS NOT NULL THEN
+                CREATE INDEX IF NOT EXISTS ix_patient_advice_patient_created
+                    ON patient_advice (patient_id, created_at DESC, id DESC);
+            END IF;
+            IF to_regclass('doctor_advice') IS NOT NULL THEN
+                CREATE INDEX IF NOT EXISTS ix_doctor_advice_patient_created
+                    ON doctor_advice (patient_id, created_at DESC, id DESC);
+            END IF;
+            IF to_regclass('advice') IS NOT NULL THEN
+                CREATE INDEX IF NOT EXISTS ix_advice_patient_created
+                    ON advice (patient_id, created_at DESC, id DESC);
+            END IF;
+            IF to_regclass('appointments') IS NOT NULL THEN
+                CREATE INDEX IF NOT EXISTS ix_appointments_patient_day
+                    ON appointments (patient_id, (COALESCE(scheduled_for, next_visit)) DESC, id DESC);
+            END IF;
+        END $$
+    """))
+
+# ---------- Query ----------
+# (kind, table, ts column/expression, data object). Each kind maps to one
+# table, so (ts, kind, id) is unique and safe as a cursor.
+_SOURCES = [
+    ("risk", "patient_risk", "created_at",
+     "jsonb_build_object('risk_class', risk_class, 'risk_score', risk_score, 'priority', priority)"),
+    ("prediction", "gh_predictions", "created_at",
+     "jsonb_build_object('risk_class', risk_class, 'risk_score', risk_score, "
+     "'priority', priority, 'reasons', reasons)"),
+    ("doctor_advice", "doctor_advice", "created_at", "jsonb_build_object('text', text)"),
+    ("appointment", "appointments", "COALESCE(scheduled_for, next_visit)",
+     "jsonb_build_object('status', status::text, 'last_visit', last_visit, "
+     "'next_visit', next_visit, 'scheduled_for', scheduled_for)"),
+    ("advice", "patient_advice", "created_at", "jsonb_build_object('text', text)"),
+]
+if has_legacy_advice:
+    _SOURCES.append(("doctor_note", "advice", "created_at",
+                     "jsonb_build_object('text', text, 'doctor_id', doctor_id)"))
+
+def _branch(kind: str, table: str, ts: str, data: str, keyset: bool) -> str:
+    where = f"patient_id = :pid AND {ts} IS NOT NULL"
+    if keyset:
+        # The plain range bound is what the index uses; the row comparison
+        # then drops the rows at the cursor timestamp that were already sent.
+        where += (f" AND {ts} <= :cts"
+                  f" AND ({ts}::timestamptz, '{kind}', id::bigint) < (:cts, :ckind, :cid)")
+    return f"""
+        (SELECT {ts}::timestamptz AS ts, '{kind}'::text AS kind, id::bigint AS id,
+                '{table}'::text AS source, {data} AS data
+         FROM {table}
+         WHERE {where}
+         ORDER BY {ts} DESC, id DESC
+         LIMIT :n)"""
+
+def _build(keyset: bool):
+    union = "\n        UNION ALL".join(_branch(*s, keyset=keyset) for s in _SOURCES)
+    return text(f"""
+        SELECT ts, kind, id, source, data FROM ({union}
+        ) t
+        ORDER BY ts DESC, kind DESC, id DESC
+        LIMIT :n
+    """)
+
+_FIRST_PAGE = _build(keyset=False)
+_NEXT_PAGE = _build(keyset=True)
+
+EVENT_ROW = RowSerializer(["ts", "kind", "id", "source", "data"], {"ts": iso})
+
+# ---------- Cursor ----------
+def encode_cursor(ts: datetime, kind: str, id_: int) -> str:
+    raw = json.dumps([ts.isoformat(), kind, id_], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+def decode_cursor(cursor: str):
+    try:
+        ts, kind, id_ = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(ts), str(kind), int(id_)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+# ---------- Endpoint ----------
+@router.get("/patients/{patient_id}/timeline")
+def patient_timeline(
+    patient_id: int,
+    limit: int = Query(50, ge=1),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    db: Session = Depends(get_db),
+):
+    limit = min(limit, MAX_PAGE)
+    params = {"pid": patient_id, "n": limit + 1}  # one extra row says whether there is a next page
+    stmt = _FIRST_PAGE
+    if cursor:
+        params["cts"], params["ckind"], params["cid"] = decode_cursor(cursor)
+        stmt = _NEXT_PAGE
+
+    db.execute(text(f"SET LOCAL statement_timeout = {int(STATEMENT_TIMEOUT_MS)}"))
+    try:
+        rows = db.execute(stmt, params).all()
+    except OperationalError as e:
+        db.rollback()
+        if "statement timeout" in str(e).lower():
+            raise HTTPException(status_code=503, detail="Timeline query timed out; retry")
+        raise
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1].ts, rows[-1].kind, rows[-1].id) if has_more else None
+    body = b'{"items":' + EVENT_ROW.dumps(rows) + b',"next_cursor":' + dumps(next_cursor) + b"}"
+    return json_response(body)
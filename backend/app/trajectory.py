@@ -0,0 +1,170 @@
+# backend/app/trajectory.py
+#
+# GH risk trajectories from gh_predictions:
+#   GET  /gh/trajectory/{patient_id}?points=50   one patient (ETag on the RISK marker)
+#   POST /gh/trajectory                          a worklist of patients, one query
+#
+# Each patient's history comes back from Postgres as two arrays (epoch
+# seconds, score) in a single row, so there is one row per patient rather
+# than one per prediction. Series are downsampled with LTTB (largest
+# triangle three buckets), which keeps peaks and threshold crossings that
+# plain striding would drop. Trend statistics are computed over the full,
+# not the downsampled, series; the slope is vectorized across the whole
+# batch with np.add.reduceat.
+import os
+import time
+from datetime import datetime, timezone
+from typing import List, Optional
+
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from pydantic import BaseModel, Field
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .db import get_db
+from . import versions
+from .fastjson import json_response, dumps
+
+router = APIRouter(prefix="/gh", tags=["gh"])
+
+DEFAULT_POINTS = int(os.getenv("TRAJECTORY_POINTS", "50"))
+RECENT_DAYS    = float(os.getenv("TRAJECTORY_RECENT_DAYS", "28"))
+MAX_BATCH      = int(os.getenv("TRAJECTORY_MAX_BATCH", "500"))
+_WEEK = 7 * 86400.0
+
+_SERIES_SQL = text("""
+    SELECT patient_id,
+           array_agg(extract(epoch FROM created_at)::float8 ORDER BY created_at, id) AS t,
+           array_agg(risk_score ORDER BY created_at, id) AS s,
+           (array_agg(threshold_used ORDER BY created_at DESC, id DESC))[1] AS threshold
+    FROM gh_predictions
+    WHERE patient_id = ANY(:ids)
+    GROUP BY patient_id
+""")
+
+# ---------- Downsampling ----------
+def lttb(t: np.ndarray, s: np.ndarray, n_out: int):
+    """Largest-Triangle-Three-Buckets; returns indices into t/s (first and last always kept)."""
+    n = len(t)
+    if n_out >= n or n_out < 3:
+        return np.arange(n) if n_out >= n else np.unique([0, n - 1])
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)  # n_out-2 inner buckets
+    keep = np.empty(n_out, dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Average of the next bucket (or the last point) is the third vertex
+        nlo, nhi = hi, edges[i + 2] if i + 2 < len(edges) else n
+        ct, cs = t[nlo:nhi].mean(), s[nlo:nhi].mean()
+        bt, bs = t[lo:hi], s[lo:hi]
+        area = np.abs((t[a] - ct) * (bs - s[a]) - (t[a] - bt) * (cs - s[a]))
+        a = lo + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+# ---------- Trend statistics ----------
+def batch_slopes(series) -> np.ndarray:
+    """Least-squares slope (score per week) for every (t, s) pair at once."""
+    lens = np.array([len(t) for t, _ in series])
+    if not len(lens) or not lens.sum():
+        return np.zeros(len(lens))
+    starts = np.concatenate(([0], np.cumsum(lens)[:-1]))
+    t = np.concatenate([t - t[0] for t, _ in series if len(t)]) / _WEEK  # per-patient origin
+    s = np.concatenate([s for _, s in series if len(s)])
+    nz = starts[lens > 0]
+    sum_t, sum_s = np.add.reduceat(t, nz), np.add.reduceat(s, nz)
+    sum_tt, sum_ts = np.add.reduceat(t * t, nz), np.add.reduceat(t * s, nz)
+    n = lens[lens > 0].astype(float)
+    den = n * sum_tt - sum_t ** 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.where(den > 0, (n * sum_ts - sum_t * sum_s) / den, 0.0)
+    out = np.zeros(len(lens))
+    out[lens > 0] = slope
+    return out
+
+def point_stats(t: np.ndarray, s: np.ndarray, threshold: float, now: float) -> dict:
+    last_t, last_s = t[-1], s[-1]
+    # Change over the recent window: against the last score at or before its start
+    j = int(np.searchsorted(t, last_t - RECENT_DAYS * 86400, side="right")) - 1
+    ref = s[max(j, 0)]
+    above = s >= threshold
+    flips = np.flatnonzero(above[1:] != above[:-1])
+    crossed = None
+    if len(flips):
+        k = flips[-1] + 1
+        crossed = {
+            "direction": "up" if above[k] else "down",
+            "at": datetime.fromtimestamp(t[k], timezone.utc).isoformat(),
+            "days_since": round((now - t[k]) / 86400, 1),
+        }
+    return {
+        "n_predictions": int(len(s)),
+        "last_score": round(float(last_s), 4),
+        "min_score": round(float(s.min()), 4),
+        "max_score": round(float(s.max()), 4),
+        "recent_delta": round(float(last_s - ref), 4),
+        "recent_days": RECENT_DAYS,
+        "threshold": round(float(threshold), 4),
+        "above_threshold": bool(last_s >= threshold),
+        "last_crossing": crossed,
+    }
+
+def build_trajectories(db: Session, patient_ids: List[int], points: int,
+                       threshold: Optional[float] = None) -> dict:
+    rows = db.execute(_SERIES_SQL, {"ids": list(patient_ids)}).all()
+    series = {r.patient_id: (np.asarray(r.t, dtype=float), np.asarray(r.s, dtype=float), r.threshold)
+              for r in rows}
+    order = [pid for pid in patient_ids if pid in series]
+    slopes = batch_slopes([series[pid][:2] for pid in order])
+    now = time.time()
+
+    out = {}
+    for pid, slope in zip(order, slopes):
+        t, s, thr_used = series[pid]
+        thr = threshold if threshold is not None else (thr_used if thr_used is not None else 0.5)
+        idx = lttb(t, s, points)
+        stats = point_stats(t, s, thr, now)
+        stats["slope_per_week"] = round(float(slope), 5)
+        out[pid] = {
+            "patient_id": pid,
+            "points": [{"t": datetime.fromtimestamp(t[i], timezone.utc).isoformat(),
+                        "score": round(float(s[i]), 4)} for i in idx],
+            "stats": stats,
+        }
+    return out
+
+# ---------- Schemas ----------
+class TrajectoryBatchIn(BaseModel):
+    patient_ids: List[int] = Field(..., min_items=1)
+    points: int = Field(DEFAULT_POINTS, ge=2, le=1000)
+    threshold: Optional[float] = Field(None, ge=0.0, le=1.0)
+
+# ---------- Endpoints ----------
+@router.get("/trajectory/{patient_id}")
+def patient_trajectory(
+    patient_id: int,
+    request: Request,
+    response: Response,
+    points: int = Query(DEFAULT_POINTS, ge=2, le=1000),
+    threshold: Optional[float] = Query(None, ge=0.0, le=1.0),
+    db: Session = Depends(get_db),
+):
+    cached = versions.check(request, response, db, versions.RISK, patient_id,
+                            f"traj{points}-{threshold if threshold is not None else ''}")
+    if cached:
+        return cached
+    out = build_trajectories(db, [patient_id], points, threshold).get(patient_id)
+    if not out:
+        raise HTTPException(status_code=404, detail="No predictions for this patient")
+    return json_response(dumps(out), response)
+
+@router.post("/trajectory")
+def worklist_trajectories(body: TrajectoryBatchIn, db: Session = Depends(get_db)):
+    ids = list(dict.fromkeys(body.patient_ids))
+    if len(ids) > MAX_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH} patients per request")
+    out = build_trajectories(db, ids, body.points, body.threshold)
+    return json_response(dumps({"items": [out[pid] for pid in ids if pid in out],
+                                "missing": [pid for pid in ids if pid not in out]}))
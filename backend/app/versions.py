@@ -0,0 +1,125 @@
+# backend/app/versions.py
+#
+# Cheap per-patient version markers for conditional GETs.
+# Write paths call bump() inside their own transaction; read endpoints call
+# check() first, which costs one primary-key lookup and answers
+# If-None-Match with a 304 before the real query runs.
+from typing import Optional, Tuple
+
+from fastapi import Request, Response
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .db import engine
+from .slots import DEFAULT_FACILITY
+
+# Scopes (key is a patient id unless noted)
+RISK         = "risk"          # gh_predictions            -> /gh/latest/{id}
+PROFILE      = "profile"       # user/patient + appointments + advice -> /patients/{id}
+ADVICE       = "advice"        # patient_advice            -> /patients/{id}/advice
+APPOINTMENTS = "appointments"  # key facility id: appointment changes there (feeds/exports)
+
+# Scopes whose key is a patient id; a 304 needs the patient to exist
+PATIENT_SCOPES = (RISK, PROFILE, ADVICE)
+
+CACHE_CONTROL = {
+    RISK:         "private, no-cache",
+    PROFILE:      "private, no-cache",
+    ADVICE:       "private, max-age=0, must-revalidate",
+    APPOINTMENTS: "private, no-cache",
+}
+
+with engine.begin() as conn:
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS cache_versions (
+            scope TEXT NOT NULL,
+            key BIGINT NOT NULL,
+            version BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (scope, key)
+        )
+    """))
+
+# ---------- Writes ----------
+def bump(db: Session, *markers: Tuple[str, int]):
+    """bump(db, (RISK, pid), (PROFILE, pid)) -- caller commits."""
+    # Sorted, so two writers touching the same markers lock them in the same order
+    markers = sorted({(s, int(k)) for s, k in markers if k is not None})
+    if not markers:
+        return
+    values = ", ".join(f"(:s{i}, :k{i}, 1)" for i in range(len(markers)))
+    params = {}
+    for i, (s, k) in enumerate(markers):
+        params[f"s{i}"], params[f"k{i}"] = s, k
+    db.execute(text(f"""
+        INSERT INTO cache_versions (scope, key, version)
+        VALUES {values}
+        ON CONFLICT (scope, key) DO UPDATE
+        SET version = cache_versions.version + 1
+    """), params)
+
+def appointments(facility_id: Optional[int]) -> Tuple[str, int]:
+    """Marker for appointment changes at one facility (NULL = the default clinic).
+    One row per facility, so writers at different clinics never share a row lock."""
+    return (APPOINTMENTS, int(facility_id or DEFAULT_FACILITY))
+
+def bump_profile_for_user(db: Session, user_id: int):
+    """Identity fields changed (name/email/phone): invalidate that user's patient profile."""
+    db.execute(text("""
+        INSERT INTO cache_versions (scope, key, version)
+        SELECT :scope, p.id, 1 FROM patients p WHERE p.user_id = :uid
+        ON CONFLICT (scope, key) DO UPDATE
+        SET version = cache_versions.version + 1
+    """), {"scope": PROFILE, "uid": user_id})
+
+# ---------- Reads ----------
+def state(db: Session, scope: str, key: Optional[int]) -> Tuple[bool, int]:
+    """
+    (resource exists, version). key=None sums every key in the scope (the
+    all-facilities feed); versions only grow, so the sum changes whenever
+    any of them does.
+    """
+    if key is None:
+        v = db.execute(text("""
+            SELECT COALESCE(sum(version), 0) FROM cache_versions WHERE scope = :s
+        """), {"s": scope}).scalar()
+        return True, int(v)
+    if scope not in PATIENT_SCOPES:
+        return True, current(db, scope, key)
+    row = db.execute(text("""
+        SELECT EXISTS (SELECT 1 FROM patients WHERE id = :k) AS found,
+               (SELECT version FROM cache_versions WHERE scope = :s AND key = :k) AS version
+    """), {"s": scope, "k": int(key)}).first()
+    return bool(row.found), int(row.version or 0)
+
+def current(db: Session, scope: str, key: int) -> int:
+    v = db.execute(text("""
+        SELECT version FROM cache_versions WHERE scope = :s AND key = :k
+    """), {"s": scope, "k": int(key)}).scalar()
+    return int(v or 0)
+
+def make_etag(scope: str, key: Optional[int], version: int, variant: str = "") -> str:
+    return f'"{scope}-{"all" if key is None else key}-{version}{"-" + variant if variant else ""}"'
+
+def _matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    # If-None-Match uses weak comparison, so W/"x" matches "x"
+    return "*" in tags or etag in (t[2:] if t.startswith("W/") else t for t in tags)
+
+def check(request: Request, response: Response, db: Session,
+          scope: str, key: Optional[int], variant: str = "") -> Optional[Response]:
+    """
+    Set ETag/Cache-Control on `response` and return a ready 304 if the
+    client already holds this version, else None. A missing patient is
+    never a 304 (not even for If-None-Match: *); the endpoint answers it.
+    """
+    exists, version = state(db, scope, key)
+    if not exists:
+        return None
+    etag = make_etag(scope, key, version, variant)
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL.get(scope, "private, no-cache")}
+    if _matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
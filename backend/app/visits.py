@@ -1,4 +1,4 @@
-from datetime import datetime, date, time, timedelta
+from datetime import date, timedelta
 from typing import Optional
 
 from fastapi import APIRouter, Depends, HTTPException, Query
@@ -6,18 +6,17 @@ from pydantic import BaseModel
 from sqlalchemy.orm import Session
 
 from .db import get_db
-from .models import Appointment, Patient, User
+from .models import Appointment, Patient
+from . import cohort, versions, identity, slots
 
 router = APIRouter(prefix="/visits", tags=["visits"])
 
 # ----------------- Helpers -----------------
 
-def get_patient_by_email(db: Session, email: str) -> Optional[Patient]:
-    """Resolve a Patient row from a user email."""
-    user = db.query(User).filter(User.email == email).first()
-    if not user:
-        return None
-    return db.query(Patient).filter(Patient.user_id == user.id).first()
+def get_patient_id_by_email(db: Session, email: str) -> Optional[int]:
+    """Resolve a patient id from a user email (cached, see identity.py)."""
+    ident = identity.by_email(db, email)
+    return ident.patient_id if ident else None
 
 # ----------------- Schemas -----------------
 
@@ -25,10 +24,11 @@ class ScheduleVisitIn(BaseModel):
     patient_id: int
     last_visit: date
     requested_next: Optional[date] = None
+    clinician_id: Optional[int] = None
 
 class RescheduleIn(BaseModel):
     patient_id: int
-    new_date: date
+    new_date: Optional[date] = None   # None: least-loaded day within ±7 days
 
 # ----------------- Endpoints -----------------
 
@@ -45,25 +45,30 @@ def schedule_visit(payload: ScheduleVisitIn, db: Session = Depends(get_db)):
     min_date = payload.last_visit + timedelta(days=21)
     max_date = payload.last_visit + timedelta(days=35)
 
-    # If clinician suggests a date, enforce 3–5 week window; else default to 3 weeks.
+    # If clinician suggests a date, enforce 3–5 week window and book that day;
+    # else take the least-loaded clinic day in the window (ties: earliest).
     if payload.requested_next:
         if not (min_date <= payload.requested_next <= max_date):
             raise HTTPException(status_code=400, detail="Requested next visit outside 3–5 week window")
-        next_visit = payload.requested_next
+        lo = hi = payload.requested_next
     else:
-        next_visit = min_date
-
-    # Pick a default clinic time for calendar convenience (09:00)
-    scheduled_dt = datetime.combine(next_visit, time(9, 0))
+        lo, hi = min_date, max_date
+    slot = slots.allocate(db, lo, hi, preferred=min_date, facility_id=patient.facility_id)
+    next_visit = slot.day
 
     appt = Appointment(
         patient_id=patient.id,
         last_visit=payload.last_visit,
         next_visit=next_visit,
-        scheduled_for=scheduled_dt,
+        scheduled_for=slot.starts_at,
         status="scheduled",
+        facility_id=slot.facility_id,
+        slot_index=slot.slot_index,
+        clinician_id=payload.clinician_id,
     )
     db.add(appt)
+    cohort.on_appointment_change(db, None, None, next_visit, "scheduled")
+    versions.bump(db, (versions.PROFILE, patient.id), versions.appointments(slot.facility_id))
     db.commit()
     db.refresh(appt)
 
@@ -73,6 +78,7 @@ def schedule_visit(payload: ScheduleVisitIn, db: Session = Depends(get_db)):
         "next_visit": appt.next_visit.isoformat(),
         "status": appt.status,
         "scheduled_for": appt.scheduled_for.isoformat(),
+        "slot_time": slot.starts_at.strftime("%H:%M"),
     }
 
 @router.get("/gh/me/next-visit")
@@ -81,13 +87,13 @@ def me_next_visit(email: str = Query(...), db: Session = Depends(get_db)):
     Patient-side: get the most recent (latest) next visit by patient email.
     Returns None if patient or appointment not found.
     """
-    patient = get_patient_by_email(db, email)
-    if not patient:
+    patient_id = get_patient_id_by_email(db, email)
+    if not patient_id:
         return {"next_visit": None}
 
     appt = (
         db.query(Appointment)
-        .filter(Appointment.patient_id == patient.id)
+        .filter(Appointment.patient_id == patient_id)
         .order_by(Appointment.next_visit.desc())
         .first()
     )
@@ -110,6 +116,7 @@ def reschedule(payload: RescheduleIn, db: Session = Depends(get_db)):
         db.query(Appointment)
         .filter(Appointment.patient_id == payload.patient_id)
         .order_by(Appointment.next_visit.desc())
+        .with_for_update()
         .first()
     )
     if not appt:
@@ -119,13 +126,33 @@ def reschedule(payload: RescheduleIn, db: Session = Depends(get_db)):
     min_allowed = current - timedelta(days=7)
     max_allowed = current + timedelta(days=7)
 
-    if not (min_allowed <= payload.new_date <= max_allowed):
+    if payload.new_date and not (min_allowed <= payload.new_date <= max_allowed):
         raise HTTPException(status_code=400, detail="Reschedule must be within ±7 days")
 
-    appt.next_visit = payload.new_date
-    appt.scheduled_for = datetime.combine(payload.new_date, time(9, 0))
+    old_day = cohort.appointment_day(appt.scheduled_for, appt.next_visit)
+    old_status = appt.status
+
+    old_facility = appt.facility_id
+
+    # Free the old slot first so its day is a candidate again
+    slots.release(db, appt.facility_id, old_day, appt.slot_index)
+    if payload.new_date:
+        slot = slots.allocate(db, payload.new_date, payload.new_date, facility_id=appt.facility_id)
+    else:
+        slot = slots.allocate(db, max(min_allowed, date.today()), max_allowed,
+                              preferred=current, facility_id=appt.facility_id)
+
+    appt.next_visit = slot.day
+    appt.scheduled_for = slot.starts_at
+    appt.facility_id = slot.facility_id
+    appt.slot_index = slot.slot_index
+    appt.reminder_sent_at = None   # new day, new reminder
     appt.status = "rescheduled"
+    cohort.on_appointment_change(db, old_day, old_status, slot.day, "rescheduled")
+    versions.bump(db, (versions.PROFILE, appt.patient_id),
+                  versions.appointments(old_facility), versions.appointments(slot.facility_id))
     db.commit()
     db.refresh(appt)
 
-    return {"ok": True, "next_visit": appt.next_visit.isoformat(), "status": appt.status}
+    return {"ok": True, "next_visit": appt.next_visit.isoformat(), "status": appt.status,
+            "slot_time": slot.starts_at.strftime("%H:%M")}
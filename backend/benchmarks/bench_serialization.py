@@ -0,0 +1,109 @@
+# backend/benchmarks/bench_serialization.py
+#
+# Compares the default FastAPI response path (pydantic model per row ->
+# jsonable_encoder -> json.dumps) with app.fastjson's compiled row
+# serializer for the shapes served by /patients, /patients/{id}/advice
+# and /gh/latest/{id}. No database needed: rows are synthesized.
+#
+#   cd backend && python benchmarks/bench_serialization.py --rows 200
+import argparse
+import json
+import os
+import sys
+import timeit
+from datetime import datetime, timezone, timedelta
+from typing import List, Optional
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+
+from app.fastjson import RowSerializer, iso, to_str, to_float, to_bool
+
+
+# Mirrors of the response models in app.patients / app.gh_predict
+# (importing those modules would open a DB connection).
+class PatientRow(BaseModel):
+    id: int
+    full_name: Optional[str] = None
+    email: Optional[str] = None
+    phone_number: Optional[str] = None
+    next_visit: Optional[str] = None
+    appt_status: Optional[str] = None
+
+class AdviceOut(BaseModel):
+    id: int
+    patient_id: int
+    text: str
+    created_at: str
+
+class PredictOut(BaseModel):
+    risk_score: float
+    risk_class: str
+    threshold_used: float
+    priority: Optional[bool] = False
+    reasons: Optional[List[str]] = []
+    created_at: Optional[str] = None
+
+
+PATIENT_ROW = RowSerializer(["id", "full_name", "email", "phone_number", "next_visit", "appt_status"],
+                            {"appt_status": to_str})
+ADVICE_ROW  = RowSerializer(["id", "patient_id", "text", "created_at"], {"created_at": iso})
+LATEST_OUT  = RowSerializer(["risk_score", "risk_class", "threshold_used", "priority", "reasons", "created_at"],
+                            {"risk_score": to_float, "threshold_used": to_float, "priority": to_bool,
+                             "created_at": iso}, by_name=True)
+
+
+def _default_path(model, dicts) -> bytes:
+    # What FastAPI does for response_model=List[model]
+    objs = [model(**d) for d in dicts]
+    return json.dumps(jsonable_encoder(objs)).encode("utf-8")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=200)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--number", type=int, default=200)
+    args = ap.parse_args()
+
+    now = datetime.now(timezone.utc)
+    cols = PATIENT_ROW.fields
+    patient_rows = [
+        (i, f"Patient {i}", f"p{i}@example.org", f"+2547000{i:05d}",
+         (now + timedelta(days=i % 35)).strftime("%Y-%m-%d"), "scheduled")
+        for i in range(args.rows)
+    ]
+    advice_rows = [(i, 1, "Reduce salt intake and rest on your left side. " * 3, now - timedelta(hours=i))
+                   for i in range(args.rows)]
+    latest = {"risk_score": 0.4213, "risk_class": "High", "threshold_used": 0.26, "priority": True,
+              "reasons": ["SBP ≥ 140 (148)", "BMI ≥ 35 (36.2)"], "created_at": now}
+
+    cases = {
+        f"/patients ({args.rows} rows)": (
+            lambda: _default_path(PatientRow, [dict(zip(cols, r)) for r in patient_rows]),
+            lambda: PATIENT_ROW.dumps(patient_rows),
+        ),
+        f"/patients/{{id}}/advice ({args.rows} rows)": (
+            lambda: _default_path(AdviceOut, [
+                {"id": r[0], "patient_id": r[1], "text": r[2], "created_at": r[3].isoformat()}
+                for r in advice_rows]),
+            lambda: ADVICE_ROW.dumps(advice_rows),
+        ),
+        "/gh/latest/{id} (1 row)": (
+            lambda: json.dumps(jsonable_encoder(PredictOut(
+                **dict(latest, created_at=latest["created_at"].isoformat())))).encode("utf-8"),
+            lambda: LATEST_OUT.dumps_one(latest),
+        ),
+    }
+
+    print(f"{'endpoint':36s} {'default µs':>12s} {'fast µs':>10s} {'speedup':>8s}")
+    for name, (slow, fast) in cases.items():
+        t_slow = min(timeit.repeat(slow, number=args.number, repeat=args.repeat)) / args.number
+        t_fast = min(timeit.repeat(fast, number=args.number, repeat=args.repeat)) / args.number
+        print(f"{name:36s} {t_slow * 1e6:12.1f} {t_fast * 1e6:10.1f} {t_slow / t_fast:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# backend/tests/conftest.py
+#
+# Run from backend/:  pytest -q
+# Tests that need Postgres use the `database` / `db_app` fixtures. They run
+# only against TEST_DATABASE_URL (a throwaway database: tests clear tables
+# such as notification_outbox) and are skipped when it is unset or down.
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# Set before any app module is imported
+os.environ.setdefault("SECRET_KEY", "test-secret-key")
+os.environ.setdefault("FIREBASE_PROJECT_ID", "demo-test")
+os.environ.setdefault("LOG_PIPELINE", "0")
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+if TEST_DATABASE_URL:
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+
+
+@pytest.fixture(scope="session")
+def database():
+    """The app's engine, bound to TEST_DATABASE_URL."""
+    if not TEST_DATABASE_URL:
+        pytest.skip("set TEST_DATABASE_URL to run database tests")
+    pytest.importorskip("psycopg2")
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+
+    from app.db import Base, engine
+    from app import models  # noqa: F401  (registers users/patients tables)
+
+    try:
+        Base.metadata.create_all(bind=engine)
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except OperationalError as e:
+        pytest.skip(f"test database unreachable: {e}")
+    return engine
+
+
+@pytest.fixture(scope="session")
+def db_app(database):
+    """The FastAPI app on the test database. Startup hooks (background
+    threads) don't run: tests use TestClient without a `with` block."""
+    try:
+        from app.main import app
+    except RuntimeError as e:  # e.g. no model artifacts in ml_model/
+        pytest.skip(f"app can't start here: {e}")
+    return app
@@ -0,0 +1,155 @@
+# backend/tests/test_outbox.py
+#
+# Outbox delivery against a stub SMTP transport: rows are queued in the
+# test database and Sender.process_batch() delivers them through fake
+# sessions whose behaviour is scripted per recipient.
+import smtplib
+from email.message import EmailMessage
+
+import pytest
+from sqlalchemy import text
+
+
+class FakeServer:
+    def __init__(self, script, delivered):
+        self.script, self.delivered = script, delivered
+        self.closed = False
+
+    def send_message(self, msg):
+        outcomes = self.script.get(msg["To"])
+        if outcomes:
+            exc = outcomes.pop(0)
+            if exc is not None:
+                raise exc
+        self.delivered.append(msg["To"])
+
+    def noop(self):
+        return (250, b"OK")
+
+    def quit(self):
+        self.closed = True
+
+    close = quit
+
+
+class StubTransport:
+    """Stands in for notifications.transport."""
+    dev_dir = None
+
+    def __init__(self, script=None, connect_error=None):
+        self.script = script or {}
+        self.connect_error = connect_error
+        self.delivered, self.connects = [], 0
+
+    def connect(self):
+        self.connects += 1
+        if self.connect_error is not None:
+            raise self.connect_error
+        return FakeServer(self.script, self.delivered)
+
+    @staticmethod
+    def build(to_email, subject, body, html=None):
+        msg = EmailMessage()
+        msg["To"], msg["Subject"] = to_email, subject
+        msg.set_content(body or "")
+        return msg
+
+
+@pytest.fixture
+def outbox(database):
+    from app import outbox
+    with database.begin() as conn:
+        conn.execute(text("DELETE FROM notification_outbox"))
+    return outbox
+
+
+def _queue(database, outbox, *emails):
+    from app.db import SessionLocal
+    with SessionLocal() as db:
+        ids = [outbox.enqueue(db, e, "ANC reminder", "See you tomorrow", kind="test") for e in emails]
+        db.commit()
+    return ids
+
+def _rows(database, ids):
+    with database.connect() as conn:
+        rows = conn.execute(text("""
+            SELECT id, status, attempts, last_error FROM notification_outbox WHERE id = ANY(:ids)
+        """), {"ids": ids}).mappings().all()
+    return {r["id"]: r for r in rows}
+
+def _make_due(database, ids):
+    with database.begin() as conn:
+        conn.execute(text("UPDATE notification_outbox SET next_attempt_at = NOW() WHERE id = ANY(:ids)"),
+                     {"ids": ids})
+
+
+def test_sent(database, outbox):
+    ids = _queue(database, outbox, "a@example.com", "b@example.com")
+    transport = StubTransport()
+    sender = outbox.Sender(transport, workers=1)
+
+    assert sender.process_batch() == 2
+    rows = _rows(database, ids)
+    assert [rows[i]["status"] for i in ids] == ["sent", "sent"]
+    assert sorted(transport.delivered) == ["a@example.com", "b@example.com"]
+    assert transport.connects == 1  # one pooled session for the whole batch
+
+
+def test_retried_then_sent(database, outbox):
+    (mid,) = _queue(database, outbox, "flaky@example.com")
+    transport = StubTransport({"flaky@example.com": [smtplib.SMTPServerDisconnected("gone")]})
+    sender = outbox.Sender(transport, workers=1)
+
+    sender.process_batch()
+    row = _rows(database, [mid])[mid]
+    assert row["status"] == "pending"
+    assert row["attempts"] == 1
+    assert "SMTPServerDisconnected" in row["last_error"]
+    assert sender.process_batch() == 0  # backing off, not due yet
+
+    _make_due(database, [mid])
+    assert sender.process_batch() == 1
+    row = _rows(database, [mid])[mid]
+    assert row["status"] == "sent"
+    assert row["attempts"] == 2
+    assert transport.connects == 2  # the suspect session was discarded
+
+
+def test_refused_recipient_fails_permanently(database, outbox):
+    bad, good = _queue(database, outbox, "nobody@example.com", "ok@example.com")
+    refused = smtplib.SMTPRecipientsRefused({"nobody@example.com": (550, b"no such user")})
+    transport = StubTransport({"nobody@example.com": [refused]})
+
+    outbox.Sender(transport, workers=1).process_batch()
+    rows = _rows(database, [bad, good])
+    assert rows[bad]["status"] == "failed"
+    assert rows[bad]["attempts"] == 1
+    assert rows[bad]["last_error"].startswith("RECIPIENT_REFUSED")
+    assert rows[good]["status"] == "sent"
+
+
+def test_exhausted_retries_fail(database, outbox, monkeypatch):
+    monkeypatch.setattr(outbox, "MAX_ATTEMPTS", 2)
+    (mid,) = _queue(database, outbox, "down@example.com")
+    transport = StubTransport({"down@example.com": [smtplib.SMTPDataError(451, b"try later")] * 2})
+    sender = outbox.Sender(transport, workers=1)
+
+    sender.process_batch()
+    _make_due(database, [mid])
+    sender.process_batch()
+    row = _rows(database, [mid])[mid]
+    assert row["status"] == "failed"
+    assert row["attempts"] == 2
+
+
+def test_connect_failure_reschedules_rest_of_batch(database, outbox):
+    ids = _queue(database, outbox, *[f"p{i}@example.com" for i in range(5)])
+    transport = StubTransport(connect_error=RuntimeError("NETWORK_ERROR: timed out"))
+
+    assert outbox.Sender(transport, workers=1).process_batch() == 5
+    assert transport.connects == 1  # not once per row
+    rows = _rows(database, ids).values()
+    assert all(r["status"] == "pending" for r in rows)
+    assert all("CONNECT" in r["last_error"] for r in rows)
+    # Only the row that tried to connect used up an attempt
+    assert sorted(r["attempts"] for r in rows) == [0, 0, 0, 0, 1]
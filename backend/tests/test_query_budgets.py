@@ -0,0 +1,92 @@
+# backend/tests/test_query_budgets.py
+#
+# Pins how many SQL statements the hot read/write routes may issue, using
+# sqlprof.query_budget(). A failure names the route, the count and any
+# statement shape that repeated (the usual N+1 signature).
+import uuid
+
+import pytest
+from sqlalchemy import text
+
+from app import sqlprof
+
+PREDICT_BODY = {
+    "age": 31, "bmi": 27.5, "systolic_bp": 128, "diastolic_bp": 84,
+    "previous_complications": 0, "preexisting_diabetes": 0,
+    "gestational_diabetes": 1, "mental_health": 0, "heart_rate": 88,
+}
+
+
+@pytest.fixture(scope="module")
+def client(db_app):
+    TestClient = pytest.importorskip("fastapi.testclient").TestClient
+    return TestClient(db_app)
+
+
+@pytest.fixture
+def patient(database):
+    """A fresh user + patient; returns (patient_id, email)."""
+    email = f"budget-{uuid.uuid4().hex[:12]}@example.com"
+    with database.begin() as conn:
+        uid = conn.execute(text("""
+            INSERT INTO users (email, full_name, role) VALUES (:em, 'Budget Test', 'patient')
+            RETURNING id
+        """), {"em": email}).scalar()
+        pid = conn.execute(text("INSERT INTO patients (user_id) VALUES (:uid) RETURNING id"),
+                           {"uid": uid}).scalar()
+    yield pid, email
+    with database.begin() as conn:
+        conn.execute(text("DELETE FROM users WHERE id = :uid"), {"uid": uid})
+
+
+def test_patient_by_email(client, patient):
+    _, email = patient
+    route = "/patients/by-email/{email}"
+    # Cold: identity lookup + profile, appointment and advice
+    with sqlprof.query_budget(4, route=route) as seen:
+        assert client.get(f"/patients/by-email/{email}").status_code == 200
+    assert len(seen) == 1
+    # Warm: the identity comes from the cache
+    with sqlprof.query_budget(3, route=route):
+        assert client.get(f"/patients/by-email/{email}").status_code == 200
+
+
+def test_predict_gh(client, patient):
+    pid, _ = patient
+    route = "/gh/predict-gh"
+    # Prediction row, cohort state (insert, then update on a repeat), counter
+    # stripe, cache version, and the read-back of created_at
+    for _ in range(2):
+        with sqlprof.query_budget(6, route=route) as seen:
+            r = client.post("/gh/predict-gh", json={**PREDICT_BODY, "patient_id": pid})
+        assert r.status_code == 200, r.text
+        assert r.json()["created_at"]
+        assert len(seen) == 1
+    # Without a patient nothing is saved
+    with sqlprof.query_budget(0, route=route):
+        assert client.post("/gh/predict-gh", json=PREDICT_BODY).status_code == 200
+
+
+def test_dashboard_patient(client, patient):
+    pid, email = patient
+    route = "/dashboard/patient/{key}"
+    # Profile, appointment, risk and advice in a single statement, by id or email
+    for key in (str(pid), email):
+        with sqlprof.query_budget(1, route=route) as seen:
+            assert client.get(f"/dashboard/patient/{key}").status_code == 200
+        assert len(seen) == 1
+
+
+def test_unmatched_paths_share_one_route_key(client):
+    with sqlprof.query_budget(0, route=sqlprof.UNMATCHED) as seen:
+        client.get("/no/such/path/1")
+        client.get("/no/such/path/2")
+    assert [s.path for s in seen] == [sqlprof.UNMATCHED] * 2
+
+
+def test_failed_statement_leaves_no_start_time(database):
+    from sqlalchemy.exc import ProgrammingError
+    with sqlprof.query_budget(5) as seen, database.connect() as conn:
+        with pytest.raises(ProgrammingError):
+            conn.execute(text("SELECT * FROM no_such_table_sqlprof"))
+        assert not conn.info.get("sqlprof_t0")
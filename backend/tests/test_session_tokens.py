@@ -0,0 +1,150 @@
+# backend/tests/test_session_tokens.py
+#
+# Firebase ID tokens signed with a locally generated RSA key (no network),
+# injected into FirebaseVerifier through fetch_certs; then the HMAC session
+# tokens issued from the verified claims.
+import time
+
+import pytest
+from fastapi import HTTPException
+
+rsa = pytest.importorskip("cryptography.hazmat.primitives.asymmetric.rsa")
+serialization = pytest.importorskip("cryptography.hazmat.primitives.serialization")
+gcrypt = pytest.importorskip("google.auth.crypt")
+gjwt = pytest.importorskip("google.auth.jwt")
+
+from app import session_tokens  # noqa: E402
+from app.session_tokens import FirebaseVerifier, issue, verify  # noqa: E402
+
+PROJECT = "demo-test"
+KID = "test-key-1"
+
+
+@pytest.fixture(scope="module")
+def key_pair():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()).decode("ascii")
+    public_pem = key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo).decode("ascii")
+    return private_pem, public_pem
+
+
+@pytest.fixture
+def verifier(key_pair):
+    fetches = []
+
+    def fetch_certs():
+        fetches.append(time.time())
+        return {KID: key_pair[1]}, 3600.0
+
+    v = FirebaseVerifier(project_id=PROJECT, fetch_certs=fetch_certs)
+    v.fetches = fetches
+    return v
+
+
+def id_token(private_pem: str, kid: str = KID, **overrides) -> str:
+    now = int(time.time())
+    claims = {
+        "iss": f"https://securetoken.google.com/{PROJECT}",
+        "aud": PROJECT,
+        "sub": "firebase-uid-123",
+        "auth_time": now - 10,
+        "iat": now - 10,
+        "exp": now + 3600,
+        "email": "patient@example.com",
+    }
+    claims.update(overrides)
+    signer = gcrypt.RSASigner.from_string(private_pem, key_id=kid)
+    return gjwt.encode(signer, claims).decode("ascii")
+
+
+def _tamper(token: str) -> str:
+    head, _, sig = token.rpartition(".")
+    return f"{head}.{('A' if sig[0] != 'A' else 'B')}{sig[1:]}"
+
+
+# ---------- Firebase ID tokens ----------
+def test_id_token_round_trip_and_claims_cache(verifier, key_pair):
+    token = id_token(key_pair[0])
+    claims = verifier.verify(token)
+    assert claims["uid"] == "firebase-uid-123"
+    assert claims["email"] == "patient@example.com"
+    # Second call is served from the claims cache; certs fetched once
+    assert verifier.verify(token) == claims
+    assert len(verifier.fetches) == 1
+
+
+def test_id_token_expired(verifier, key_pair):
+    now = int(time.time())
+    token = id_token(key_pair[0], iat=now - 7200, auth_time=now - 7200, exp=now - 3600)
+    with pytest.raises(ValueError):
+        verifier.verify(token)
+
+
+def test_id_token_tampered_signature(verifier, key_pair):
+    with pytest.raises(ValueError):
+        verifier.verify(_tamper(id_token(key_pair[0])))
+
+
+def test_id_token_wrong_audience_and_issuer(verifier, key_pair):
+    with pytest.raises(ValueError):
+        verifier.verify(id_token(key_pair[0], aud="other-project"))
+    with pytest.raises(ValueError):
+        verifier.verify(id_token(key_pair[0], iss="https://securetoken.google.com/other-project"))
+
+
+def test_unknown_kid_refetches_certs_once(verifier, key_pair):
+    with pytest.raises(ValueError):
+        verifier.verify(id_token(key_pair[0], kid="rotated-away"))
+    assert len(verifier.fetches) == 2
+
+
+# ---------- Session tokens ----------
+def test_session_round_trip(verifier, key_pair):
+    claims = verifier.verify(id_token(key_pair[0]))
+    token, exp = issue(42, "patient", patient_id=7)
+    payload = verify(token)
+    assert payload["sub"] == 42
+    assert payload["role"] == "patient"
+    assert payload["pid"] == 7
+    assert payload["exp"] == exp > time.time()
+    assert claims["uid"]  # issued only after a verified ID token
+
+
+def test_session_expired():
+    token, _ = issue(42, "patient", ttl=-1)
+    with pytest.raises(HTTPException) as e:
+        verify(token)
+    assert e.value.status_code == 401
+
+
+def test_session_tampered_signature_and_payload():
+    token, _ = issue(42, "patient")
+    with pytest.raises(HTTPException) as e:
+        verify(_tamper(token))
+    assert e.value.status_code == 401
+
+    # Re-encoded payload claiming admin, original signature
+    body, sig = token.split(".")
+    forged = session_tokens._b64e(session_tokens._b64d(body).replace(b'"patient"', b'"admin"'))
+    with pytest.raises(HTTPException):
+        verify(f"{forged}.{sig}")
+
+
+def test_require_role():
+    token, _ = issue(1, "clinician")
+    dep = session_tokens.require_role("admin")
+    with pytest.raises(HTTPException) as e:
+        dep(session=verify(token))
+    assert e.value.status_code == 403
+    assert session_tokens.require_role("clinician", "admin")(session=verify(token))["sub"] == 1
+
+
+def test_capability_is_bound_to_its_purpose():
+    token = session_tokens.capability("calendar:f3cp")
+    assert session_tokens.check_capability("calendar:f3cp", token)
+    assert not session_tokens.check_capability("calendar:f4cp", token)
+    assert not session_tokens.check_capability("calendar:f3cp", None)
+    assert not session_tokens.check_capability("calendar:f3cp", _tamper(token))
@@ -197,27 +197,12 @@ export default function ClinicianDashboard(){
       const pid = await resolvePatientId(lookup.trim())
       if (!pid) { alert('Patient not found'); setOverviewLoading(false); return }
 
-      // 1) base profile (NOTE: correct path is /patients/:id — not /patients/by-id/:id)
-      const prof = await api.get(`/patients/${pid}`)
-      const profile = prof?.data || {}
-      const email = profile?.email || null
-      const advice = Array.isArray(profile?.advice) ? profile.advice : []
-
-      // 2) latest prediction (same endpoint used by PatientDashboard)
-      let prediction = null
-      try{
-        const pr = await api.get(`/gh/latest/${pid}`)
-        prediction = pr?.data ?? null
-      }catch(_){}
-
-      // 3) ANC schedule (same endpoint as patient flow, needs email)
-      let visit = null
-      if (email){
-        try{
-          const vr = await api.get('/visits/gh/me/next-visit', { params: { email } })
-          visit = vr?.data ?? null // { next_visit: 'YYYY-MM-DD', status? }
-        }catch(_){}
-      }
+      // profile + latest prediction + ANC schedule + advice in one call (advice_limit=0: full history)
+      const { data } = await api.get(`/dashboard/patient/${pid}`, { params: { advice_limit: 0 } })
+      const email = data?.profile?.email || null
+      const prediction = data?.risk ?? null
+      const visit = data?.appointment ?? null // { next_visit: 'YYYY-MM-DD', status? }
+      const advice = Array.isArray(data?.advice) ? data.advice : []
 
       setOverview({
         email,
@@ -14,37 +14,8 @@ function getEmail(){
   }catch{ return null }
 }
 
-// --- unified resolver (matches clinician flow) ---
-async function resolvePatientId(term){
-  if (!term) return null
-  const q = term.trim()
-  // 1) primary: server resolver (handles email OR id; same path clinician uses)
-  try{
-    const r = await api.get('/patients/resolve', { params: { q } })
-    if (r?.data?.id) return r.data.id
-  }catch(_){}
-
-  // 2) exact email fallback
-  if (q.includes('@')){
-    try{
-      const r = await api.get(`/patients/by-email/${encodeURIComponent(q)}`)
-      if (r?.data?.id) return r.data.id
-    }catch(_){}
-  }
-
-  // 3) last resort: search list and pick exact match by email
-  try{
-    const r = await api.get('/patients', { params: { q } })
-    const rows = Array.isArray(r?.data) ? r.data : []
-    const s = q.toLowerCase()
-    const exact = rows.find(p => (p?.email || '').toLowerCase() === s)
-    return exact?.id ?? null
-  }catch(_){}
-
-  return null
-}
-
 export default function PatientDashboard(){
+  const [patientId, setPatientId] = useState(null)
   const [nextVisit, setNextVisit] = useState(null)
   const [advice, setAdvice] = useState([])
   const [loadingAdvice, setLoadingAdvice] = useState(true)
@@ -57,46 +28,32 @@ export default function PatientDashboard(){
   const name = getDisplayName() || 'Patient'
   const email = getEmail()
 
-  async function loadNextVisit(){
-    try{
-      if (!email) return
-      const {data} = await api.get('/visits/gh/me/next-visit', { params: { email } })
-      setNextVisit(data?.next_visit || null)
-    }catch{ setNextVisit(null) }
-  }
-
-  async function loadAdvice(){
-    try{
-      if (!email) return
-      setLoadingAdvice(true)
-      const { data } = await api.get(`/patients/by-email/${encodeURIComponent(email)}`)
-      setAdvice(data?.advice || [])
-    }catch{ setAdvice([]) }
-    finally{ setLoadingAdvice(false) }
-  }
-
-  // load the latest saved GH prediction for THIS patient
-  async function loadRisk(){
+  // one round trip: profile + latest appointment + latest risk + recent advice
+  async function loadDashboard(){
+    setLoadingAdvice(true)
     setRiskLoading(true)
     setRiskError('')
     try{
-      if (!email) { setRisk(null); return }
-      const pid = await resolvePatientId(email)
-      if (!pid){ setRisk(null); return }
-      const { data } = await api.get(`/gh/latest/${pid}`)
-      setRisk(data || null)
+      if (!email) { setRisk(null); setAdvice([]); return }
+      // advice_limit=0: the whole advice history, as the profile endpoint returned before
+      const { data } = await api.get(`/dashboard/patient/${encodeURIComponent(email)}`, {
+        params: { advice_limit: 0 },
+      })
+      setPatientId(data?.profile?.id ?? null)
+      setNextVisit(data?.appointment?.next_visit || null)
+      setAdvice(data?.advice || [])
+      setRisk(data?.risk || null)
     }catch(e){
-      // if backend says 404, treat as "no prediction yet" instead of error banner
-      const status = e?.response?.status
-      if (status === 404){
-        setRisk(null)
-        setRiskError('')
-      }else{
-        setRisk(null)
+      // 404 means no patient profile yet: show empty panels, not an error banner
+      setRisk(null)
+      setAdvice([])
+      setNextVisit(null)
+      if (e?.response?.status !== 404){
         const msg = e?.response?.data?.detail || e?.message || 'Failed to load your latest risk'
         setRiskError(msg)
       }
     }finally{
+      setLoadingAdvice(false)
       setRiskLoading(false)
     }
   }
@@ -104,14 +61,13 @@ export default function PatientDashboard(){
   async function reschedule(){
     try{
       if (!email) return alert('No email found for your account')
-      const { data: me } = await api.get(`/patients/by-email/${encodeURIComponent(email)}`)
-      const pid = me?.id
+      const pid = patientId
       if (!pid) return alert('Could not resolve your patient profile')
 
       const val = prompt('Pick a new date (YYYY-MM-DD) within 7 days of current plan:', nextVisit || '')
       if (!val) return
       await api.post('/visits/reschedule', { patient_id: pid, new_date: val })
-      await loadNextVisit()
+      await loadDashboard()
       alert('Rescheduled successfully')
     }catch(e){
       const msg = e?.response?.data?.detail
@@ -121,7 +77,7 @@ export default function PatientDashboard(){
     }
   }
 
-  useEffect(()=>{ loadNextVisit(); loadAdvice(); loadRisk() },[]) // run once
+  useEffect(()=>{ loadDashboard() },[]) // run once
 
   const badge = r => r==='High'
     ? 'badge high'